@@ -0,0 +1,213 @@
+# server/benchmarks/benchmark.py
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+STAGES = ["extraction", "chunking", "embedding", "upsert", "retrieval", "generation", "writing"]
+
+
+class StageRecorder:
+    """Wall time, item throughput and peak traced memory per pipeline stage."""
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, dict] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        result = {"items": 0}
+        if self.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield result
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else 0
+            if self.trace_memory:
+                tracemalloc.stop()
+            self.stages[name] = {
+                "seconds": elapsed,
+                "items": result["items"],
+                "items_per_second": result["items"] / elapsed if elapsed else 0.0,
+                "peak_memory_mb": peak / 2 ** 20,
+            }
+            print(f"[Benchmark] {name:<11} {elapsed:8.2f}s  {result['items']:>9} items  {peak / 2 ** 20:8.1f} MB peak")
+
+
+def _install_fakes(args, workdir: str):
+    from server.utils import client_pool
+    from server.benchmarks.fake_services import (
+        ServiceProfile, FakeEmbeddingClient, FakeAsyncEmbeddingClient, FakeAsyncChatClient
+    )
+
+    os.environ.update({
+        "VECTOR_BACKEND": "local",
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vectors"),
+        "EMBEDDING_CACHE": "0",
+        "LLM_CACHE": "0",
+        "QUERY_CACHE_PATH": os.path.join(workdir, "query_cache.sqlite"),
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "fake-embedding",
+        "AZURE_OPENAI_CHAT_DEPLOYMENT": "fake-chat",
+    })
+
+    embedding_profile = ServiceProfile(
+        latency=args.embedding_latency, per_item_latency=args.embedding_item_latency,
+        requests_per_minute=args.embedding_rpm, error_rate=args.error_rate, seed=1
+    )
+    chat_profile = ServiceProfile(
+        latency=args.chat_latency, per_item_latency=0.0005,
+        requests_per_minute=args.chat_rpm, error_rate=args.error_rate, seed=2
+    )
+
+    client_pool.reset()
+    client_pool.set_client("embedding", FakeEmbeddingClient(embedding_profile, dim=args.dim))
+    client_pool.set_client("async_embedding", FakeAsyncEmbeddingClient(embedding_profile, dim=args.dim))
+    client_pool.set_client("async_chat", FakeAsyncChatClient(chat_profile))
+    return {"embedding": embedding_profile, "chat": chat_profile}
+
+
+def run_benchmark(args, fi_rows: int) -> dict:
+    from server.benchmarks.synthetic_data import generate_files
+
+    workdir = tempfile.mkdtemp(prefix=f"dfmea_bench_{fi_rows}_", dir=args.workdir)
+    print(f"\n[Benchmark] {fi_rows:,} field-issue rows in {workdir}")
+    kb_path, fi_path = generate_files(os.path.join(workdir, "data"), fi_rows, seed=args.seed)
+    profiles = _install_fakes(args, workdir)
+
+    from server.utils import telemetry
+    telemetry.enable()
+    telemetry.REGISTRY.reset()
+
+    # Imported after the environment is prepared so agents pick up the stand-ins
+    from server.agents.extraction_agent import ExtractionAgent
+    from server.agents.chunking_agent import ChunkingAgent
+    from server.agents.embedding_agent import EmbeddingAgent
+    from server.agents.vectorstore_agent import VectorStoreAgent
+    from server.agents.context_agent import ContextAgent
+    from server.agents.writer_agent import WriterAgent
+
+    recorder = StageRecorder(trace_memory=not args.no_memory)
+
+    with recorder.stage("extraction") as stage:
+        extractor = ExtractionAgent(kb_path, fi_path)
+        kb_data = extractor.load_knowledge_bank()
+        fi_data = extractor.load_field_issues()
+        stage["items"] = len(kb_data) + len(fi_data)
+
+    with recorder.stage("chunking") as stage:
+        chunks = ChunkingAgent().run(kb_data, fi_data)
+        stage["items"] = len(chunks)
+    del kb_data, fi_data
+
+    with recorder.stage("embedding") as stage:
+        embedder = EmbeddingAgent(use_cache=False)
+        embedder.cooldown = 0
+        embedded = embedder.embed_chunks(chunks, use_async=not args.sync_embedding)
+        stage["items"] = len(embedded)
+    del chunks
+
+    with recorder.stage("upsert") as stage:
+        vectorstore = VectorStoreAgent(collection_name=f"bench_{fi_rows}")
+        vectorstore.create_collection(len(embedded[0]["embedding"]))
+        vectorstore.add_embeddings(embedded, batch_limit=args.upsert_batch)
+        stage["items"] = len(embedded)
+    del embedded
+
+    queries = [f"Generate DFMEA entries for {p} display failures" for p in ("TC57", "TC52", "ET40", "MC9300")]
+    with recorder.stage("retrieval") as stage:
+        # Distinct queries, so the query-vector cache does not hide the embedding round trip
+        for i in range(args.queries):
+            vectorstore.search(queries[i % len(queries)] + f" #{i}", top_k=args.top_k)
+        stage["items"] = args.queries
+
+    with recorder.stage("generation") as stage:
+        context = ContextAgent(collection_name=vectorstore.collection_name, use_cache=False)
+        entries = context.run(query=queries[0], top_k=args.top_k)
+        stage["items"] = len(entries)
+
+    with recorder.stage("writing") as stage:
+        writer = WriterAgent(
+            output_path=os.path.join(workdir, "output", "dfmea_output.xlsx"),
+            json_dump_path=os.path.join(workdir, "output", "raw_dfmea_output.json")
+        )
+        writer.run(entries)
+        stage["items"] = len(entries)
+
+    if not args.keep:
+        vectorstore.delete_collection()
+
+    return {
+        "rows": fi_rows,
+        "stages": recorder.stages,
+        "services": {name: profile.stats() for name, profile in profiles.items()},
+        "metrics": {k: v for k, v in telemetry.export_run_report().items() if k != "spans"},
+        "total_seconds": sum(s["seconds"] for s in recorder.stages.values()),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return a message for every stage that got slower than baseline by more than tolerance."""
+    regressions = []
+    previous = {run["rows"]: run for run in baseline.get("runs", [])}
+    for run in report["runs"]:
+        base = previous.get(run["rows"])
+        if not base:
+            continue
+        for name, stats in run["stages"].items():
+            before = base["stages"].get(name, {}).get("seconds")
+            if before and stats["seconds"] > before * (1 + tolerance):
+                regressions.append(f"{run['rows']:,} rows / {name}: {before:.2f}s -> {stats['seconds']:.2f}s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline DFMEA pipeline benchmark against local stand-ins.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000], help="Field-issue row counts, e.g. 1000 100000 1000000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--upsert-batch", type=int, default=500)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--embedding-item-latency", type=float, default=0.001)
+    parser.add_argument("--embedding-rpm", type=int, default=0, help="0 = unlimited")
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--chat-rpm", type=int, default=0, help="0 = unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--sync-embedding", action="store_true")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc (it slows Python-heavy stages)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--keep", action="store_true", help="Keep the local collection after the run")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", default=None, help="Previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "runs": []}
+    for rows in args.rows:
+        report["runs"].append(run_benchmark(args, rows))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n[Benchmark] Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"[Benchmark] REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# server/utils/cache.py
+
+import os
+import time
+import sqlite3
+import json
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk cache of embedding vectors.
+
+    Keys are sha256(deployment + text), values are float32 blobs. Once the
+    cache grows past max_entries the least recently used rows are evicted.
+    With memory_items > 0 an in-process LRU sits in front of the database.
+    """
+
+    _QUERY_CHUNK = 500  # Stay well under SQLite's bound-parameter limit
+
+    def __init__(self, path: str = None, max_entries: int = None, memory_items: int = 0):
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+        self.max_entries = int(max_entries or os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500_000))
+        self.memory_items = memory_items
+        self._memory: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_accessed ON embeddings(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, deployment: str) -> str:
+        return hashlib.sha256(f"{deployment}\x00{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        # float32 numpy vectors are already in blob layout
+        if hasattr(vector, "tobytes") and getattr(vector, "itemsize", 0) == 4:
+            return vector.tobytes()
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def _remember(self, key: str, vector: List[float]):
+        if not self.memory_items:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts: List[str], deployment: str) -> List[Optional[List[float]]]:
+        keys = [self.make_key(text, deployment) for text in texts]
+        found = {}
+        now = time.time()
+
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            missing = [key for key in keys if key not in found]
+
+            for i in range(0, len(missing), self._QUERY_CHUNK):
+                key_batch = missing[i:i + self._QUERY_CHUNK]
+                placeholders = ",".join("?" * len(key_batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", key_batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._decode(blob)
+                    self._remember(key, found[key])
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET accessed = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows]
+                    )
+            if missing:
+                self._conn.commit()
+
+        vectors = [found.get(key) for key in keys]
+        hits = sum(1 for v in vectors if v is not None)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def get(self, text: str, deployment: str) -> Optional[List[float]]:
+        return self.get_many([text], deployment)[0]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], deployment: str):
+        now = time.time()
+        rows = [(self.make_key(text, deployment), self._encode(vec), now) for text, vec in zip(texts, vectors)]
+        with self._lock:
+            for (key, _, _), vec in zip(rows, vectors):
+                self._remember(key, list(vec))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self._evict()
+
+    def put(self, text: str, vector: List[float], deployment: str):
+        self.put_many([text], [vector], deployment)
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Trim to 90% of capacity so we don't evict on every subsequent insert
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY accessed ASC LIMIT ?)", (excess,)
+        )
+        self._conn.commit()
+        self.evictions += excess
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._memory.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    On-disk cache of parsed LLM responses.
+
+    Keys cover everything that determines the completion: deployment,
+    temperature, a hash of the system prompt and the exact user message.
+    Entries expire after ttl_seconds (0 disables expiry) and the least
+    recently used rows are evicted beyond max_entries.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None, ttl_seconds: float = None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+        self.max_entries = int(max_entries or os.getenv("LLM_CACHE_MAX_ENTRIES", 20_000))
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else os.getenv("LLM_CACHE_TTL_SECONDS", 0))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(deployment: str, temperature: float, system_msg: str, user_msg: str) -> str:
+        system_hash = hashlib.sha256(system_msg.encode("utf-8")).hexdigest()
+        material = json.dumps([deployment, temperature, system_hash, user_msg], ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._conn.commit()
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl_seconds:
+            expired = self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)).rowcount
+            self.evictions += max(expired, 0)
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            excess = count - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)", (excess,)
+            )
+            self.evictions += excess
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
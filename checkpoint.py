@@ -0,0 +1,145 @@
+# server/utils/checkpoint.py
+
+import os
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from server.utils.embedding_matrix import EmbeddingMatrix
+from server.utils import telemetry
+
+logger = telemetry.get_logger("Checkpoint")
+
+
+class RunCheckpoint:
+    """
+    Per-run directory of stage outputs, so a failed run can be resumed by
+    run ID without redoing finished work:
+
+        manifest.json           completed stages and small values (collection name, output path)
+        chunks.jsonl.gz         chunking output
+        embeddings.npy          float32 embedding matrix
+        embeddings.jsonl.gz     its metadata table (text, metadata, tokens)
+        retrieval/<key>.json.gz retrieved matches per query
+        batches/<key>.json      parsed entries per completed LLM batch
+    """
+
+    def __init__(self, run_id: Optional[str] = None, root_dir: Optional[str] = None):
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.root_dir = root_dir or os.getenv("DFMEA_RUN_DIR", ".runs")
+        self.path = os.path.join(self.root_dir, self.run_id)
+        os.makedirs(os.path.join(self.path, "retrieval"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "batches"), exist_ok=True)
+        self._lock = threading.Lock()
+        self.manifest = self._read_manifest()
+
+    def _file(self, *parts: str) -> str:
+        return os.path.join(self.path, *parts)
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _replace(tmp: str, path: str):
+        # Files appear complete or not at all, even if the process dies mid-write
+        os.replace(tmp, path)
+
+    # -- manifest ----------------------------------------------------------
+
+    def _read_manifest(self) -> Dict:
+        path = self._file("manifest.json")
+        if not os.path.isfile(path):
+            return {"run_id": self.run_id, "created": time.time(), "stages": {}, "values": {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        tmp = self._file("manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        self._replace(tmp, self._file("manifest.json"))
+
+    def done(self, stage: str) -> bool:
+        return stage in self.manifest["stages"]
+
+    def mark_done(self, stage: str, **values):
+        with self._lock:
+            self.manifest["stages"][stage] = time.time()
+            self.manifest["values"].update(values)
+            self._write_manifest()
+        logger.info(f"Run {self.run_id}: stage '{stage}' checkpointed.")
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.manifest["values"].get(name, default)
+
+    def set(self, **values):
+        with self._lock:
+            self.manifest["values"].update(values)
+            self._write_manifest()
+
+    # -- chunks and embeddings ---------------------------------------------
+
+    def _write_jsonl(self, name: str, records: Iterable[Dict]):
+        tmp = self._file(f"{name}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=3) as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        self._replace(tmp, self._file(name))
+
+    def _read_jsonl(self, name: str) -> List[Dict]:
+        with gzip.open(self._file(name), "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def save_chunks(self, chunks: List[Dict]):
+        self._write_jsonl("chunks.jsonl.gz", chunks)
+        self.mark_done("chunking", chunk_count=len(chunks))
+
+    def load_chunks(self) -> List[Dict]:
+        return self._read_jsonl("chunks.jsonl.gz")
+
+    def save_embeddings(self, embedded: EmbeddingMatrix):
+        tmp = self._file("embeddings.npy.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(embedded.vectors, dtype=np.float32))
+        self._replace(tmp, self._file("embeddings.npy"))
+        self._write_jsonl("embeddings.jsonl.gz", embedded.records)
+        self.mark_done("embedding", embedding_count=len(embedded))
+
+    def load_embeddings(self) -> EmbeddingMatrix:
+        vectors = np.load(self._file("embeddings.npy"), mmap_mode="r")
+        return EmbeddingMatrix(vectors, self._read_jsonl("embeddings.jsonl.gz"))
+
+    # -- retrieval and generation ------------------------------------------
+
+    def load_retrieval(self, key: str) -> Optional[List[Dict]]:
+        path = self._file("retrieval", f"{key}.json.gz")
+        if not os.path.isfile(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_retrieval(self, key: str, matches: List[Dict]):
+        path = self._file("retrieval", f"{key}.json.gz")
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=3) as f:
+            json.dump(matches, f, default=lambda v: v.tolist() if hasattr(v, "tolist") else str(v))
+        self._replace(tmp, path)
+
+    def load_batch(self, key: str) -> Optional[List[Dict]]:
+        path = self._file("batches", f"{key}.json")
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_batch(self, key: str, entries: List[Dict]):
+        path = self._file("batches", f"{key}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        self._replace(tmp, path)
@@ -1,46 +1,298 @@
 # server/agents/chunking_agent.py
 
+import os
+import re
 import uuid
-import tiktoken
 import warnings
+from collections import Counter
+from datetime import date, datetime
+from functools import lru_cache
 from tqdm import tqdm
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
+from server.utils.tokenizer import get_encoder, encode_batch
+from server.utils.dedup import NearDuplicateIndex
+from server.utils import telemetry
+
+logger = telemetry.get_logger("ChunkingAgent")
+
+# Fixed namespace so chunk IDs are stable across runs and machines
+CHUNK_NAMESPACE = uuid.UUID("6f1c5d2e-8a43-4b7e-9c1d-2f0e5a7b3c91")
+
+# Columns that identify a single report rather than describe the failure
+DEDUP_IGNORE_COLUMNS = "issue_id,id,reported_date,date,site,serial_number"
+ROW_ID_COLUMNS = ("issue_id", "id")
+
+# Aggregate mode: the first of these headers present is the report date
+DATE_COLUMNS = ("reported_date", "report_date", "date_reported", "reported_on", "issue_date",
+                "failure_date", "created_date", "date")
+
+# Aggregate mode: one summary chunk per group of these field-issue columns
+AGGREGATE_GROUP_COLUMNS = "product,part_category,fault_code"
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d.%m.%Y", "%Y/%m/%d")
+
+# Source columns copied into chunk metadata as indexed filter fields (the KB's
+# "Function" column holds the subsystem)
+FILTER_COLUMNS = {
+    "product": "product", "productname": "product", "model": "product",
+    "subsystem": "subsystem", "function": "subsystem",
+    "faultcode": "fault_code", "errorcode": "fault_code",
+}
+
+
+@lru_cache(maxsize=4096)
+def _normalize_column(name) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
 
 class ChunkingAgent:
-    def __init__(self, max_tokens=1500, overlap=100, model_name="text-embedding-ada-002"):
-        self.encoder = tiktoken.encoding_for_model(model_name)
+    def __init__(self, max_tokens=1500, overlap=100, model_name="text-embedding-ada-002",
+                 encode_batch_size=2048, num_threads=None, field_issue_mode=None, dedup_threshold=None):
+        self.model_name = model_name
+        self.encoder = get_encoder(model_name)
         self.max_tokens = max_tokens
         self.overlap = overlap
+        self.encode_batch_size = encode_batch_size
+        self.num_threads = num_threads
+
+        # "rows": one chunk per field issue; "dedup": one chunk per cluster of near-duplicates;
+        # "aggregate": one statistical chunk per product/part_category/fault_code group
+        self.field_issue_mode = (field_issue_mode or os.getenv("FIELD_ISSUE_MODE", "rows")).lower()
+        self.dedup_threshold = dedup_threshold or float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+        self.ignore_columns = {
+            c.strip().lower() for c in os.getenv("DEDUP_IGNORE_COLUMNS", DEDUP_IGNORE_COLUMNS).split(",") if c.strip()
+        }
+        self.group_columns = [
+            c.strip() for c in os.getenv("AGGREGATE_GROUP_COLUMNS", AGGREGATE_GROUP_COLUMNS).split(",") if c.strip()
+        ]
+        self.example_comments = int(os.getenv("AGGREGATE_EXAMPLE_COMMENTS", "3"))
+        self.top_fault_types = int(os.getenv("AGGREGATE_TOP_FAULT_TYPES", "3"))
 
         warnings.filterwarnings("ignore", category=UserWarning)
 
     def run(self, kb_data: List[Dict], fi_data: List[Dict]) -> List[Dict]:
-        print(f"[ChunkingAgent] Chunking knowledge bank...")
-        kb_chunks = self._create_chunks(kb_data, source="knowledge_bank")
+        with telemetry.span("chunking") as span:
+            logger.info("Chunking knowledge bank...")
+            kb_chunks = self._create_chunks(kb_data, source="knowledge_bank")
 
-        print(f"[ChunkingAgent] Chunking field-reported issues...")
-        fi_chunks = self._create_chunks(fi_data, source="field_issues")
+            logger.info("Chunking field-reported issues...")
+            fi_chunks = self._field_issue_chunks(fi_data)
 
-        all_chunks = kb_chunks + fi_chunks
-        print(f"[ChunkingAgent] Merged into {len(all_chunks)} smart chunks before token slicing.")
+            all_chunks = kb_chunks + fi_chunks
+            logger.info(f"Merged into {len(all_chunks)} smart chunks before token slicing.")
 
-        sliced_chunks = self._token_slice_chunks(all_chunks)
-        return sliced_chunks
+            with telemetry.span("tokenization"):
+                sliced_chunks = self._token_slice_chunks(all_chunks)
+            span["rows"] = len(kb_data) + len(fi_data)
+            span["chunks"] = len(sliced_chunks)
+            return sliced_chunks
+
+    def stream(self, kb_rows: Iterable[Dict], fi_rows: Iterable[Dict], batch_size: int = 500) -> Iterator[List[Dict]]:
+        """Chunk and token-slice rows as they arrive, yielding bounded batches of chunks."""
+        for source, rows in (("knowledge_bank", kb_rows), ("field_issues", fi_rows)):
+            if source == "field_issues" and self.field_issue_mode != "rows":
+                # Clusters are only final once every row has been seen
+                chunks = self._field_issue_chunks(rows)
+                for i in range(0, len(chunks), batch_size):
+                    yield self._slice_batch(chunks[i:i + batch_size])
+                continue
+
+            buffer = []
+            for row in rows:
+                chunk = self._make_chunk(row, source)
+                if chunk:
+                    buffer.append(chunk)
+                if len(buffer) >= batch_size:
+                    yield self._slice_batch(buffer)
+                    buffer = []
+            if buffer:
+                yield self._slice_batch(buffer)
 
     def _create_chunks(self, data: List[Dict], source: str) -> List[Dict]:
         chunks = []
         for row in data:
-            text = self._format_row_as_text(row)
-            if text.strip():
-                chunks.append({
-                    "text": text,
-                    "metadata": {
-                        "uuid": str(uuid.uuid4()),
-                        "source": source
-                    }
-                })
+            chunk = self._make_chunk(row, source)
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def _field_issue_chunks(self, rows: Iterable[Dict]) -> List[Dict]:
+        if self.field_issue_mode == "rows":
+            return self._create_chunks(rows, source="field_issues")
+        if self.field_issue_mode == "dedup":
+            return self._collapse_duplicates(rows)
+        if self.field_issue_mode == "aggregate":
+            return self._aggregate_groups(rows)
+        raise ValueError(f"Unsupported field_issue_mode: {self.field_issue_mode}")
+
+    def _collapse_duplicates(self, rows: Iterable[Dict]) -> List[Dict]:
+        """
+        Collapse exact and near-duplicate field issues into one representative
+        chunk per cluster, carrying the occurrence count and source row IDs.
+        Rows are only compared within the same filter fields and part
+        category, so a cluster never mixes products or fault codes and
+        filtered retrieval keeps every occurrence.
+        """
+        indexes: Dict[tuple, NearDuplicateIndex] = {}
+        block_clusters: Dict[tuple, List[int]] = {}  # block -> positions in clusters
+        clusters = []  # (representative text, source row IDs, filter fields)
+        row_count = 0
+        for row_no, row in enumerate(rows, 1):
+            text = self._format_row_as_text(
+                {k: v for k, v in row.items() if str(k).strip().lower() not in self.ignore_columns}
+            )
+            if not text.strip():
+                continue
+            row_count += 1
+            filter_fields = self._filter_metadata(row)
+            part_category = next(
+                (str(v).strip().lower() for k, v in row.items() if _normalize_column(k) == "partcategory" and v), ""
+            )
+            block = tuple(sorted(filter_fields.items())) + (part_category,)
+            if block not in indexes:
+                indexes[block] = NearDuplicateIndex(threshold=self.dedup_threshold)
+                block_clusters[block] = []
+            cluster = indexes[block].add(text)
+            if cluster == len(block_clusters[block]):
+                block_clusters[block].append(len(clusters))
+                clusters.append((text, [], filter_fields))
+            clusters[block_clusters[block][cluster]][1].append(self._row_id(row, row_no))
+
+        chunks = []
+        for text, row_ids, filter_fields in clusters:
+            chunk = self._new_chunk(f"{text} | occurrence_count: {len(row_ids)}", "field_issues")
+            chunk["metadata"].update(filter_fields)
+            chunk["metadata"]["occurrence_count"] = len(row_ids)
+            chunk["metadata"]["source_row_ids"] = row_ids
+            chunks.append(chunk)
+
+        logger.info(f"Collapsed {row_count} field-issue rows into {len(chunks)} representative chunks.")
+        telemetry.incr("chunking.fi_rows_collapsed", row_count - len(chunks))
+        return chunks
+
+    def _aggregate_groups(self, rows: Iterable[Dict]) -> List[Dict]:
+        """
+        Summarize field issues per group (product, part_category, fault_code
+        by default): report count and share, date range, most frequent fault
+        types and a few example comments. Only per-group state is kept, so
+        the input can be streamed.
+        """
+        groups = {}
+        columns = None
+        total = 0
+        for row in rows:
+            if columns is None:
+                columns = self._resolve_columns(row)
+            key = tuple(str(row.get(columns[name], "") or "").strip() for name in self.group_columns)
+            if not any(key):
+                continue
+            total += 1
+
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {"count": 0, "first": None, "last": None, "fault_types": Counter(), "examples": []}
+            group["count"] += 1
+
+            reported = self._parse_date(row.get(columns["date"])) if columns["date"] else None
+            if reported:
+                group["first"] = min(group["first"] or reported, reported)
+                group["last"] = max(group["last"] or reported, reported)
+
+            fault_type = str(row.get(columns["fault_type"], "") or "").strip() if columns["fault_type"] else ""
+            if fault_type:
+                group["fault_types"][fault_type] += 1
+
+            comment = str(row.get(columns["comments"], "") or "").strip() if columns["comments"] else ""
+            if comment and len(group["examples"]) < self.example_comments and comment not in group["examples"]:
+                group["examples"].append(comment)
+
+        chunks = []
+        for key, group in sorted(groups.items(), key=lambda item: -item[1]["count"]):
+            parts = [f"{name}: {value}" for name, value in zip(self.group_columns, key) if value]
+            parts.append(f"occurrence_count: {group['count']}")
+            parts.append(f"share_of_field_issues: {group['count'] / total:.2%}")
+            if group["first"]:
+                parts.append(f"date_range: {group['first'].isoformat()} to {group['last'].isoformat()}")
+            if group["fault_types"]:
+                top = group["fault_types"].most_common(self.top_fault_types)
+                parts.append("top_fault_types: " + ", ".join(f"{name} ({count})" for name, count in top))
+            if group["examples"]:
+                parts.append("example_comments: " + " / ".join(group["examples"]))
+
+            chunk = self._new_chunk(" | ".join(parts), "field_issues")
+            chunk["metadata"]["occurrence_count"] = group["count"]
+            chunk["metadata"].update({name: value for name, value in zip(self.group_columns, key) if value})
+            chunk["metadata"].update(self._filter_metadata(dict(zip(self.group_columns, key))))
+            chunks.append(chunk)
+
+        logger.info(f"Aggregated {total} field-issue rows into {len(chunks)} summary chunks.")
+        telemetry.incr("chunking.fi_rows_collapsed", total - len(chunks))
         return chunks
 
+    def _resolve_columns(self, row: Dict) -> Dict[str, str]:
+        # Exports vary in case and separators ("Part Category", "part_category")
+        by_norm = {_normalize_column(k): k for k in row}
+
+        def find(*names):
+            return next((by_norm[_normalize_column(n)] for n in names if _normalize_column(n) in by_norm), None)
+
+        columns = {name: find(name) or name for name in self.group_columns}
+        columns["date"] = find(*DATE_COLUMNS)
+        columns["fault_type"] = find("fault_type", "failure_mode", "symptom")
+        columns["comments"] = find("comments", "comment", "description")
+        return columns
+
+    @staticmethod
+    def _parse_date(value):
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        text = str(value or "").strip()[:10]
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(text, fmt).date()
+            except ValueError:
+                continue
+        return None
+
+    @staticmethod
+    def _row_id(row: Dict, row_no: int) -> str:
+        for key, value in row.items():
+            if str(key).strip().lower() in ROW_ID_COLUMNS and value not in (None, ""):
+                return str(value).strip()
+        return str(row_no)
+
+    def _make_chunk(self, row: Dict, source: str):
+        text = self._format_row_as_text(row)
+        if not text.strip():
+            return None
+        chunk = self._new_chunk(text, source)
+        chunk["metadata"].update(self._filter_metadata(row))
+        if source == "knowledge_bank":
+            # Lets MergeAgent report which KB row a generated cause matched
+            kb_id = self._row_id(row, "")
+            if kb_id:
+                chunk["metadata"]["kb_id"] = kb_id
+        return chunk
+
+    @staticmethod
+    def _filter_metadata(row: Dict) -> Dict[str, str]:
+        fields = {}
+        for key, value in row.items():
+            field = FILTER_COLUMNS.get(_normalize_column(key))
+            if field and field not in fields and value not in (None, "") and str(value).strip():
+                fields[field] = str(value).strip()
+        return fields
+
+    def _new_chunk(self, text: str, source: str) -> Dict:
+        return {
+            "text": text,
+            "metadata": {
+                "uuid": str(uuid.uuid5(CHUNK_NAMESPACE, f"{source}\x1f{text}")),
+                "source": source
+            }
+        }
+
     def _format_row_as_text(self, row: Dict) -> str:
         return " | ".join(
             f"{k.strip()}: {str(v).strip()}"
@@ -49,34 +301,63 @@ class ChunkingAgent:
         )
 
     def _token_slice_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        """
+        Tokenize chunks once, in multi-threaded batches, and attach the token
+        count to every resulting chunk as "tokens" so embedding and rate
+        limiting never re-encode the text.
+        """
         sliced_chunks = []
         total_tokens = 0  # Initialize a counter to accumulate total tokens
 
-        for chunk in tqdm(chunks, desc="[ChunkingAgent] Token slicing"):
-            tokens = self.encoder.encode(chunk["text"])
-            total_tokens += len(tokens)  # Accumulate the number of tokens for this chunk
+        progress = tqdm(total=len(chunks), desc="[ChunkingAgent] Token slicing")
+        for i in range(0, len(chunks), self.encode_batch_size):
+            batch = chunks[i:i + self.encode_batch_size]
+            sliced = self._slice_batch(batch)
+            sliced_chunks.extend(sliced)
+            total_tokens += sum(chunk["tokens"] for chunk in sliced)  # Accumulate the number of tokens for this batch
+            progress.update(len(batch))
+        progress.close()
 
-            if len(tokens) <= self.max_tokens:
-                sliced_chunks.append(chunk)
-                continue
+        logger.info(f"Tokens sliced into {len(sliced_chunks)} total chunks.")
+        logger.info(f"Total tokens across all chunks: {total_tokens}")  # Print the total token count
+        telemetry.incr("chunking.chunks", len(sliced_chunks))
+        telemetry.incr("chunking.tokens", total_tokens)
 
-            start = 0
-            while start < len(tokens):
-                end = min(start + self.max_tokens, len(tokens))
-                token_slice = tokens[start:end]
-                text_slice = self.encoder.decode(token_slice)
+        return sliced_chunks
 
-                sliced_chunks.append({
-                    "text": text_slice,
-                    "metadata": chunk["metadata"]
-                })
+    def _slice_batch(self, batch: List[Dict]) -> List[Dict]:
+        batch_tokens = encode_batch([chunk["text"] for chunk in batch], self.model_name, self.num_threads)
+        sliced = []
+        for chunk, tokens in zip(batch, batch_tokens):
+            sliced.extend(self._slice_chunk(chunk, tokens))
+        return sliced
 
-                if end == len(tokens):
-                    break
-                start += self.max_tokens - self.overlap
+    def _slice_chunk(self, chunk: Dict, tokens: List[int]) -> List[Dict]:
+        if len(tokens) <= self.max_tokens:
+            chunk["metadata"]["point_id"] = chunk["metadata"]["uuid"]
+            chunk["tokens"] = len(tokens)
+            return [chunk]
 
-        print(f"[ChunkingAgent] Tokens sliced into {len(sliced_chunks)} total chunks.")
-        print(f"[ChunkingAgent] Total tokens across all chunks: {total_tokens}")  # Print the total token count
+        slices = []
+        start = 0
+        slice_no = 0
+        while start < len(tokens):
+            end = min(start + self.max_tokens, len(tokens))
+            token_slice = tokens[start:end]
+            text_slice = self.encoder.decode(token_slice)
 
-        return sliced_chunks
+            row_uuid = chunk["metadata"]["uuid"]
+            slices.append({
+                "text": text_slice,
+                "tokens": len(token_slice),
+                "metadata": {
+                    **chunk["metadata"],
+                    "point_id": str(uuid.uuid5(CHUNK_NAMESPACE, f"{row_uuid}:{slice_no}"))
+                }
+            })
+            slice_no += 1
 
+            if end == len(tokens):
+                break
+            start += self.max_tokens - self.overlap
+        return slices
@@ -0,0 +1,109 @@
+# server/cli.py
+#
+# python -m server.cli run --kb kb/*.csv --fi issues/ --target TC57:Display
+# python -m server.cli serve                 # warm worker on DFMEA_WORKER_ADDRESS
+# python -m server.cli generate --collection dfmea_collection --worker
+#
+# Only the standard library is imported here; each command imports the
+# pipeline stages it runs, and --worker hands the job to a warm worker.
+
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional
+
+
+def _filter_pair(pair: str):
+    field, sep, value = pair.partition("=")
+    if not sep or not field:
+        raise argparse.ArgumentTypeError(f"filters are FIELD=VALUE, got: {pair}")
+    return field, value
+
+
+def _filters(pairs: Optional[List]) -> Optional[Dict]:
+    filters = {}
+    for field, value in pairs or []:
+        filters.setdefault(field, []).append(value)
+    return {field: values[0] if len(values) == 1 else values for field, values in filters.items()} or None
+
+
+def _targets(specs: Optional[List[str]]) -> Optional[List[Dict]]:
+    # PRODUCT:SUBSYSTEM, either side may be empty ("TC57:", ":Display")
+    targets = []
+    for spec in specs or []:
+        product, _, subsystem = spec.partition(":")
+        targets.append({"product": product or None, "subsystem": subsystem or "Display"})
+    return targets or None
+
+
+def _job(args) -> Dict:
+    job = {"op": args.command}
+    if args.command in ("ingest", "run"):
+        # The worker may run in another directory
+        job["kb_path"] = os.path.abspath(args.kb) if args.kb else None
+        job["fi_path"] = os.path.abspath(args.fi) if args.fi else None
+        job["incremental"] = args.incremental or None
+    if args.command in ("generate", "run"):
+        job["query"] = args.query
+        job["top_k"] = args.top_k
+        job["filters"] = _filters(args.filter)
+        job["targets"] = _targets(args.target)
+    job["collection"] = args.collection
+    job["run_id"] = args.run_id
+    return job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m server.cli", description="DFMEA generation pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def job_command(name: str, help: str):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--collection", default=None)
+        command.add_argument("--run-id", default=None, help="Checkpoint under this run ID; reuse it to resume")
+        command.add_argument("--worker", nargs="?", const="", default=None, metavar="HOST:PORT",
+                             help="Send the job to a running worker (default DFMEA_WORKER_ADDRESS)")
+        return command
+
+    for name, help in (("ingest", "Extract, chunk, embed and store"), ("run", "Ingest, then generate")):
+        command = job_command(name, help)
+        command.add_argument("--kb", default=None, help="Knowledge bank file, directory or glob")
+        command.add_argument("--fi", default=None, help="Field issues file, directory or glob")
+        command.add_argument("--incremental", action="store_true")
+    for name in ("generate", "run"):
+        command = commands.choices.get(name) or job_command(name, "Generate DFMEA entries from a collection")
+        command.add_argument("--query", default=None)
+        command.add_argument("--top-k", type=int, default=100)
+        command.add_argument("--filter", action="append", type=_filter_pair, metavar="FIELD=VALUE")
+        command.add_argument("--target", action="append", metavar="PRODUCT:SUBSYSTEM")
+
+    serve = commands.add_parser("serve", help="Run a warm worker accepting jobs on a local socket")
+    serve.add_argument("--address", default=None, metavar="HOST:PORT")
+    for name in ("ping", "stop"):
+        command = commands.add_parser(name, help=f"{name.capitalize()} a running worker")
+        command.add_argument("--address", default=None, metavar="HOST:PORT")
+
+    args = parser.parse_args(argv)
+
+    from server.pipeline.worker import DFMEAWorker, send_job
+    if args.command == "serve":
+        DFMEAWorker(args.address).serve()
+        return 0
+    if args.command in ("ping", "stop"):
+        reply = send_job({"op": "ping" if args.command == "ping" else "shutdown"}, args.address, timeout=10)
+    elif args.worker is not None:
+        reply = send_job(_job(args), args.worker or None)
+    else:
+        from server.utils import telemetry
+        reply = DFMEAWorker().execute(_job(args))
+        # Writes the JSON run report when DFMEA_RUN_REPORT is set
+        if telemetry.enabled():
+            telemetry.export_run_report()
+
+    print(json.dumps(reply, indent=2, default=str))
+    return 0 if reply.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
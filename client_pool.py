@@ -0,0 +1,111 @@
+# server/utils/client_pool.py
+
+import os
+import asyncio
+import threading
+import weakref
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+from server.utils.cache import EmbeddingCache, ResponseCache
+
+if TYPE_CHECKING:
+    from openai import AzureOpenAI, AsyncAzureOpenAI
+    from qdrant_client import QdrantClient
+
+load_dotenv()
+
+# One instance of each client per process, shared by every agent. Async clients
+# are bound to the event loop they were created on, so they are pooled per loop.
+# The SDKs are imported inside the factories, so only stages that use a client pay for them.
+_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _get_or_create(name: str, factory):
+    with _lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def _get_or_create_async(name: str, factory):
+    loop = asyncio.get_running_loop()
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        if name not in per_loop:
+            per_loop[name] = factory()
+        return per_loop[name]
+
+
+def set_client(name: str, client):
+    """Override a pooled client (e.g. with a local stand-in for offline runs)."""
+    with _lock:
+        _clients[name] = client
+
+
+def reset():
+    with _lock:
+        _clients.clear()
+        _async_clients.clear()
+
+
+def get_embedding_client() -> "AzureOpenAI":
+    from openai import AzureOpenAI
+    return _get_or_create("embedding", lambda: AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION")
+    ))
+
+
+def get_async_embedding_client() -> "AsyncAzureOpenAI":
+    if "async_embedding" in _clients:
+        return _clients["async_embedding"]
+    from openai import AsyncAzureOpenAI
+    return _get_or_create_async("async_embedding", lambda: AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION")
+    ))
+
+
+def get_async_chat_client() -> "AsyncAzureOpenAI":
+    if "async_chat" in _clients:
+        return _clients["async_chat"]
+    from openai import AsyncAzureOpenAI
+    return _get_or_create_async("async_chat", lambda: AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_CHAT_API_VERSION"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    ))
+
+
+def get_qdrant_client() -> "QdrantClient":
+    from qdrant_client import QdrantClient
+    return _get_or_create("qdrant", lambda: QdrantClient(
+        url=os.getenv("QDRANT_ENDPOINT"),
+        api_key=os.getenv("QDRANT_API_KEY"),
+        # QDRANT_PREFER_GRPC=1 sends upserts and searches over gRPC (binary, multiplexed)
+        prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "0") == "1",
+        grpc_port=int(os.getenv("QDRANT_GRPC_PORT", 6334)),
+        https=True,
+        timeout=30,
+        verify=False
+    ))
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    return _get_or_create("embedding_cache", EmbeddingCache)
+
+
+def get_query_cache() -> EmbeddingCache:
+    return _get_or_create("query_cache", lambda: EmbeddingCache(
+        path=os.getenv("QUERY_CACHE_PATH", ".cache/query_embeddings.sqlite"),
+        max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 50_000)),
+        memory_items=int(os.getenv("QUERY_CACHE_MEMORY_ITEMS", 1024))
+    ))
+
+
+def get_response_cache() -> ResponseCache:
+    return _get_or_create("response_cache", ResponseCache)
@@ -0,0 +1,29 @@
+# server/tests/conftest.py
+
+import pytest
+from server.utils import client_pool
+from server.benchmarks.fake_services import ServiceProfile, FakeEmbeddingClient, FakeAsyncChatClient
+
+DIM = 64
+
+
+@pytest.fixture
+def fake_services(tmp_path, monkeypatch):
+    """Local vector backend, caches under tmp_path and the offline stand-ins for Azure OpenAI."""
+    monkeypatch.setenv("VECTOR_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_VECTOR_DIR", str(tmp_path / "vectors"))
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("QUERY_CACHE_PATH", str(tmp_path / "query_cache.sqlite"))
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_responses.sqlite"))
+    monkeypatch.setenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "fake-embedding")
+    monkeypatch.setenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "fake-chat")
+    monkeypatch.delenv("EMBEDDING_DIMENSIONS", raising=False)
+    monkeypatch.delenv("RETRIEVAL_MODE", raising=False)
+
+    profile = ServiceProfile(latency=0.0, jitter=0.0)
+    client_pool.reset()
+    client_pool.set_client("embedding", FakeEmbeddingClient(profile, dim=DIM))
+    client_pool.set_client("async_chat", FakeAsyncChatClient(profile))
+    yield profile
+    client_pool.reset()
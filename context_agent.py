@@ -3,25 +3,83 @@
 import os
 import re
 import json
+import time
 import asyncio
-from typing import List, Dict
+from typing import List, Dict, Optional, Callable
 from server.agents.vectorstore_agent import VectorStoreAgent
-from openai import AsyncAzureOpenAI
+from server.utils.client_pool import get_async_chat_client, get_response_cache
+from server.utils.llm_scheduler import LLMScheduler
+from server.utils.tokenizer import count_tokens, encode_batch
+from server.utils.context_packing import mmr_rerank, pack_prompts
+from server.utils.json_stream import IncrementalJSONArrayParser
+from server.utils.checkpoint import RunCheckpoint
+from server.utils import telemetry
+
+logger = telemetry.get_logger("ContextAgent")
+
+TARGET_QUERY = "Generate DFMEA entries for {product} {subsystem} field failures"
 
 class ContextAgent:
-    def __init__(self, collection_name: str, batch_size: int = 5):
+    def __init__(self, collection_name: str, batch_size: int = 5, scheduler: Optional[LLMScheduler] = None,
+                 use_cache: bool = None, force_refresh: bool = None, stream: bool = None, packing: str = None,
+                 checkpoint: Optional[RunCheckpoint] = None, vectorstore: Optional[VectorStoreAgent] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None, merge: bool = False):
         self.collection_name = collection_name
-        self.vectorstore = VectorStoreAgent(collection_name=self.collection_name)
+        self.vectorstore = vectorstore or VectorStoreAgent(collection_name=self.collection_name)
         self.batch_size = batch_size
 
-        self.client = AsyncAzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_CHAT_API_VERSION"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
+        # "budget": MMR-rerank, then pack prompts up to a token budget with balanced sources;
+        # "fixed": the original groups of batch_size chunks
+        self.packing = (packing or os.getenv("CONTEXT_PACKING", "budget")).lower()
+        self.prompt_token_budget = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 6000))
+        self.mmr_lambda = float(os.getenv("MMR_LAMBDA", 0.7))
+        self.mmr_duplicate_threshold = float(os.getenv("MMR_DUPLICATE_THRESHOLD", 0.98))
+
+        # Shared admission control: concurrency cap, TPM/RPM budget, backoff, deadline
+        self.scheduler = scheduler or LLMScheduler()
+        self.expected_output_tokens = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 1500))
+        self.deadline = float(os.getenv("LLM_DEADLINE_SECONDS", 0)) or None
+        self.failed_batches: List[Dict] = []
+
+        self.client = None  # Pooled async client, bound once the event loop is running
         self.deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
+        self.temperature = 0.3
+
+        # Parsed responses are cached per (deployment, temperature, system prompt, batch text)
+        if use_cache is None:
+            use_cache = os.getenv("LLM_CACHE", "1") != "0"
+        if force_refresh is None:
+            force_refresh = os.getenv("LLM_CACHE_REFRESH", "0") == "1"
+        self.response_cache = get_response_cache() if use_cache else None
+        self.force_refresh = force_refresh
+
+        # Streaming mode parses the JSON array as tokens arrive and emits entries early
+        if stream is None:
+            stream = os.getenv("LLM_STREAM", "0") == "1"
+        self.stream = stream
+        self.on_entry: Optional[Callable[[Dict], None]] = None
+        self._system_token_counts: Dict[str, int] = {}
+
+        # Resumable runs: retrievals and completed batches are persisted under the run directory
+        self.checkpoint = checkpoint
+
+        # A long-lived caller can pass its own event loop, so the pooled async client
+        # (bound to one loop) and its HTTP connections survive between runs
+        self.loop = loop
+
+        # merge=True only for callers that run MergeAgent downstream: it computes RPN and KB
+        # links deterministically after generation, so the prompt stops asking the model for them
+        self.merge = merge
+
+        self.system_msg = self.build_system_msg()
 
-        self.system_msg = (
+    def build_system_msg(self, subsystem: str = "Display", product: Optional[str] = None) -> str:
+        product_rule = f"- Generate only for product {product} and set Product to '{product}'.\n" if product else ""
+        derived_fields = "" if self.merge else (
+            "        - RPN (calculated as Severity × Occurrence × Detection)\n"
+            "        - linked_to_dfmea_kb (boolean — true if matched with knowledge bank)\n"
+        )
+        return (
             "You are a DFMEA analyst with deep domain expertise in Enterprise Mobile Computing at Zebra Technologies.\n\n"
 
             "You are provided with raw structured text from two sources:\n"
@@ -50,12 +108,12 @@ class ContextAgent:
             "        - Controls Prevention (list of 1–3 actionable items — must not be empty)\n"
             "        - Controls Detection (list of 1–3 techniques — must not be empty)\n"
             "        - Recommended Actions (list of 1–3 suggestions — must not be empty)\n"
-            "        - RPN (calculated as Severity × Occurrence × Detection)\n"
-            "        - linked_to_dfmea_kb (boolean — true if matched with knowledge bank)\n\n"
+            f"{derived_fields}\n"
 
             "RULES:\n"
             "- Use only data from the chunked input text (SOURCE: ...).\n"
-            "- Generate only for Display subsystem.\n"
+            f"- Generate only for {subsystem} subsystem.\n"
+            f"{product_rule}"
             "- Return **pure valid JSON** (no explanations, no markdown, no triple backticks).\n"
             "- Start output with '[' and ensure the output can be parsed using `json.loads()`.\n"
             "- You can return 1–3 DFMEA entries per batch.\n"
@@ -70,17 +128,94 @@ class ContextAgent:
         for i in range(0, len(lst), n):
             yield lst[i:i + n]
 
-    async def _call_azure_openai(self, user_msg: str) -> str:
-        response = await self.client.chat.completions.create(
-            model=self.deployment,
-            temperature=0.3,
-            messages=[
-                {"role": "system", "content": self.system_msg},
-                {"role": "user", "content": user_msg}
-            ]
-        )
+    def _pack(self, query: str, matches: List[Dict], query_vector: Optional[List[float]] = None) -> List[List[str]]:
+        """Rerank matches with MMR and pack them into prompts under the token budget."""
+        if self.packing == "fixed":
+            return list(self._batch([m["text"] for m in matches], self.batch_size))
+        if self.packing != "budget":
+            raise ValueError(f"Unknown context packing mode: {self.packing}")
+
+        query_vector = query_vector or self.vectorstore.embed_query(query)
+        reranked = mmr_rerank(query_vector, matches, self.mmr_lambda, self.mmr_duplicate_threshold)
+        if len(reranked) < len(matches):
+            logger.info(f"Dropped {len(matches) - len(reranked)} near-duplicate chunks.")
+            telemetry.incr("context.duplicates_dropped", len(matches) - len(reranked))
+
+        token_counts = [len(tokens) for tokens in encode_batch([m["text"] for m in reranked], "cl100k_base")]
+        prompts = pack_prompts(reranked, token_counts, self.prompt_token_budget)
+        telemetry.observe("context.prompts_per_query", len(prompts))
+        return [[m["text"] for m in prompt] for prompt in prompts]
+
+    async def _call_azure_openai(self, user_msg: str, system_msg: str) -> str:
+        start = time.perf_counter()
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.deployment,
+                temperature=self.temperature,
+                messages=[
+                    {"role": "system", "content": system_msg},
+                    {"role": "user", "content": user_msg}
+                ]
+            )
+        finally:
+            telemetry.observe("llm.latency", time.perf_counter() - start)
+
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            telemetry.incr("llm.tokens_in", usage.prompt_tokens)
+            telemetry.incr("llm.tokens_out", usage.completion_tokens)
         return response.choices[0].message.content
 
+    async def _stream_azure_openai(self, user_msg: str, index: int, system_msg: str):
+        """
+        Stream a completion and parse entries incrementally. Returns the entries
+        that arrived intact and whether the array was closed cleanly; entries
+        survive a broken or truncated tail.
+        """
+        parser = IncrementalJSONArrayParser()
+        entries = []
+        received = []
+        start = time.perf_counter()
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.deployment,
+                temperature=self.temperature,
+                stream=True,
+                messages=[
+                    {"role": "system", "content": system_msg},
+                    {"role": "user", "content": user_msg}
+                ]
+            )
+            async for event in stream:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if not delta:
+                    continue
+                received.append(delta)
+                for entry in parser.feed(delta):
+                    if not entries:
+                        logger.info(f"Batch {index}: first entry received.")
+                        telemetry.observe("llm.time_to_first_entry", time.perf_counter() - start)
+                    entries.append(entry)
+                    if self.on_entry:
+                        self.on_entry(entry)
+        except Exception as e:
+            if not entries:
+                raise
+            logger.warning(f"Batch {index} stream broke after {len(entries)} entries: {type(e).__name__}: {e}")
+            telemetry.incr("llm.truncated_streams")
+        finally:
+            telemetry.observe("llm.latency", time.perf_counter() - start)
+
+        if telemetry.enabled():
+            telemetry.incr("llm.tokens_in", count_tokens(system_msg) + count_tokens(user_msg))
+            telemetry.incr("llm.tokens_out", count_tokens("".join(received)))
+        if parser.errors:
+            logger.warning(f"Batch {index}: dropped {parser.errors} malformed entries.")
+            telemetry.incr("llm.malformed_entries", parser.errors)
+        return entries, parser.complete and not parser.errors
+
     async def _parse_llm_response(self, raw_response: str) -> List[Dict]:
         cleaned = re.sub(r"^```(json)?", "", raw_response.strip(), flags=re.IGNORECASE | re.MULTILINE)
         cleaned = re.sub(r"```$", "", cleaned.strip(), flags=re.MULTILINE)
@@ -89,43 +224,203 @@ class ContextAgent:
             parsed = json.loads(cleaned)
             return parsed if isinstance(parsed, list) else []
         except json.JSONDecodeError:
-            print("[ContextAgent] JSON decode failed after cleanup.")
+            logger.warning("JSON decode failed after cleanup.")
             return []
 
-    async def _process_batch(self, batch_chunks: List[str], index: int) -> List[Dict]:
-        print(f"[ContextAgent] Processing batch {index}...")
+    async def _process_batch(self, batch_chunks: List[str], index: int, system_msg: Optional[str] = None) -> List[Dict]:
+        logger.info(f"Processing batch {index}...")
+        system_msg = system_msg or self.system_msg
         user_msg = "Here are relevant data chunks:\n\n" + "\n\n".join(batch_chunks)
+        attempts = 0
+
+        batch_key = None
+        if self.checkpoint:
+            batch_key = self.checkpoint.key(self.deployment, system_msg, user_msg)
+            saved = self.checkpoint.load_batch(batch_key)
+            if saved is not None:
+                logger.info(f"Batch {index} restored from run checkpoint.")
+                for entry in saved:
+                    if self.on_entry:
+                        self.on_entry(entry)
+                return saved
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(self.deployment, self.temperature, system_msg, user_msg)
+            if not self.force_refresh:
+                cached = self.response_cache.get(cache_key)
+                telemetry.incr("llm.cache_hits" if cached else "llm.cache_misses")
+                if cached:
+                    logger.info(f"Batch {index} served from response cache.")
+                    if batch_key:
+                        self.checkpoint.save_batch(batch_key, cached)
+                    for entry in cached:
+                        if self.on_entry:
+                            self.on_entry(entry)
+                    return cached
+
+        async def attempt() -> List[Dict]:
+            nonlocal attempts
+            attempts += 1
+            if self.stream:
+                return await stream_attempt()
+            raw_response = await self._call_azure_openai(user_msg, system_msg)
+            logger.info(f"Raw LLM Response (batch {index}, attempt {attempts}):\n{raw_response[:300]}\n")
+
+            parsed = await self._parse_llm_response(raw_response)
+            if not parsed:
+                raise ValueError("Empty or invalid JSON after parsing.")
+            if cache_key:
+                self.response_cache.put(cache_key, parsed)
+            if batch_key:
+                self.checkpoint.save_batch(batch_key, parsed)
+            for entry in parsed:
+                if self.on_entry:
+                    self.on_entry(entry)
+            return parsed
+
+        async def stream_attempt() -> List[Dict]:
+            entries, complete = await self._stream_azure_openai(user_msg, index, system_msg)
+            if not entries:
+                # Nothing usable arrived, so nothing was emitted: safe to retry
+                raise ValueError("No complete DFMEA entries in streamed response.")
+            # Partial results are kept but never cached
+            if cache_key and complete:
+                self.response_cache.put(cache_key, entries)
+            if batch_key and complete:
+                self.checkpoint.save_batch(batch_key, entries)
+            return entries
+
+        # Budget the prompt plus the completion we expect back
+        tokens = self._system_tokens(system_msg) + count_tokens(user_msg) + self.expected_output_tokens
+        try:
+            return await self.scheduler.submit(attempt, tokens, label=f"Batch {index}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Batch {index} permanently failed after {attempts} attempts: {e}")
+            self.failed_batches.append({"index": index, "chunks": batch_chunks, "error": f"{type(e).__name__}: {e}"})
+            telemetry.incr("llm.batch_failures")
+            return []
 
-        for attempt in range(1, 3):
-            try:
-                raw_response = await self._call_azure_openai(user_msg)
-                print(f"[ContextAgent] Raw LLM Response (batch {index}, attempt {attempt}):\n{raw_response[:300]}\n")
+    def _system_tokens(self, system_msg: str) -> int:
+        if system_msg not in self._system_token_counts:
+            self._system_token_counts[system_msg] = count_tokens(system_msg)
+        return self._system_token_counts[system_msg]
 
-                parsed = await self._parse_llm_response(raw_response)
-                if parsed:
-                    return parsed
-                else:
-                    raise ValueError("Empty or invalid JSON after parsing.")
+    async def _generate(self, batches: List[List[str]], system_msgs: List[str],
+                        deadline: Optional[float]) -> List[Optional[List[Dict]]]:
+        """Run every prompt under the shared scheduler; returns one result (or None) per batch."""
+        tasks = [self._process_batch(batch, i, system_msg) for i, (batch, system_msg) in enumerate(zip(batches, system_msgs), 1)]
 
-            except Exception as e:
-                print(f"[ContextAgent] Batch {index} attempt {attempt} failed: {e}")
-                await asyncio.sleep(1.5 * attempt)  # backoff
+        with telemetry.span("generation", batches=len(batches)) as span:
+            results = await self.scheduler.run_all(tasks, timeout=deadline or self.deadline)
+            for i, result in enumerate(results, 1):
+                if result is None:
+                    self.failed_batches.append({"index": i, "chunks": batches[i - 1], "error": "cancelled or deadline exceeded"})
+                    telemetry.incr("llm.batch_failures")
+            span["failed_batches"] = len(self.failed_batches)
+        if self.failed_batches:
+            logger.warning(f"⚠️ {len(self.failed_batches)} batches produced no entries.")
+        return results
 
-        print(f"[ContextAgent] Batch {index} permanently failed after 2 attempts.")
-        return []
+    def _search(self, query: str, top_k: int, filters: Optional[Dict] = None,
+                query_vector: Optional[List[float]] = None) -> List[Dict]:
+        """Vector store search, replayed from the run checkpoint when resuming."""
+        with_vectors = self.packing == "budget"
+        key = None
+        if self.checkpoint:
+            key = self.checkpoint.key(query, str(top_k), json.dumps(filters, sort_keys=True), str(with_vectors))
+            saved = self.checkpoint.load_retrieval(key)
+            if saved is not None:
+                logger.info(f"Retrieval for '{query}' restored from run checkpoint.")
+                return saved
+        matches = self.vectorstore.search(query, top_k=top_k, filters=filters, with_vectors=with_vectors,
+                                          query_vector=query_vector)
+        if key:
+            self.checkpoint.save_retrieval(key, matches)
+        return matches
 
-    async def run_async(self, query: str, top_k: int = 50) -> List[Dict]:
-        print("[ContextAgent] Searching Qdrant for:", query)
-        matches = self.vectorstore.search(query, top_k=top_k)
-        chunks = [m["text"] for m in matches]
+    def _start(self, on_entry: Optional[Callable[[Dict], None]]):
+        self.client = get_async_chat_client()
+        self.on_entry = on_entry or self.on_entry
+        self.failed_batches = []
 
-        print(f"[ContextAgent] Retrieved {len(chunks)} chunks from Qdrant.\n")
-        tasks = [self._process_batch(batch, i) for i, batch in enumerate(self._batch(chunks, self.batch_size), 1)]
+    async def run_async(self, query: str, top_k: int = 50, deadline: Optional[float] = None,
+                        on_entry: Optional[Callable[[Dict], None]] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        self._start(on_entry)
 
-        results = await asyncio.gather(*tasks)
-        flattened = [entry for batch in results for entry in batch]
-        print(f"\n[ContextAgent] Parsed {len(flattened)} DFMEA entries.\n")
+        logger.info(f"Searching Qdrant for: {query}")
+        matches = self._search(query, top_k, filters)
+
+        logger.info(f"Retrieved {len(matches)} chunks from Qdrant.")
+        batches = self._pack(query, matches)
+        logger.info(f"Packed into {len(batches)} prompts ({self.packing}).")
+        results = await self._generate(batches, [self.system_msg] * len(batches), deadline)
+
+        flattened = [entry for batch in results if batch for entry in batch]
+        logger.info(f"Parsed {len(flattened)} DFMEA entries.")
+        telemetry.incr("llm.entries", len(flattened))
         return flattened
 
-    def run(self, query: str, top_k: int = 50) -> List[Dict]:
-        return asyncio.run(self.run_async(query, top_k=top_k))
+    async def run_targets_async(self, targets: List[Dict], top_k: int = 50, deadline: Optional[float] = None,
+                                on_entry: Optional[Callable[[Dict], None]] = None,
+                                query_template: str = TARGET_QUERY, use_filters: bool = True) -> List[Dict]:
+        """
+        Generate DFMEA entries for several {"product", "subsystem"} targets in
+        one run: all target queries are embedded in one request, retrievals
+        run concurrently, and every prompt shares this agent's scheduler.
+        Entries come back in target order and are renumbered from 1.
+        """
+        self._start(on_entry)
+        targets = [{"product": t.get("product") or None, "subsystem": t.get("subsystem") or "Display"} for t in targets]
+        queries = [query_template.format(product=t["product"] or "all products", subsystem=t["subsystem"]) for t in targets]
+
+        logger.info(f"Retrieving context for {len(targets)} targets...")
+        query_vectors = self.vectorstore.embed_queries(queries)
+        all_matches = await asyncio.gather(*(
+            asyncio.to_thread(
+                self._search, query, top_k,
+                filters={k: v for k, v in target.items() if v} if use_filters else None,
+                query_vector=vector
+            )
+            for target, query, vector in zip(targets, queries, query_vectors)
+        ))
+
+        batches, system_msgs, owners = [], [], []
+        for n, (target, query, vector, matches) in enumerate(zip(targets, queries, query_vectors, all_matches)):
+            target_batches = self._pack(query, matches, vector)
+            logger.info(f"{target['product'] or 'All products'} / {target['subsystem']}: "
+                        f"{len(matches)} chunks packed into {len(target_batches)} prompts.")
+            system_msg = self.build_system_msg(subsystem=target["subsystem"], product=target["product"])
+            batches.extend(target_batches)
+            system_msgs.extend([system_msg] * len(target_batches))
+            owners.extend([n] * len(target_batches))
+
+        results = await self._generate(batches, system_msgs, deadline)
+
+        merged = []
+        for owner, result in zip(owners, results):
+            target = targets[owner]
+            for entry in result or []:
+                if target["product"]:
+                    entry["Product"] = target["product"]
+                entry["ID"] = len(merged) + 1
+                merged.append(entry)
+
+        logger.info(f"Parsed {len(merged)} DFMEA entries across {len(targets)} targets.")
+        telemetry.incr("llm.entries", len(merged))
+        return merged
+
+    def run(self, query: str, top_k: int = 50, deadline: Optional[float] = None,
+            on_entry: Optional[Callable[[Dict], None]] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        return self._run_coroutine(self.run_async(query, top_k=top_k, deadline=deadline, on_entry=on_entry, filters=filters))
+
+    def run_targets(self, targets: List[Dict], top_k: int = 50, deadline: Optional[float] = None,
+                    on_entry: Optional[Callable[[Dict], None]] = None, **kwargs) -> List[Dict]:
+        return self._run_coroutine(self.run_targets_async(targets, top_k=top_k, deadline=deadline, on_entry=on_entry, **kwargs))
+
+    def _run_coroutine(self, coroutine):
+        if self.loop is not None:
+            return self.loop.run_until_complete(coroutine)
+        return asyncio.run(coroutine)
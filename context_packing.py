@@ -0,0 +1,94 @@
+# server/utils/context_packing.py
+
+from typing import Dict, List, Optional
+import numpy as np
+
+# "\n\n" between chunks in the user message
+SEPARATOR_TOKENS = 2
+
+
+def mmr_rerank(query_vector: List[float], matches: List[Dict], lambda_: float = 0.7,
+               duplicate_threshold: Optional[float] = 0.98) -> List[Dict]:
+    """
+    Reorder matches by maximal marginal relevance: each pick maximises
+    lambda * sim(query, chunk) - (1 - lambda) * max sim(chunk, already picked).
+    Matches whose similarity to an earlier pick reaches duplicate_threshold
+    are dropped. Matches without an "embedding" keep their retrieval order
+    after the reranked ones.
+    """
+    with_vectors = [m for m in matches if m.get("embedding") is not None]
+    without = [m for m in matches if m.get("embedding") is None]
+    if len(with_vectors) < 2:
+        return with_vectors + without
+
+    vectors = np.asarray([m["embedding"] for m in with_vectors], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+    redundancy = np.full(len(with_vectors), -np.inf, dtype=np.float32)
+    remaining = np.ones(len(with_vectors), dtype=bool)
+    order = []
+
+    while remaining.any():
+        scores = lambda_ * relevance - (1 - lambda_) * np.maximum(redundancy, 0)
+        scores[~remaining] = -np.inf
+        pick = int(np.argmax(scores))
+        remaining[pick] = False
+        if duplicate_threshold is not None and redundancy[pick] >= duplicate_threshold:
+            continue
+        order.append(pick)
+        redundancy = np.maximum(redundancy, pairwise[pick])
+
+    return [with_vectors[i] for i in order] + without
+
+
+def pack_prompts(matches: List[Dict], token_counts: List[int], token_budget: int,
+                 source_key: str = "source") -> List[List[Dict]]:
+    """
+    Pack matches (in priority order) into as few prompts as possible whose
+    chunk tokens stay within token_budget, keeping every source's share of
+    each prompt close to its share of the whole set.
+
+    Each prompt is filled by repeatedly taking the earliest chunk that still
+    fits from the source furthest below its target share, falling back to
+    the other sources. A chunk larger than the budget gets a prompt to itself.
+    """
+    queues: Dict[str, List[int]] = {}
+    for i, match in enumerate(matches):
+        queues.setdefault(match.get("metadata", {}).get(source_key, ""), []).append(i)
+    total = sum(token_counts) or 1
+    share = {source: sum(token_counts[i] for i in items) / total for source, items in queues.items()}
+    cost = [tokens + SEPARATOR_TOKENS for tokens in token_counts]
+
+    prompts = []
+    while any(queues.values()):
+        prompt, used = [], 0
+        used_by_source = {source: 0 for source in queues}
+        while True:
+            # Sources ordered by how far they are below their target share in this prompt
+            sources = sorted(
+                (s for s in queues if queues[s]),
+                key=lambda s: used_by_source[s] - share[s] * max(used, 1)
+            )
+            picked = None
+            for source in sources:
+                for position, i in enumerate(queues[source]):
+                    if used + cost[i] <= token_budget or not prompt:
+                        picked = (source, position, i)
+                        break
+                if picked:
+                    break
+            if not picked:
+                break
+            source, position, i = picked
+            queues[source].pop(position)
+            prompt.append(matches[i])
+            used += cost[i]
+            used_by_source[source] += cost[i]
+            if used >= token_budget:
+                break
+        prompts.append(prompt)
+    return prompts
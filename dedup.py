@@ -0,0 +1,91 @@
+# server/utils/dedup.py
+
+import re
+import zlib
+import hashlib
+from typing import Dict, List
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 32) + 15)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text.lower()).strip()
+
+
+class MinHasher:
+    """MinHash signatures over character shingles of normalized text."""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a < 2^31 and hash < 2^32 keep a * hash + b inside uint64
+        self._a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        k = self.shingle_size
+        grams = {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingles(text)
+        return ((self._a * hashes + self._b) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate clustering. Exact repeats (after normalization)
+    are matched with a dict lookup; everything else is matched by MinHash
+    LSH against the cluster representatives and joins the first one whose
+    estimated Jaccard similarity reaches the threshold.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        self._exact: Dict[bytes, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def add(self, text: str) -> int:
+        """Return the cluster index text belongs to, creating a new cluster if none matches."""
+        text = normalize(text)
+        # A 16-byte digest keeps the exact-match table small on million-row inputs; unlike
+        # hash() it is stable across processes and collisions are negligible
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        cluster = self._exact.get(key)
+        if cluster is not None:
+            return cluster
+
+        signature = self.hasher.signature(text)
+        band_keys = [
+            signature[i * self.rows_per_band:(i + 1) * self.rows_per_band].tobytes()
+            for i in range(self.bands)
+        ]
+
+        seen = set()
+        for band, band_key in enumerate(band_keys):
+            for candidate in self._buckets[band].get(band_key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    self._exact[key] = candidate
+                    return candidate
+
+        cluster = len(self._signatures)
+        self._signatures.append(signature)
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band].setdefault(band_key, []).append(cluster)
+        self._exact[key] = cluster
+        return cluster
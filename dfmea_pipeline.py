@@ -2,27 +2,76 @@
 
 from server.agents.context_agent import ContextAgent
 from server.agents.writer_agent import WriterAgent
-from crewai import Agent, Task, Crew
+from server.agents.merge_agent import MergeAgent, merge_enabled
+from server.utils import telemetry
+
+logger = telemetry.get_logger("DFMEAPipeline")
 
 class DFMEAPipeline:
-    def __init__(self, collection_name: str):
+    def __init__(self, collection_name: str, force_refresh: bool = None, checkpoint=None, context: ContextAgent = None):
         self.collection_name = collection_name
+        self.force_refresh = force_refresh
+        self.checkpoint = checkpoint
+        # A warm ContextAgent (e.g. held by the worker service) is reused instead of built per run
+        self.context = context
 
-    def run(self, query="Generate DFMEA entries for recent field failures", top_k=100):
-        print("[DFMEAPipeline] Starting DFMEA generation pipeline...")
+    def _context(self) -> ContextAgent:
+        if self.context is not None:
+            self.context.checkpoint = self.checkpoint
+            return self.context
+        return ContextAgent(collection_name=self.collection_name, batch_size=5, force_refresh=self.force_refresh,
+                            checkpoint=self.checkpoint, merge=merge_enabled())
 
-        # Step 1: Contextual reasoning using RAG
-        context = ContextAgent(collection_name=self.collection_name, batch_size=5)
-        structured_json = context.run(query=query, top_k=top_k)
+    def _write(self, structured_json, context: ContextAgent):
+        # Merge duplicate failure modes across batches, link causes to the KB, recompute RPN
+        if context.merge:
+            structured_json = MergeAgent(context.vectorstore).run(structured_json)
 
-        # Step 2: Write output to Excel + JSON
         writer = WriterAgent()
         output_path = writer.run(structured_json)
-
+        if self.checkpoint:
+            self.checkpoint.mark_done("writing", output_path=str(output_path))
         return output_path
 
-    # Optional: Crew trace
-    def crew ():
+    def _resumed_output(self):
+        if self.checkpoint and self.checkpoint.done("writing"):
+            logger.info(f"Resuming run {self.checkpoint.run_id}: output already written.")
+            return self.checkpoint.get("output_path")
+        return None
+
+    @telemetry.traced("dfmea_pipeline")
+    def run(self, query="Generate DFMEA entries for recent field failures", top_k=100, filters=None):
+        logger.info("Starting DFMEA generation pipeline...")
+        resumed = self._resumed_output()
+        if resumed:
+            return resumed
+
+        # Step 1: Contextual reasoning using RAG
+        context = self._context()
+        structured_json = context.run(query=query, top_k=top_k, filters=filters)
+
+        # Step 2: Merge and write output to Excel + JSON
+        return self._write(structured_json, context)
+
+    @telemetry.traced("dfmea_pipeline")
+    def run_targets(self, targets, top_k=100, use_filters=True):
+        """
+        One DFMEA run for several targets, e.g. [{"product": "TC57", "subsystem": "Display"}, ...],
+        sharing the embedding request, retrieval and LLM budget; written as one output.
+        """
+        logger.info(f"Starting DFMEA generation pipeline for {len(targets)} targets...")
+        resumed = self._resumed_output()
+        if resumed:
+            return resumed
+
+        context = self._context()
+        structured_json = context.run_targets(targets, top_k=top_k, use_filters=use_filters)
+
+        return self._write(structured_json, context)
+
+    # Optional: Crew trace (crewai is heavy and only imported when asked for)
+    def crew(self):
+        from crewai import Agent, Task, Crew
         crew = Crew(
             agents=[
                 Agent(name="Reasoning LLM", description="Generate DFMEA structured output."),
@@ -34,5 +83,6 @@ class DFMEAPipeline:
             ],
             verbose=True
         )
+        return crew
 
         
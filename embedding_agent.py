@@ -1,68 +1,302 @@
 import os
 import asyncio
 import time
-from typing import List, Dict
+import random
+from collections import deque
+import numpy as np
+from typing import List, Dict, Optional
 from tqdm import tqdm
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from openai import AzureOpenAI, RateLimitError, APIConnectionError, InternalServerError
+from openai import RateLimitError, APIConnectionError, InternalServerError
 from dotenv import load_dotenv
-from tiktoken import get_encoding
+from server.utils.cache import EmbeddingCache
+from server.utils.client_pool import get_embedding_client, get_async_embedding_client, get_embedding_cache
+from server.utils.rate_limiter import TokenBucket, retry_after_seconds
+from server.utils.tokenizer import count_tokens
+from server.utils.embedding_matrix import EmbeddingMatrix, to_vector
+from server.utils import telemetry
 
 load_dotenv()
 
+logger = telemetry.get_logger("EmbeddingAgent")
+
+
+def _count_retry(retry_state):
+    telemetry.incr("embedding.retries")
+
+
+def embedding_dimensions() -> Optional[int]:
+    # Shortened output vectors for models that support it (text-embedding-3-*)
+    value = os.getenv("EMBEDDING_DIMENSIONS")
+    return int(value) if value else None
+
+
+def embedding_request_options(dimensions: Optional[int] = None) -> Dict:
+    # base64 skips building a Python float per dimension in the client
+    options = {"encoding_format": "base64"}
+    if dimensions:
+        options["dimensions"] = dimensions
+    return options
+
+
+def cache_namespace(deployment: str, dimensions: Optional[int] = None) -> str:
+    return f"{deployment}@{dimensions}" if dimensions else deployment
+
 class EmbeddingAgent:
-    def __init__(self):
-        self.client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION")
-        )
+    def __init__(self, cache: Optional[EmbeddingCache] = None, use_cache: bool = None, dimensions: int = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.client = get_embedding_client()
         self.deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+        self.dimensions = dimensions or embedding_dimensions()
+        self.request_options = embedding_request_options(self.dimensions)
+        self.cache_namespace = cache_namespace(self.deployment, self.dimensions)
         self.batch_size = 50  # Tune for performance vs. rate limits
         self.cooldown = 2      # Cooldown in seconds between batches
 
-    def _log_token_usage(self, embedded: List[Dict]):
+        # Async mode: several batches in flight, paced by RPM/TPM token buckets
+        self.max_concurrency = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+        self.requests_per_minute = int(os.getenv("EMBEDDING_RPM", 720))
+        self.tokens_per_minute = int(os.getenv("EMBEDDING_TPM", 240_000))
+        self.min_batch_size = 1
+        self.max_attempts = 5
+        self.failed_batches: List[Dict] = []
+
+        # Content-addressed cache: only texts we have never embedded go to Azure
+        if use_cache is None:
+            use_cache = os.getenv("EMBEDDING_CACHE", "1") != "0"
+        self.cache = cache if cache is not None else (get_embedding_cache() if use_cache else None)
+
+        # A long-lived caller can pass its own event loop, so the pooled async client
+        # (bound to one loop) and its HTTP connections survive between runs
+        self.loop = loop
+
+    def _log_token_usage(self, embedded: EmbeddingMatrix):
+        logger.info(f"Embedding matrix: {len(embedded)} x {embedded.dim} float32 ({embedded.nbytes / 2 ** 20:.1f} MB)")
+        embedded = embedded.records
         total_tokens = sum(chunk.get("tokens", 0) for chunk in embedded)
         kb_tokens = sum(chunk.get("tokens", 0) for chunk in embedded if chunk.get("metadata", {}).get("source") == "knowledge_bank")
         fi_tokens = sum(chunk.get("tokens", 0) for chunk in embedded if chunk.get("metadata", {}).get("source") == "field_issues")
-        print("\n🔍 [EmbeddingAgent] Token Usage Summary:")
-        print(f"  • Total Chunks Embedded: {len(embedded)}")
-        print(f"  • Total Tokens Used: {total_tokens:,}")
-        print(f"  • Knowledge Bank → {kb_tokens:,} tokens")
-        print(f"  • Field Issues   → {fi_tokens:,} tokens")
+        logger.info("🔍 Token Usage Summary:")
+        logger.info(f"  • Total Chunks Embedded: {len(embedded)}")
+        logger.info(f"  • Total Tokens Used: {total_tokens:,}")
+        logger.info(f"  • Knowledge Bank → {kb_tokens:,} tokens")
+        logger.info(f"  • Field Issues   → {fi_tokens:,} tokens")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            logger.info(f"  • Cache          → {stats['hits']:,} hits / {stats['misses']:,} misses ({stats['hit_rate']:.0%})")
 
     @retry(
         stop=stop_after_attempt(5),
         wait=wait_exponential(multiplier=2, min=4, max=60),
         retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+        before_sleep=_count_retry,
         reraise=True
     )
+    @telemetry.timed("embedding.api_latency")
     def _embed_batch_with_retry(self, batch_texts):
-        return self.client.embeddings.create(input=batch_texts, model=self.deployment)
+        return self.client.embeddings.create(input=batch_texts, model=self.deployment, **self.request_options)
+
+    def _lookup_cache(self, chunks: List[Dict]) -> List[Optional[np.ndarray]]:
+        if self.cache is None:
+            return [None] * len(chunks)
+        vectors = [
+            None if vector is None else np.asarray(vector, dtype=np.float32)
+            for vector in self.cache.get_many([chunk["text"] for chunk in chunks], self.cache_namespace)
+        ]
+        hits = sum(1 for vector in vectors if vector is not None)
+        telemetry.incr("embedding.cache_hits", hits)
+        telemetry.incr("embedding.cache_misses", len(vectors) - hits)
+        return vectors
+
+    def _record_success(self, chunks: List[Dict], batch_idx: List[int], batch_texts: List[str], batch_vectors, vectors):
+        for idx, vector in zip(batch_idx, batch_vectors):
+            vectors[idx] = vector
+        if self.cache is not None:
+            self.cache.put_many(batch_texts, batch_vectors, self.cache_namespace)
+        telemetry.incr("embedding.requests")
+        telemetry.incr("embedding.tokens_in", sum(self._chunk_tokens(chunks[idx]) for idx in batch_idx))
+
+    def embed_chunks_sync(self, chunks: List[Dict]) -> EmbeddingMatrix:
+        logger.info(f"🚀 Embedding {len(chunks)} chunks with sync batching...")
+        self.failed_batches = []
 
-    def embed_chunks_sync(self, chunks: List[Dict]) -> List[Dict]:
-        print(f"[EmbeddingAgent] 🚀 Embedding {len(chunks)} chunks with sync batching...")
+        vectors = self._lookup_cache(chunks)
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        logger.info(f"{len(chunks) - len(pending)} cached, {len(pending)} to embed.")
 
-        embedded_chunks = []
-        for i in tqdm(range(0, len(chunks), self.batch_size), desc="[EmbeddingAgent] Embedding"):
-            batch = chunks[i:i + self.batch_size]
-            batch_texts = [chunk["text"] for chunk in batch]
+        for i in tqdm(range(0, len(pending), self.batch_size), desc="[EmbeddingAgent] Embedding"):
+            batch_idx = pending[i:i + self.batch_size]
+            batch_texts = [chunks[idx]["text"] for idx in batch_idx]
             try:
                 response = self._embed_batch_with_retry(batch_texts)
-                for idx, item in enumerate(response.data):
-                    embedded_chunks.append({
-                        "text": batch[idx]["text"],
-                        "embedding": item.embedding,
-                        "metadata": batch[idx].get("metadata", {}),
-                        "tokens": self._count_tokens(batch[idx]["text"])
-                    })
+                batch_vectors = [to_vector(item.embedding) for item in response.data]
+                self._record_success(chunks, batch_idx, batch_texts, batch_vectors, vectors)
             except Exception as e:
-                print(f"[EmbeddingAgent] Batch failed after retries: {type(e).__name__}: {e}")
+                logger.warning(f"Batch failed after retries: {type(e).__name__}: {e}")
+                self._record_failure(chunks, batch_idx, e)
             time.sleep(self.cooldown)  # Cooldown between batches
 
+        embedded_chunks = self._assemble(chunks, vectors)
+        self._log_token_usage(embedded_chunks)
+        return embedded_chunks
+
+    def embed_batch(self, chunks: List[Dict]) -> EmbeddingMatrix:
+        """Embed one bounded batch of chunks quietly (used by the streaming pipeline)."""
+        vectors = self._lookup_cache(chunks)
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+
+        for i in range(0, len(pending), self.batch_size):
+            batch_idx = pending[i:i + self.batch_size]
+            batch_texts = [chunks[idx]["text"] for idx in batch_idx]
+            try:
+                response = self._embed_batch_with_retry(batch_texts)
+                batch_vectors = [to_vector(item.embedding) for item in response.data]
+                self._record_success(chunks, batch_idx, batch_texts, batch_vectors, vectors)
+            except Exception as e:
+                logger.warning(f"Batch failed after retries: {type(e).__name__}: {e}")
+                self._record_failure(chunks, batch_idx, e)
+
+        return self._assemble(chunks, vectors)
+
+    def _assemble(self, chunks: List[Dict], vectors: List[Optional[np.ndarray]]) -> EmbeddingMatrix:
+        kept = [(chunk, vector) for chunk, vector in zip(chunks, vectors) if vector is not None]
+        records = [
+            {"text": chunk["text"], "metadata": chunk.get("metadata", {}), "tokens": self._chunk_tokens(chunk)}
+            for chunk, _ in kept
+        ]
+        return EmbeddingMatrix.from_rows(records, [vector for _, vector in kept])
+
+    def _record_failure(self, chunks: List[Dict], batch_idx: List[int], error: Exception):
+        telemetry.incr("embedding.batch_failures")
+        self.failed_batches.append({
+            "indices": list(batch_idx),
+            "texts": [chunks[idx]["text"] for idx in batch_idx],
+            "error": f"{type(error).__name__}: {error}"
+        })
+
+    async def embed_chunks_async(self, chunks: List[Dict]) -> EmbeddingMatrix:
+        """
+        Embed chunks with up to max_concurrency batches in flight.
+
+        Requests are paced by RPM and TPM token buckets instead of a fixed
+        cooldown. On RateLimitError the batch is split and the batch size for
+        subsequent requests is halved; it grows back as batches succeed.
+        Batches that still fail are listed in self.failed_batches.
+        """
+        logger.info(f"🚀 Embedding {len(chunks)} chunks with async batching "
+                    f"(concurrency={self.max_concurrency})...")
+        self.failed_batches = []
+
+        vectors = self._lookup_cache(chunks)
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        token_counts = {i: self._chunk_tokens(chunks[i]) for i in pending}
+        logger.info(f"{len(chunks) - len(pending)} cached, {len(pending)} to embed.")
+
+        client = get_async_embedding_client()
+        request_bucket = TokenBucket(self.requests_per_minute)
+        token_bucket = TokenBucket(self.tokens_per_minute)
+
+        state = {"cursor": 0, "batch_size": self.batch_size}
+        retries = deque()  # (batch indices, attempt)
+        progress = tqdm(total=len(pending), desc="[EmbeddingAgent] Embedding")
+
+        def next_batch():
+            if retries:
+                return retries.popleft()
+            start = state["cursor"]
+            if start >= len(pending):
+                return None
+            state["cursor"] = start + state["batch_size"]
+            return pending[start:state["cursor"]], 1
+
+        async def worker():
+            while True:
+                item = next_batch()
+                if item is None:
+                    return
+                batch_idx, attempt = item
+                batch_texts = [chunks[idx]["text"] for idx in batch_idx]
+
+                await request_bucket.acquire(1)
+                await token_bucket.acquire(sum(token_counts[idx] for idx in batch_idx))
+                start = time.perf_counter()
+                try:
+                    response = await client.embeddings.create(input=batch_texts, model=self.deployment, **self.request_options)
+                except RateLimitError as e:
+                    telemetry.incr("embedding.rate_limited")
+                    delay = retry_after_seconds(e) or min(60, 2 ** attempt) * (0.5 + random.random())
+                    # A 429 may come from either limit, so both budgets back off
+                    request_bucket.pause(delay)
+                    token_bucket.pause(delay)
+                    state["batch_size"] = max(self.min_batch_size, state["batch_size"] // 2)
+                    if attempt >= self.max_attempts:
+                        self._record_failure(chunks, batch_idx, e)
+                        progress.update(len(batch_idx))
+                    elif len(batch_idx) > state["batch_size"]:
+                        # Retry as smaller batches so each fits the shrunken budget
+                        for j in range(0, len(batch_idx), state["batch_size"]):
+                            retries.append((batch_idx[j:j + state["batch_size"]], attempt + 1))
+                    else:
+                        retries.append((batch_idx, attempt + 1))
+                    telemetry.incr("embedding.retries")
+                    continue
+                except (APIConnectionError, InternalServerError) as e:
+                    if attempt >= self.max_attempts:
+                        self._record_failure(chunks, batch_idx, e)
+                        progress.update(len(batch_idx))
+                    else:
+                        await asyncio.sleep(min(60, 2 ** attempt) * (0.5 + random.random()))
+                        retries.append((batch_idx, attempt + 1))
+                        telemetry.incr("embedding.retries")
+                    continue
+                except Exception as e:
+                    logger.warning(f"Batch failed: {type(e).__name__}: {e}")
+                    self._record_failure(chunks, batch_idx, e)
+                    progress.update(len(batch_idx))
+                    continue
+                finally:
+                    telemetry.observe("embedding.api_latency", time.perf_counter() - start)
+
+                batch_vectors = [to_vector(item.embedding) for item in response.data]
+                self._record_success(chunks, batch_idx, batch_texts, batch_vectors, vectors)
+                progress.update(len(batch_idx))
+                # Additive increase back towards the configured batch size
+                state["batch_size"] = min(self.batch_size, state["batch_size"] + 1)
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(max(1, self.max_concurrency))])
+        finally:
+            progress.close()
+
+        if self.failed_batches:
+            failed = sum(len(b["indices"]) for b in self.failed_batches)
+            logger.warning(f"⚠️ {len(self.failed_batches)} batches ({failed} chunks) failed to embed.")
+
+        embedded_chunks = self._assemble(chunks, vectors)
         self._log_token_usage(embedded_chunks)
         return embedded_chunks
 
+    def embed_chunks(self, chunks: List[Dict], use_async: bool = None) -> EmbeddingMatrix:
+        if use_async is None:
+            use_async = os.getenv("EMBEDDING_MODE", "sync") == "async"
+        with telemetry.span("embedding", mode="async" if use_async else "sync", chunks=len(chunks)) as span:
+            if use_async:
+                embedded = self._run_coroutine(self.embed_chunks_async(chunks))
+            else:
+                embedded = self.embed_chunks_sync(chunks)
+            span["failed_batches"] = len(self.failed_batches)
+            return embedded
+
+    def _run_coroutine(self, coroutine):
+        if self.loop is not None:
+            return self.loop.run_until_complete(coroutine)
+        return asyncio.run(coroutine)
+
+    def _chunk_tokens(self, chunk: Dict) -> int:
+        # ChunkingAgent attaches the count; only re-encode chunks that came from elsewhere
+        if "tokens" not in chunk:
+            chunk["tokens"] = self._count_tokens(chunk["text"])
+        return chunk["tokens"]
+
     def _count_tokens(self, text: str) -> int:
-        tokenizer = get_encoding("cl100k_base")
-        return len(tokenizer.encode(text))
+        return count_tokens(text, "cl100k_base")
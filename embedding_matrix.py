@@ -0,0 +1,56 @@
+# server/utils/embedding_matrix.py
+
+import base64
+from typing import Dict, Iterator, List, Sequence
+import numpy as np
+
+
+def to_vector(embedding) -> np.ndarray:
+    """float32 vector from an API embedding: a base64 string or a list of floats."""
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+class EmbeddingMatrix:
+    """
+    Embedded chunks as one contiguous float32 matrix plus a metadata table
+    (text, metadata and token count per row), instead of a Python list of
+    floats per chunk. Indexing returns the usual chunk dict with a row view
+    as "embedding" and slicing returns another EmbeddingMatrix, so code
+    written against lists of embedded chunks keeps working.
+    """
+
+    def __init__(self, vectors: np.ndarray, records: List[Dict]):
+        if len(vectors) != len(records):
+            raise ValueError("vectors and records must have the same length")
+        self.vectors = vectors
+        self.records = records
+
+    @classmethod
+    def from_rows(cls, records: List[Dict], vectors: Sequence[np.ndarray]) -> "EmbeddingMatrix":
+        dim = len(vectors[0]) if len(vectors) else 0
+        matrix = np.empty((len(vectors), dim), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            matrix[i] = vector
+        return cls(matrix, records)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EmbeddingMatrix(self.vectors[index], self.records[index])
+        return {**self.records[index], "embedding": self.vectors[index]}
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self.records)):
+            yield self[i]
@@ -1,22 +1,51 @@
+import os
 from server.pipeline.vector_pipeline import VectorPipeline
 from server.pipeline.dfmea_pipeline import DFMEAPipeline
+from server.utils.checkpoint import RunCheckpoint
+from server.utils import telemetry
+
+logger = telemetry.get_logger("End-to-End")
 
 class DFMEAEndToEndPipeline:
-    def __init__(self, kb_path: str, fi_path: str, query: str = "Generate DFMEA entries for recent field failures", top_k: int = 100):
+    def __init__(self, kb_path: str, fi_path: str, query: str = "Generate DFMEA entries for recent field failures", top_k: int = 100, incremental: bool = None, filters: dict = None, targets: list = None, run_id: str = None):
         self.kb_path = kb_path
         self.fi_path = fi_path
         self.query = query
         self.top_k = top_k
+        self.incremental = incremental
+        self.filters = filters
+        self.targets = targets
+
+        # Passing a run_id (or DFMEA_CHECKPOINT=1) persists each stage, so a failed run
+        # can be resumed with the same run_id and skips everything already finished
+        self.checkpoint = None
+        if run_id or os.getenv("DFMEA_CHECKPOINT", "0") == "1":
+            self.checkpoint = RunCheckpoint(run_id)
+        self.run_id = self.checkpoint.run_id if self.checkpoint else None
 
     def run(self):
-        print("[End-to-End] Starting full DFMEA pipeline...")
+        logger.info("Starting full DFMEA pipeline...")
+        if self.checkpoint:
+            logger.info(f"Run ID: {self.run_id} (checkpoints in {self.checkpoint.path})")
+        with telemetry.span("end_to_end"):
+            output_path = self._run()
+
+        # Writes the JSON run report when DFMEA_RUN_REPORT is set
+        if telemetry.enabled():
+            telemetry.export_run_report()
+        return output_path
 
+    def _run(self):
         # Step 1: Chunk, embed and store in Qdrant
-        vector_pipeline = VectorPipeline(self.kb_path, self.fi_path)
+        vector_pipeline = VectorPipeline(self.kb_path, self.fi_path, incremental=self.incremental,
+                                         checkpoint=self.checkpoint)
         collection_name = vector_pipeline.run()
 
         # Step 2: Use context agent + writer
-        dfmea_pipeline = DFMEAPipeline(collection_name)
-        output_path = dfmea_pipeline.run(query=self.query, top_k=self.top_k)
+        dfmea_pipeline = DFMEAPipeline(collection_name, checkpoint=self.checkpoint)
+        if self.targets:
+            output_path = dfmea_pipeline.run_targets(self.targets, top_k=self.top_k)
+        else:
+            output_path = dfmea_pipeline.run(query=self.query, top_k=self.top_k, filters=self.filters)
 
         return output_path
@@ -1,26 +1,119 @@
 # server/agents/extraction_agent.py
 
+import os
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterator, List
 from server.utils.excel_parser import parse_excel_or_csv
+from server.utils.row_reader import iter_rows
+from server.utils import telemetry
+
+logger = telemetry.get_logger("ExtractionAgent")
+
+SUPPORTED_SUFFIXES = (".csv", ".xlsx", ".xlsm", ".xls")
+
+
+def _resolve_paths(path_spec) -> List[Path]:
+    """A file, a directory (every supported file inside) or a glob pattern."""
+    spec = str(path_spec)
+    if any(ch in spec for ch in "*?["):
+        return [Path(p) for p in sorted(glob.glob(spec, recursive=True)) if Path(p).is_file()]
+    path = Path(spec)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES)
+    return [path] if path.is_file() else []
+
+
+def _read_file(path: str) -> List[Dict]:
+    # Runs in a worker process. The load_* methods keep the original pandas reader for
+    # every file, so row text (and the content-derived point IDs and cache keys) is
+    # unchanged whether one file or many are passed
+    return parse_excel_or_csv(path)
+
+
+def _stream_file(path: str) -> Iterator[Dict]:
+    # The iter_* methods keep the original streaming reader; it has no .xls support
+    if Path(path).suffix.lower() == ".xls":
+        yield from parse_excel_or_csv(path)
+    else:
+        yield from iter_rows(path)
+
 
 class ExtractionAgent:
-    def __init__(self, kb_path=None, fi_path=None):
+    def __init__(self, kb_path=None, fi_path=None, max_workers: int = None):
         base_dir = Path(__file__).resolve().parent.parent
 
         # Use default sample files if none provided
-        self.kb_path = Path(kb_path) if kb_path else base_dir / "sample_files" / "dfmea_knowledge_bank_3.csv"
-        self.fi_path = Path(fi_path) if fi_path else base_dir / "sample_files" / "field_reported_issues_3.xlsx"
+        kb_spec = kb_path or base_dir / "sample_files" / "dfmea_knowledge_bank_3.csv"
+        fi_spec = fi_path or base_dir / "sample_files" / "field_reported_issues_3.xlsx"
+        self.kb_paths = _resolve_paths(kb_spec)
+        self.fi_paths = _resolve_paths(fi_spec)
+        self.max_workers = max_workers or int(os.getenv("EXTRACTION_WORKERS", min(8, os.cpu_count() or 1)))
 
         # Validate file paths
-        if not self.kb_path.is_file():
-            raise FileNotFoundError(f"Knowledge Bank file not found: {self.kb_path}")
-        if not self.fi_path.is_file():
-            raise FileNotFoundError(f"Field Issues file not found: {self.fi_path}")
+        if not self.kb_paths:
+            raise FileNotFoundError(f"Knowledge Bank file not found: {kb_spec}")
+        if not self.fi_paths:
+            raise FileNotFoundError(f"Field Issues file not found: {fi_spec}")
+        self.kb_path = self.kb_paths[0]
+        self.fi_path = self.fi_paths[0]
+
+    def _load(self, paths: List[Path]) -> List[Dict]:
+        if len(paths) == 1:
+            return _read_file(str(paths[0]))
+        rows = []
+        for file_rows in self._iter_files(paths):
+            rows.extend(file_rows)
+        return rows
+
+    def _iter_files(self, paths: List[Path]) -> Iterator[List[Dict]]:
+        """
+        Parse files in a process pool and yield each file's rows in path
+        order. At most 2 * max_workers files are in flight, so parsed-but-
+        unconsumed rows stay bounded however many files match.
+        """
+        workers = max(1, min(self.max_workers, len(paths)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            remaining = iter(paths)
+            for path in remaining:
+                pending.append((path, pool.submit(_read_file, str(path))))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                path, future = pending.popleft()
+                rows = future.result()
+                logger.info(f"Parsed {len(rows)} rows from {path}")
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append((next_path, pool.submit(_read_file, str(next_path))))
+                yield rows
+
+    def _iter(self, paths: List[Path]) -> Iterator[Dict]:
+        # Files are streamed one after another, so memory stays bounded by the consumer
+        for path in paths:
+            yield from _stream_file(str(path))
 
     def load_knowledge_bank(self):
-        print(f"[ExtractionAgent] Loading DFMEA Knowledge Bank: {self.kb_path}")
-        return parse_excel_or_csv(str(self.kb_path))
+        logger.info(f"Loading DFMEA Knowledge Bank: {', '.join(map(str, self.kb_paths))}")
+        with telemetry.span("extraction", source="knowledge_bank", files=len(self.kb_paths)) as span:
+            rows = self._load(self.kb_paths)
+            span["rows"] = len(rows)
+        return rows
 
     def load_field_issues(self):
-        print(f"[ExtractionAgent] Loading Field Reported Issues: {self.fi_path}")
-        return parse_excel_or_csv(str(self.fi_path))
+        logger.info(f"Loading Field Reported Issues: {len(self.fi_paths)} file(s), first {self.fi_path}")
+        with telemetry.span("extraction", source="field_issues", files=len(self.fi_paths)) as span:
+            rows = self._load(self.fi_paths)
+            span["rows"] = len(rows)
+        return rows
+
+    def iter_knowledge_bank(self):
+        logger.info(f"Streaming DFMEA Knowledge Bank: {', '.join(map(str, self.kb_paths))}")
+        return self._iter(self.kb_paths)
+
+    def iter_field_issues(self):
+        logger.info(f"Streaming Field Reported Issues: {len(self.fi_paths)} file(s), first {self.fi_path}")
+        return self._iter(self.fi_paths)
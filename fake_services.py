@@ -0,0 +1,206 @@
+# server/benchmarks/fake_services.py
+
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from types import SimpleNamespace
+from typing import List
+import httpx
+import numpy as np
+from openai import RateLimitError, InternalServerError
+
+
+class ServiceProfile:
+    """
+    Behaviour of a fake endpoint: per-call latency (base + per-item), a
+    requests-per-minute ceiling that answers 429 with Retry-After, and a
+    probability of injecting a 500.
+    """
+
+    def __init__(self, latency: float = 0.05, per_item_latency: float = 0.0, jitter: float = 0.2,
+                 requests_per_minute: int = 0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.latencies: List[float] = []
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    def admit(self, items: int = 1) -> float:
+        """Raise the error this call should fail with, or return how long it should take."""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            if self.requests_per_minute:
+                while self._window and now - self._window[0] > 60:
+                    self._window.popleft()
+                if len(self._window) >= self.requests_per_minute:
+                    self.rate_limited += 1
+                    retry_after = max(0.0, 60 - (now - self._window[0]))
+                    raise _error(RateLimitError, 429, "Rate limit exceeded (fake)", retry_after)
+                self._window.append(now)
+            if self.error_rate and self.rng.random() < self.error_rate:
+                self.errors += 1
+                raise _error(InternalServerError, 500, "Injected server error (fake)")
+            delay = self.latency + self.per_item_latency * items
+            return delay * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "latency": percentiles(self.latencies),
+        }
+
+
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    values = np.asarray(samples)
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def _error(cls, status: int, message: str, retry_after: float = None):
+    headers = {"retry-after": f"{retry_after:.3f}"} if retry_after is not None else {}
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "http://fake.local"))
+    return cls(message, response=response, body=None)
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    # Deterministic per text, so caches and dedup behave as with the real service
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _embedding_response(inputs, dim: int):
+    texts = [inputs] if isinstance(inputs, str) else list(inputs)
+    data = [SimpleNamespace(index=i, embedding=fake_embedding(str(t), dim)) for i, t in enumerate(texts)]
+    return SimpleNamespace(data=data, usage=SimpleNamespace(prompt_tokens=sum(len(str(t)) // 4 for t in texts)))
+
+
+class FakeEmbeddingClient:
+    """Drop-in for AzureOpenAI: exposes .embeddings.create(input=..., model=...)."""
+
+    def __init__(self, profile: ServiceProfile = None, dim: int = 1536):
+        self.profile = profile or ServiceProfile()
+        self.dim = dim
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _create(self, input, model=None, **kwargs):
+        items = 1 if isinstance(input, str) else len(input)
+        start = time.perf_counter()
+        time.sleep(self.profile.admit(items))
+        response = _embedding_response(input, kwargs.get("dimensions") or self.dim)
+        self.profile.record(time.perf_counter() - start)
+        return response
+
+
+class FakeAsyncEmbeddingClient(FakeEmbeddingClient):
+    """Drop-in for AsyncAzureOpenAI embeddings."""
+
+    async def _create(self, input, model=None, **kwargs):
+        items = 1 if isinstance(input, str) else len(input)
+        start = time.perf_counter()
+        await asyncio.sleep(self.profile.admit(items))
+        response = _embedding_response(input, kwargs.get("dimensions") or self.dim)
+        self.profile.record(time.perf_counter() - start)
+        return response
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncChatClient:
+    """
+    Drop-in for AsyncAzureOpenAI chat completions. Answers every prompt with
+    1–3 schema-shaped DFMEA entries derived from the chunk text, optionally
+    streamed in small deltas.
+    """
+
+    def __init__(self, profile: ServiceProfile = None, stream_chunk_chars: int = 40):
+        self.profile = profile or ServiceProfile(latency=1.0, per_item_latency=0.0005)
+        self.stream_chunk_chars = stream_chunk_chars
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model=None, messages=None, stream=False, **kwargs):
+        user_msg = messages[-1]["content"] if messages else ""
+        start = time.perf_counter()
+        delay = self.profile.admit(len(user_msg) // 4)
+        content = json.dumps(self._entries(user_msg))
+
+        if not stream:
+            await asyncio.sleep(delay)
+            self.profile.record(time.perf_counter() - start)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+        async def events():
+            pieces = [content[i:i + self.stream_chunk_chars] for i in range(0, len(content), self.stream_chunk_chars)]
+            for piece in pieces:
+                await asyncio.sleep(delay / max(len(pieces), 1))
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+            self.profile.record(time.perf_counter() - start)
+
+        return events()
+
+    @staticmethod
+    def _field(text: str, name: str, default: str) -> str:
+        match = re.search(rf"{name}\s*:\s*([^|\n]+)", text, flags=re.IGNORECASE)
+        return match.group(1).strip() if match else default
+
+    def _entries(self, user_msg: str) -> List[dict]:
+        chunks = [c for c in user_msg.split("\n\n")[1:] if c.strip()] or [user_msg]
+        rng = random.Random(hashlib.md5(user_msg.encode("utf-8")).hexdigest())
+        entries = []
+        for i, chunk in enumerate(chunks[:rng.randint(1, 3)], 1):
+            severity, occurrence, detection = rng.randint(2, 9), rng.randint(1, 8), rng.randint(1, 8)
+            entries.append({
+                "ID": i,
+                "Product": self._field(chunk, "product", "TC57"),
+                "Subsystems": [{
+                    "Subsystem": "Display",
+                    "Components": [{
+                        "Component": self._field(chunk, "part_category", "Touch Panel"),
+                        "Function": "Display output and touch input",
+                        "FailureModes": [{
+                            "FailureMode": self._field(chunk, "fault_type", self._field(chunk, "Potential Failure Mode", "No display")),
+                            "Effects": [{"Effect": "User cannot operate device", "Severity": severity}],
+                            "Causes": [{
+                                "Cause": self._field(chunk, "Potential Causes", "Connector damage"),
+                                "Occurrence": occurrence,
+                                "Detection": detection,
+                                "Controls Prevention": ["Design margin review"],
+                                "Controls Detection": ["Drop test"],
+                                "Recommended Actions": ["Add connector retention"],
+                                "RPN": severity * occurrence * detection,
+                                "linked_to_dfmea_kb": "knowledge_bank" in chunk
+                            }]
+                        }]
+                    }]
+                }]
+            })
+        return entries
+
+    async def close(self):
+        pass
@@ -0,0 +1,88 @@
+# server/utils/json_stream.py
+
+import json
+from typing import Dict, List
+
+
+class IncrementalJSONArrayParser:
+    """
+    Parse a top-level JSON array of objects while its text is still arriving.
+
+    feed() returns each element object as soon as its closing brace arrives.
+    Leading noise such as markdown fences is skipped, an element that fails to
+    decode is dropped without affecting its neighbours, and a truncated tail
+    simply never yields its last partial element.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0            # Next character of buffer to scan
+        self.started = False    # Seen the opening '['
+        self.complete = False   # Seen the matching closing ']'
+        self.depth = 0          # Nesting depth, the top-level array counts as 1
+        self.in_string = False
+        self.escape = False
+        self.obj_start = None   # Buffer offset of the element being scanned
+        self.emitted = 0
+        self.errors = 0
+
+    def feed(self, text: str) -> List[Dict]:
+        if self.complete:
+            return []
+        self.buffer += text
+        entries = []
+
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+
+            if not self.started:
+                if ch == "[":
+                    self.started = True
+                    self.depth = 1
+                i += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                if self.depth == 1 and ch == "{":
+                    self.obj_start = i
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1 and ch == "}" and self.obj_start is not None:
+                    entry = self._decode(buf[self.obj_start:i + 1])
+                    if entry is not None:
+                        entries.append(entry)
+                    self.obj_start = None
+                elif self.depth == 0:
+                    self.complete = True
+                    i += 1
+                    break
+            i += 1
+
+        # Drop text that can no longer be part of an unfinished element
+        keep_from = self.obj_start if self.obj_start is not None else i
+        self.buffer = buf[keep_from:]
+        self.pos = i - keep_from
+        if self.obj_start is not None:
+            self.obj_start = 0
+        return entries
+
+    def _decode(self, text: str):
+        try:
+            entry = json.loads(text)
+        except json.JSONDecodeError:
+            self.errors += 1
+            return None
+        self.emitted += 1
+        return entry if isinstance(entry, dict) else None
@@ -0,0 +1,138 @@
+# server/utils/lexical_index.py
+
+import os
+import re
+import pickle
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+# Keeps part numbers and fault codes ("FC-101", "TC57", "1.2mm") as single tokens
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_FORMAT_VERSION = 1
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        # "fc-101" also matches queries that write "fc 101"
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk text, with the same payload filters as
+    the vector backends. Postings are numpy arrays, so scoring a query is
+    one vectorised update per query term.
+    """
+
+    def __init__(self, fields: Iterable[str], k1: float = 1.2, b: float = 0.75):
+        self.fields = tuple(fields)
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.field_values: Dict[str, Tuple[np.ndarray, Dict[str, np.ndarray]]] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, records: Iterable[Tuple[str, Dict]]):
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        field_rows = {field: {} for field in self.fields}
+        ids = []
+
+        for doc, (pid, payload) in enumerate(records):
+            ids.append(pid)
+            terms = Counter(tokenize(payload.get("text", "")))
+            lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(doc)
+                tfs.append(tf)
+            for field in self.fields:
+                value = payload.get(field)
+                if value not in (None, ""):
+                    field_rows[field].setdefault(str(value), []).append(doc)
+
+        self.ids = ids
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for term, (docs, tfs) in postings.items()
+        }
+        self.field_values = {}
+        for field, by_value in field_rows.items():
+            has_field = np.zeros(len(ids), dtype=bool)
+            for rows in by_value.values():
+                has_field[rows] = True
+            self.field_values[field] = (has_field, {v: np.asarray(rows, dtype=np.int32) for v, rows in by_value.items()})
+        return self
+
+    def _allowed_mask(self, filters: Dict[str, List[str]]):
+        if not filters:
+            return None
+        allowed = np.ones(len(self.ids), dtype=bool)
+        for field, values in filters.items():
+            has_field, by_value = self.field_values.get(field, (np.zeros(len(self.ids), dtype=bool), {}))
+            passes = ~has_field
+            for value in values:
+                if value in by_value:
+                    passes[by_value[value]] = True
+            allowed &= passes
+        return allowed
+
+    def search(self, query: str, top_k: int, filters: Dict[str, List[str]] = None) -> List[Tuple[str, float]]:
+        """Return up to top_k (point_id, bm25_score) pairs, filters applied before ranking."""
+        if not self.ids:
+            return []
+        n_docs = len(self.ids)
+        avg_length = float(self.doc_lengths.mean()) or 1.0
+        scores = np.zeros(n_docs, dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, tfs = self.postings[term]
+            idf = np.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / avg_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        allowed = self._allowed_mask(filters)
+        if allowed is not None:
+            scores[~allowed] = 0
+
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return []
+        k = min(top_k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((_FORMAT_VERSION, self.__dict__), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Return the saved index, or None if it is missing or from an older format."""
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            version, state = pickle.load(f)
+        if version != _FORMAT_VERSION:
+            return None
+        index = cls.__new__(cls)
+        index.__dict__.update(state)
+        return index
@@ -0,0 +1,137 @@
+# server/utils/llm_scheduler.py
+
+import os
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, List, Optional, TypeVar
+from openai import RateLimitError
+from server.utils.rate_limiter import TokenBucket, retry_after_seconds
+from server.utils import telemetry
+
+T = TypeVar("T")
+
+logger = telemetry.get_logger("LLMScheduler")
+
+
+class LLMScheduler:
+    """
+    Admission control for chat completions.
+
+    At most max_concurrency calls are in flight, and every call first draws
+    one request from the RPM bucket and its estimated token cost from the TPM
+    bucket. Failed calls are retried with full-jitter exponential backoff; a
+    429 honours Retry-After and pauses the whole budget, not just one call.
+    """
+
+    def __init__(self, max_concurrency: int = None, tokens_per_minute: int = None,
+                 requests_per_minute: int = None, max_attempts: int = None,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+        self.tokens_per_minute = tokens_per_minute or int(os.getenv("LLM_TPM", 30_000))
+        self.requests_per_minute = requests_per_minute or int(os.getenv("LLM_RPM", 180))
+        self.max_attempts = max_attempts or int(os.getenv("LLM_MAX_ATTEMPTS", 6))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.retries = 0
+        self._loop = None
+        self._bind()
+
+    def _bind(self):
+        # asyncio primitives belong to one event loop; rebuild them when a new loop runs us
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is self._loop and loop is not None:
+            return
+        self._loop = loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.token_bucket = TokenBucket(self.tokens_per_minute)
+        self.request_bucket = TokenBucket(self.requests_per_minute)
+        # A cancel() that arrived before this loop ran us still applies to the coming run
+        cancelled = asyncio.Event()
+        if getattr(self, "_cancelled", None) is not None and self._cancelled.is_set():
+            cancelled.set()
+        self._cancelled = cancelled
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def cancel(self):
+        """
+        Stop admitting new calls and abort the current run_all(), or the next
+        one if none is running yet. Safe to call from any thread.
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._cancelled.set)
+        else:
+            self._cancelled.set()
+
+    async def submit(self, call: Callable[[], Awaitable[T]], tokens: int, label: str = "call") -> T:
+        self._bind()
+        for attempt in range(1, self.max_attempts + 1):
+            if self._cancelled.is_set():
+                raise asyncio.CancelledError(f"{label} cancelled")
+
+            async with self.semaphore:
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(tokens)
+                try:
+                    return await call()
+                except asyncio.CancelledError:
+                    raise
+                except RateLimitError as e:
+                    telemetry.incr("llm.rate_limited")
+                    delay = retry_after_seconds(e) or self._backoff(attempt)
+                    self.request_bucket.pause(delay)
+                    self.token_bucket.pause(delay)
+                    error = e
+                except Exception as e:
+                    delay = self._backoff(attempt)
+                    error = e
+
+            if attempt == self.max_attempts:
+                raise error
+            self.retries += 1
+            telemetry.incr("llm.retries")
+            logger.warning(f"{label} attempt {attempt} failed: {type(error).__name__}: {error}. "
+                           f"Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def run_all(self, coros: List[Awaitable[T]], timeout: Optional[float] = None) -> List[Optional[T]]:
+        """
+        Run coroutines concurrently until all finish, the deadline passes or
+        cancel() is called. Unfinished coroutines are cancelled and their slot
+        in the result list is None.
+        """
+        self._bind()
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        cancel_waiter = asyncio.ensure_future(self._cancelled.wait())
+        deadline = time.monotonic() + timeout if timeout else None
+
+        try:
+            pending = set(tasks)
+            while pending and not self._cancelled.is_set():
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    logger.warning("Deadline reached; cancelling remaining calls.")
+                    break
+                _, pending = await asyncio.wait(
+                    pending | {cancel_waiter}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                pending.discard(cancel_waiter)
+        finally:
+            cancel_waiter.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Cancellation is scoped to one run; a long-lived loop (the worker) reuses this scheduler
+            self._cancelled.clear()
+
+        return [
+            task.result() if task.done() and not task.cancelled() and task.exception() is None else None
+            for task in tasks
+        ]
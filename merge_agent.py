@@ -0,0 +1,238 @@
+# server/agents/merge_agent.py
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from server.agents.vectorstore_agent import VectorStoreAgent
+from server.utils import telemetry
+
+logger = telemetry.get_logger("MergeAgent")
+
+# Rows per block of the cause x knowledge-bank similarity product
+_BLOCK = 4096
+
+LIST_FIELDS = ("Controls Prevention", "Controls Detection", "Recommended Actions")
+
+
+def merge_enabled() -> bool:
+    # DFMEA_MERGE=0 writes the model's own RPN and KB links instead
+    return os.getenv("DFMEA_MERGE", "1") != "0"
+
+
+def _norm(text) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def _score(value) -> Optional[int]:
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2 or not len(matrix):
+        return np.zeros((0, 0), dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+class MergeAgent:
+    """
+    Post-generation stage between ContextAgent and WriterAgent:
+
+    - Embeds every generated "component: failure mode" and "failure mode:
+      cause" text in requests of up to 2048 inputs, outside the query cache.
+    - Links each cause to its most similar knowledge-bank chunk in the
+      collection with one similarity matrix product, and sets
+      linked_to_dfmea_kb and matched_kb_id from that match.
+    - Merges failure modes that parallel batches produced twice for the
+      same product/subsystem/component. Duplicate causes within a failure
+      mode are merged too.
+    - Recomputes every RPN as the failure mode's highest Severity x
+      Occurrence x Detection.
+    """
+
+    def __init__(self, vectorstore: VectorStoreAgent, kb_threshold: float = None, duplicate_threshold: float = None):
+        self.vectorstore = vectorstore
+        self.kb_threshold = kb_threshold or float(os.getenv("KB_LINK_THRESHOLD", 0.85))
+        self.duplicate_threshold = duplicate_threshold or float(os.getenv("MERGE_DUPLICATE_THRESHOLD", 0.92))
+        # Loaded once per run: nothing cheap identifies a collection's content, so
+        # reusing the matrix across runs could link causes to stale KB vectors
+        self._kb: Optional[Tuple[List[str], np.ndarray]] = None
+
+    # -- knowledge-bank vectors --------------------------------------------
+
+    def _kb_matrix(self) -> Tuple[List[str], np.ndarray]:
+        if self._kb is not None:
+            return self._kb
+        backend = self.vectorstore.backend
+        name = self.vectorstore.collection_name
+        point_ids, kb_ids = [], []
+        for pid, payload in backend.iter_payloads(filters={"source": "knowledge_bank"}):
+            point_ids.append(pid)
+            kb_ids.append(str(payload.get("kb_id") or pid))
+        vectors = {}
+        for i in range(0, len(point_ids), 1000):
+            vectors.update(backend.vectors(point_ids[i:i + 1000]))
+        keep = [i for i, pid in enumerate(point_ids) if pid in vectors]
+        kb_ids = [kb_ids[i] for i in keep]
+        matrix = _unit_rows([vectors[point_ids[i]] for i in keep])
+
+        logger.info(f"Loaded {len(kb_ids)} knowledge-bank vectors from '{name}'.")
+        self._kb = (kb_ids, matrix)
+        return self._kb
+
+    def _link(self, causes: List[Dict], vectors: np.ndarray):
+        kb_ids, kb_matrix = self._kb_matrix()
+        if not len(kb_ids):
+            logger.warning("No knowledge-bank vectors in the collection; no causes linked.")
+            for cause in causes:
+                cause["linked_to_dfmea_kb"] = False
+                cause["matched_kb_id"] = ""
+            return
+
+        linked = 0
+        for start in range(0, len(causes), _BLOCK):
+            scores = vectors[start:start + _BLOCK] @ kb_matrix.T
+            best = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(best)), best]
+            for cause, row, score in zip(causes[start:start + _BLOCK], best, best_scores):
+                is_linked = bool(score >= self.kb_threshold)
+                cause["linked_to_dfmea_kb"] = is_linked
+                cause["matched_kb_id"] = kb_ids[row] if is_linked else ""
+                linked += is_linked
+        telemetry.incr("merge.kb_links", linked)
+        logger.info(f"Linked {linked}/{len(causes)} causes to the knowledge bank.")
+
+    # -- merging -----------------------------------------------------------
+
+    def _cluster(self, rows: List[int], vectors: np.ndarray) -> List[List[int]]:
+        """Greedy clustering: each row joins the first kept row it is at least duplicate_threshold similar to."""
+        kept, clusters = [], []
+        for row in rows:
+            if kept:
+                similarity = vectors[kept] @ vectors[row]
+                best = int(similarity.argmax())
+                if similarity[best] >= self.duplicate_threshold:
+                    clusters[best].append(row)
+                    continue
+            kept.append(row)
+            clusters.append([row])
+        return clusters
+
+    @staticmethod
+    def _merge_effects(failure_modes: List[Dict]) -> List[Dict]:
+        effects = {}
+        for fm in failure_modes:
+            for effect in fm.get("Effects", []):
+                key = _norm(effect.get("Effect"))
+                current = effects.get(key)
+                if current is None:
+                    effects[key] = dict(effect)
+                elif (_score(effect.get("Severity")) or 0) > (_score(current.get("Severity")) or 0):
+                    current["Severity"] = effect.get("Severity")
+        return list(effects.values())
+
+    @staticmethod
+    def _merge_causes(causes: List[Dict]) -> Dict:
+        # Worst case wins for the ratings; control and action lists are unioned
+        merged = dict(causes[0])
+        for field in ("Occurrence", "Detection"):
+            values = [_score(c.get(field)) for c in causes if _score(c.get(field)) is not None]
+            if values:
+                merged[field] = max(values)
+        for field in LIST_FIELDS:
+            seen, items = set(), []
+            for cause in causes:
+                values = cause.get(field) or []
+                for item in values if isinstance(values, list) else [values]:
+                    if _norm(item) and _norm(item) not in seen:
+                        seen.add(_norm(item))
+                        items.append(item)
+            merged[field] = items
+        linked = [c for c in causes if c.get("linked_to_dfmea_kb")]
+        if linked:
+            merged["linked_to_dfmea_kb"] = True
+            merged["matched_kb_id"] = linked[0].get("matched_kb_id", "")
+        return merged
+
+    @staticmethod
+    def _set_rpn(failure_mode: Dict):
+        severities = [_score(e.get("Severity")) for e in failure_mode.get("Effects", [])]
+        severity = max((s for s in severities if s is not None), default=None)
+        for cause in failure_mode.get("Causes", []):
+            occurrence, detection = _score(cause.get("Occurrence")), _score(cause.get("Detection"))
+            if None in (severity, occurrence, detection):
+                cause["RPN"] = ""
+            else:
+                cause["RPN"] = severity * occurrence * detection
+
+    # -- entry point -------------------------------------------------------
+
+    @telemetry.traced("merge")
+    def run(self, entries: List[Dict]) -> List[Dict]:
+        # Flat views over the nested entries: one record per failure mode and per cause
+        failure_modes, causes, cause_owner = [], [], []
+        for entry in entries:
+            for sub in entry.get("Subsystems", []):
+                for comp in sub.get("Components", []):
+                    key = (_norm(entry.get("Product")), _norm(sub.get("Subsystem")), _norm(comp.get("Component")))
+                    for fm in comp.get("FailureModes", []):
+                        fm_index = len(failure_modes)
+                        failure_modes.append({"key": key, "comp": comp, "fm": fm,
+                                              "text": f"{comp.get('Component', '')}: {fm.get('FailureMode', '')}"})
+                        for cause in fm.get("Causes", []):
+                            causes.append({"cause": cause, "text": f"{fm.get('FailureMode', '')}: {cause.get('Cause', '')}"})
+                            cause_owner.append(fm_index)
+        if not failure_modes:
+            return entries
+
+        texts = list(dict.fromkeys([f["text"] for f in failure_modes] + [c["text"] for c in causes]))
+        position = {text: i for i, text in enumerate(texts)}
+        # Generated texts are one-off, so they bypass the query cache
+        embedded = _unit_rows(self.vectorstore.embed_queries(texts, use_cache=False))
+        fm_vectors = embedded[[position[f["text"]] for f in failure_modes]]
+        cause_vectors = embedded[[position[c["text"]] for c in causes]] if causes else np.zeros((0, embedded.shape[1]), np.float32)
+
+        if causes:
+            self._link([c["cause"] for c in causes], cause_vectors)
+
+        # Index of failure modes per product/subsystem/component; duplicates only merge within a key
+        by_key: Dict[Tuple, List[int]] = {}
+        for i, f in enumerate(failure_modes):
+            by_key.setdefault(f["key"], []).append(i)
+        causes_of: Dict[int, List[int]] = {}
+        for c, owner in enumerate(cause_owner):
+            causes_of.setdefault(owner, []).append(c)
+
+        merged_away = set()
+        for rows in by_key.values():
+            for cluster in self._cluster(rows, fm_vectors):
+                head = failure_modes[cluster[0]]["fm"]
+                members = [failure_modes[i]["fm"] for i in cluster]
+                cause_rows = [c for i in cluster for c in causes_of.get(i, [])]
+                head["Effects"] = self._merge_effects(members)
+                head["Causes"] = [self._merge_causes([causes[c]["cause"] for c in group])
+                                  for group in self._cluster(cause_rows, cause_vectors)]
+                self._set_rpn(head)
+                merged_away.update(cluster[1:])
+
+        for i in merged_away:
+            comp = failure_modes[i]["comp"]
+            comp["FailureModes"] = [fm for fm in comp["FailureModes"] if fm is not failure_modes[i]["fm"]]
+
+        # Drop anything left empty by the merge and renumber
+        merged = []
+        for entry in entries:
+            for sub in entry.get("Subsystems", []):
+                sub["Components"] = [c for c in sub.get("Components", []) if c.get("FailureModes")]
+            entry["Subsystems"] = [s for s in entry.get("Subsystems", []) if s.get("Components")]
+            if entry["Subsystems"]:
+                entry["ID"] = len(merged) + 1
+                merged.append(entry)
+
+        telemetry.incr("merge.failure_modes_merged", len(merged_away))
+        logger.info(f"Merged {len(merged_away)} duplicate failure modes; {len(merged)} entries remain.")
+        return merged
@@ -0,0 +1,128 @@
+# server/utils/quantization.py
+
+from typing import Optional
+import numpy as np
+
+# Rows scored per block, so decoding never materialises a full float32 copy
+_BLOCK = 8192
+
+
+class ScalarQuantizer:
+    """
+    Per-dimension int8 scalar quantization: 4x smaller than float32. Inner
+    products are computed against the codes directly,
+    q . x ~= q . lo + (q * scale) . code.
+    """
+
+    def __init__(self):
+        self.lo = None
+        self.scale = None
+        self.codes = None
+
+    def fit(self, matrix: np.ndarray, rows: np.ndarray):
+        lo = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+        hi = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+        for i in range(0, len(rows), _BLOCK):
+            block = matrix[rows[i:i + _BLOCK]]
+            lo = np.minimum(lo, block.min(axis=0))
+            hi = np.maximum(hi, block.max(axis=0))
+        self.lo = lo
+        self.scale = np.where(hi > lo, (hi - lo) / 255.0, 1.0).astype(np.float32)
+        return self
+
+    def encode(self, matrix: np.ndarray, count: int):
+        self.codes = np.empty((count, matrix.shape[1]), dtype=np.uint8)
+        for i in range(0, count, _BLOCK):
+            block = matrix[i:i + _BLOCK]
+            self.codes[i:i + _BLOCK] = np.clip(np.rint((block - self.lo) / self.scale), 0, 255).astype(np.uint8)
+        return self
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        weights = query * self.scale
+        offset = float(query @ self.lo)
+        codes = self.codes if rows is None else self.codes[rows]
+        out = np.empty(len(codes), dtype=np.float32)
+        for i in range(0, len(codes), _BLOCK):
+            out[i:i + _BLOCK] = codes[i:i + _BLOCK].astype(np.float32) @ weights + offset
+        return out
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vectors are split into `subspaces` slices and each
+    slice is replaced by the index of its nearest of 256 k-means centroids,
+    so a 1536-d float32 vector shrinks to `subspaces` bytes. Queries use
+    asymmetric distance: a (subspaces x 256) table of partial inner products
+    is looked up and summed per row.
+    """
+
+    def __init__(self, subspaces: int = 96, iterations: int = 8, sample_size: int = 20_000, seed: int = 0):
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids = None  # (subspaces, k, sub_dim)
+        self.codes = None
+
+    def _split(self, dim: int) -> int:
+        # Largest subspace count <= the requested one that divides the dimension
+        m = max(1, min(self.subspaces, dim))
+        while dim % m:
+            m -= 1
+        return m
+
+    def fit(self, matrix: np.ndarray, rows: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        sample = matrix[np.sort(rng.choice(rows, size=min(len(rows), self.sample_size), replace=False))]
+        self.subspaces = self._split(sample.shape[1])
+        sub_dim = sample.shape[1] // self.subspaces
+        k = min(256, len(sample))
+
+        centroids = np.empty((self.subspaces, k, sub_dim), dtype=np.float32)
+        for m in range(self.subspaces):
+            part = np.ascontiguousarray(sample[:, m * sub_dim:(m + 1) * sub_dim])
+            centers = part[rng.choice(len(part), size=k, replace=False)].copy()
+            for _ in range(self.iterations):
+                assign = self._nearest(part, centers)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, assign, part)
+                counts = np.bincount(assign, minlength=k)[:, None]
+                centers = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+            centroids[m] = centers
+        self.centroids = centroids
+        return self
+
+    @staticmethod
+    def _nearest(part: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        # argmin ||x - c||^2 == argmax (x . c - ||c||^2 / 2)
+        return np.argmax(part @ centers.T - 0.5 * (centers ** 2).sum(axis=1), axis=1)
+
+    def encode(self, matrix: np.ndarray, count: int):
+        sub_dim = self.centroids.shape[2]
+        self.codes = np.empty((count, self.subspaces), dtype=np.uint8)
+        for i in range(0, count, _BLOCK):
+            block = np.asarray(matrix[i:i + _BLOCK], dtype=np.float32)
+            for m in range(self.subspaces):
+                self.codes[i:i + _BLOCK, m] = self._nearest(block[:, m * sub_dim:(m + 1) * sub_dim], self.centroids[m])
+        return self
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        sub_dim = self.centroids.shape[2]
+        table = np.einsum("mkd,md->mk", self.centroids, query.reshape(self.subspaces, sub_dim))
+        codes = self.codes if rows is None else self.codes[rows]
+        out = np.empty(len(codes), dtype=np.float32)
+        columns = np.arange(self.subspaces)
+        for i in range(0, len(codes), _BLOCK):
+            out[i:i + _BLOCK] = table[columns, codes[i:i + _BLOCK]].sum(axis=1)
+        return out
+
+
+def make_quantizer(kind: str, subspaces: int = 96):
+    kind = (kind or "none").lower()
+    if kind in ("none", ""):
+        return None
+    if kind == "scalar":
+        return ScalarQuantizer()
+    if kind == "product":
+        return ProductQuantizer(subspaces=subspaces)
+    raise ValueError(f"Unknown vector quantization: {kind}")
@@ -0,0 +1,63 @@
+# server/utils/rate_limiter.py
+
+import time
+import asyncio
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at capacity_per_minute / 60 per second.
+
+    One bucket per budget: use amount=1 for requests-per-minute and the
+    request's token count for tokens-per-minute.
+    """
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        # A single request larger than the whole budget must still go through eventually
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Block all acquirers for the given time (e.g. after a 429 with Retry-After)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Extract the server-suggested delay from an OpenAI API error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after-ms", "retry-after"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            continue
+        return seconds / 1000.0 if header.endswith("-ms") else seconds
+    return None
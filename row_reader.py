@@ -0,0 +1,43 @@
+# server/utils/row_reader.py
+
+import csv
+from pathlib import Path
+from typing import Dict, Iterator
+
+
+def iter_rows(file_path: str) -> Iterator[Dict]:
+    """
+    Yield rows of a CSV or XLSX file one at a time as dicts keyed by header,
+    without loading the whole sheet into memory.
+    """
+    suffix = Path(file_path).suffix.lower()
+    if suffix == ".csv":
+        yield from _iter_csv(file_path)
+    elif suffix in (".xlsx", ".xlsm"):
+        yield from _iter_xlsx(file_path)
+    else:
+        raise ValueError(f"Unsupported file type for streaming: {file_path}")
+
+
+def _iter_csv(file_path: str) -> Iterator[Dict]:
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield {k: v for k, v in row.items() if k is not None}
+
+
+def _iter_xlsx(file_path: str) -> Iterator[Dict]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(h).strip() if h is not None else f"column_{i}" for i, h in enumerate(header)]
+        for values in rows:
+            if values is None or all(v is None for v in values):
+                continue
+            yield {col: ("" if v is None else v) for col, v in zip(columns, values)}
+    finally:
+        workbook.close()
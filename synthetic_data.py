@@ -0,0 +1,84 @@
+# server/benchmarks/synthetic_data.py
+
+import os
+import csv
+import random
+from datetime import date, timedelta
+from typing import Tuple
+
+# Same header as sample_files/dfmea_knowledge_bank_3.csv
+KB_COLUMNS = [
+    "ID", "Function", "Potential Failure Mode", "Image1 - Failure Mode", "Image2 - Failure Mode", "TDM", "SPR",
+    "Potential Failure Effects", "SEVERITY", "Potential Causes", "Image - Root Cause", "OCCURRENCE",
+    "Preventive Controls", "Image - Prevention", "Detection Controls", "Image - Detection", "DETECTION", "RPN",
+    "PFMEA Linkage", "SPRRefLink", "JIRA", "JIRARefLink"
+]
+
+FI_COLUMNS = ["issue_id", "product", "fault_code", "part_category", "fault_type", "reported_date", "site", "comments"]
+
+PRODUCTS = ["TC57", "TC52", "TC21", "MC9300", "ET40", "ET45", "TC72", "WT6300"]
+SUBSYSTEMS = ["Display", "Battery", "Scanner", "Audio", "Housing", "Keypad"]
+PARTS = ["Touch Panel", "LCD", "Backlight", "Display FPC", "Cover Lens", "Display Connector", "Digitizer"]
+FAULTS = [
+    "No display", "Flickering", "Ghost touch", "Dead pixels", "Cracked lens", "Mura", "Dim backlight",
+    "Touch unresponsive", "Lines on screen", "Display delamination"
+]
+CAUSES = [
+    "Insufficient clearance between display and underlying components",
+    "FPC fatigue from repeated flexing at hinge",
+    "Connector unseated after drop impact",
+    "Adhesive degradation at high temperature and humidity",
+    "ESD damage to touch controller",
+    "Cover lens stress concentration at corner",
+]
+
+
+def _kb_row(rng: random.Random, i: int) -> list:
+    fault, cause = rng.choice(FAULTS), rng.choice(CAUSES)
+    sev, occ, det = rng.randint(2, 9), rng.randint(1, 8), rng.randint(1, 8)
+    spr = rng.randint(10000, 99999)
+    return [
+        i, rng.choice(SUBSYSTEMS), f"{fault} on {rng.choice(PARTS)}", "", "", f"QUAL-LIB-{rng.randint(100, 999)}",
+        f"SPR {spr}", f"{fault} observed by user", sev, cause, "", occ, f"Design review of {rng.choice(PARTS)} margins",
+        "", "Include symptom in qualification test check list", "", det, sev * occ * det, rng.choice(["Yes", "No"]),
+        f"https://spr.example.com/ViewSPR.aspx?sprID={spr}", "", ""
+    ]
+
+
+def _fi_row(rng: random.Random, i: int, start: date) -> list:
+    fault = rng.choice(FAULTS)
+    return [
+        i, rng.choice(PRODUCTS), f"FC-{rng.randint(100, 160)}", rng.choice(PARTS), fault,
+        (start + timedelta(days=rng.randint(0, 720))).isoformat(), f"SITE-{rng.randint(1, 40):02d}",
+        f"Customer reports {fault.lower()} after {rng.choice(['drop', 'charging', 'cold start', 'update', 'daily use'])}"
+    ]
+
+
+def generate_files(out_dir: str, fi_rows: int, kb_rows: int = None, seed: int = 0) -> Tuple[str, str]:
+    """
+    Write a synthetic knowledge bank and field-issue export to out_dir.
+
+    Rows are streamed to disk, so 1M-row files need no more memory than 1k.
+    The small vocabularies deliberately produce many repeated field issues,
+    as real exports do.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    kb_rows = kb_rows or max(70, fi_rows // 100)
+    rng = random.Random(seed)
+
+    kb_path = os.path.join(out_dir, f"kb_{kb_rows}.csv")
+    with open(kb_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(KB_COLUMNS)
+        for i in range(1, kb_rows + 1):
+            writer.writerow(_kb_row(rng, i))
+
+    fi_path = os.path.join(out_dir, f"field_issues_{fi_rows}.csv")
+    start = date(2023, 1, 1)
+    with open(fi_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FI_COLUMNS)
+        for i in range(1, fi_rows + 1):
+            writer.writerow(_fi_row(rng, i, start))
+
+    return kb_path, fi_path
@@ -0,0 +1,227 @@
+# server/utils/telemetry.py
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+import asyncio
+
+# Instrumentation is off unless DFMEA_TELEMETRY=1 (or enable() is called); every
+# recording helper checks this one flag first, so disabled runs pay ~nothing.
+_enabled = os.getenv("DFMEA_TELEMETRY", "0") == "1"
+_current_span = contextvars.ContextVar("dfmea_span", default=None)
+
+
+class MetricsRegistry:
+    """In-process counters, histograms and finished spans for one or more runs."""
+
+    def __init__(self, max_samples: int = 10_000):
+        self.max_samples = max_samples
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters: Dict[str, float] = {}
+            self.histograms: Dict[str, dict] = {}
+            self.spans: List[dict] = []
+            self.started = time.time()
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            hist = self.histograms.setdefault(name, {"count": 0, "sum": 0.0, "min": value, "max": value, "samples": []})
+            hist["count"] += 1
+            hist["sum"] += value
+            hist["min"] = min(hist["min"], value)
+            hist["max"] = max(hist["max"], value)
+            # Reservoir sampling (Algorithm R): a uniform sample of every value seen,
+            # so percentiles cover the whole run while memory stays flat
+            if len(hist["samples"]) < self.max_samples:
+                hist["samples"].append(value)
+            else:
+                slot = self._random.randrange(hist["count"])
+                if slot < self.max_samples:
+                    hist["samples"][slot] = value
+
+    def add_span(self, record: dict):
+        with self._lock:
+            self.spans.append(record)
+
+    @staticmethod
+    def _summary(hist: dict) -> dict:
+        samples = sorted(hist["samples"])
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+        return {
+            "count": hist["count"],
+            "sum": hist["sum"],
+            "mean": hist["sum"] / hist["count"] if hist["count"] else 0.0,
+            "min": hist["min"],
+            "max": hist["max"],
+            "p50": pct(0.50),
+            "p90": pct(0.90),
+            "p99": pct(0.99),
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: self._summary(h) for name, h in self.histograms.items()}
+            spans = list(self.spans)
+
+        rates = {}
+        for name in counters:
+            if name.endswith(".cache_hits"):
+                prefix = name[:-len(".cache_hits")]
+                lookups = counters[name] + counters.get(f"{prefix}.cache_misses", 0)
+                rates[f"{prefix}.cache_hit_rate"] = counters[name] / lookups if lookups else 0.0
+
+        return {
+            "started": self.started,
+            "duration_seconds": time.time() - self.started,
+            "counters": counters,
+            "rates": rates,
+            "histograms": histograms,
+            "spans": spans,
+        }
+
+
+REGISTRY = MetricsRegistry()
+
+
+def enable(flag: bool = True):
+    global _enabled
+    _enabled = flag
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def incr(name: str, value: float = 1):
+    if _enabled:
+        REGISTRY.incr(name, value)
+
+
+def observe(name: str, value: float):
+    if _enabled:
+        REGISTRY.observe(name, value)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a stage. Nested spans record their parent, across threads and
+    asyncio tasks via contextvars. The yielded dict can be filled with
+    attributes (item counts etc.) before the span closes.
+    """
+    if not _enabled:
+        yield attrs
+        return
+
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        REGISTRY.observe(f"span.{name}.seconds", duration)
+        REGISTRY.add_span({
+            "name": name,
+            "parent": parent,
+            "start": time.time() - duration,
+            "seconds": duration,
+            "status": status,
+            "attrs": attrs,
+        })
+
+
+def timed(metric: str):
+    """Decorator: observe the wall time of a sync or async call under metric."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    REGISTRY.observe(metric, time.perf_counter() - start)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                REGISTRY.observe(metric, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def traced(name: str):
+    """Decorator: wrap a sync function in a span named name."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_run_report(path: Optional[str] = None) -> dict:
+    """Return the registry snapshot and, if a path is given (or DFMEA_RUN_REPORT is set), write it as JSON."""
+    report = REGISTRY.snapshot()
+    path = path or os.getenv("DFMEA_RUN_REPORT")
+    if path:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    return report
+
+
+class _AgentFormatter(logging.Formatter):
+    def format(self, record):
+        record.agent = record.name.split(".", 1)[-1]
+        return super().format(record)
+
+
+def get_logger(agent: str) -> logging.Logger:
+    """Logger printing '[Agent] message', replacing the old print() calls."""
+    root = logging.getLogger("dfmea")
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(_AgentFormatter("[%(agent)s] %(message)s"))
+        root.addHandler(handler)
+        root.setLevel(os.getenv("DFMEA_LOG_LEVEL", "INFO").upper())
+        root.propagate = False
+    return logging.getLogger(f"dfmea.{agent}")
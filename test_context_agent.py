@@ -0,0 +1,38 @@
+# server/tests/test_context_agent.py
+
+import asyncio
+from server.agents.context_agent import ContextAgent
+
+CHUNKS = [
+    "Product: TC57 | Subsystem: Display | Component: Backlight | Failure: flicker at low temperature",
+    "Product: TC57 | Subsystem: Display | Component: LCD | Failure: dead pixels after drop",
+]
+
+
+def _generate(agent: ContextAgent):
+    async def run():
+        agent._start(None)
+        return await agent._process_batch(CHUNKS, 1)
+    return asyncio.run(run())
+
+
+def test_empty_response_cache_stores_responses(fake_services):
+    # An empty ResponseCache is falsy (__len__ == 0) but must still be used
+    agent = ContextAgent(collection_name="context_test", use_cache=True, stream=False)
+    assert agent.response_cache is not None
+    assert len(agent.response_cache) == 0
+
+    entries = _generate(agent)
+
+    assert entries
+    assert len(agent.response_cache) == 1
+
+
+def test_repeated_batch_is_served_from_cache(fake_services):
+    first = _generate(ContextAgent(collection_name="context_test", use_cache=True, stream=False))
+    calls = fake_services.calls
+
+    second = _generate(ContextAgent(collection_name="context_test", use_cache=True, stream=False))
+
+    assert fake_services.calls == calls
+    assert second == first
@@ -0,0 +1,63 @@
+# server/tests/test_context_packing.py
+
+import random
+from server.utils.context_packing import mmr_rerank, pack_prompts, SEPARATOR_TOKENS
+
+QUERY = [1.0, 0.0, 0.0]
+
+
+def _match(name, embedding=None, source="field_issues"):
+    return {"id": name, "embedding": embedding, "metadata": {"source": source}}
+
+
+def test_mmr_prefers_diverse_rows_over_near_duplicates():
+    best = _match("best", [0.9, 0.436, 0.0])
+    near_duplicate = _match("near_duplicate", [0.89, 0.45, 0.07])
+    diverse = _match("diverse", [0.8, -0.6, 0.0])
+
+    ranked = mmr_rerank(QUERY, [best, near_duplicate, diverse], lambda_=0.7, duplicate_threshold=None)
+    assert [m["id"] for m in ranked] == ["best", "diverse", "near_duplicate"]
+
+    ranked = mmr_rerank(QUERY, [best, near_duplicate, diverse], lambda_=0.7, duplicate_threshold=0.98)
+    assert [m["id"] for m in ranked] == ["best", "diverse"]
+
+
+def test_mmr_keeps_matches_without_vectors_last():
+    ranked = mmr_rerank(QUERY, [_match("no_vector"), _match("a", [0.2, 1.0, 0.0]), _match("b", [1.0, 0.1, 0.0])])
+
+    assert [m["id"] for m in ranked] == ["b", "a", "no_vector"]
+
+
+def test_packing_never_exceeds_the_token_budget():
+    rng = random.Random(7)
+    budget = 500
+    matches = [_match(i, source=rng.choice(["knowledge_bank", "field_issues"])) for i in range(200)]
+    tokens = [rng.randint(1, budget - SEPARATOR_TOKENS) for _ in matches]
+    size = {m["id"]: t for m, t in zip(matches, tokens)}
+
+    prompts = pack_prompts(matches, tokens, budget)
+
+    for prompt in prompts:
+        assert prompt
+        assert sum(size[m["id"]] + SEPARATOR_TOKENS for m in prompt) <= budget
+    packed = sorted(m["id"] for prompt in prompts for m in prompt)
+    assert packed == list(range(len(matches)))
+
+
+def test_oversized_chunk_gets_its_own_prompt():
+    matches = [_match("small"), _match("huge"), _match("small2")]
+
+    prompts = pack_prompts(matches, [100, 5000, 100], token_budget=1000)
+
+    assert [[m["id"] for m in p] for p in prompts] == [["small", "small2"], ["huge"]]
+
+
+def test_packing_balances_sources():
+    matches = [_match(f"kb{i}", source="knowledge_bank") for i in range(10)] + \
+              [_match(f"fi{i}", source="field_issues") for i in range(10)]
+
+    prompts = pack_prompts(matches, [98] * 20, token_budget=500)
+
+    for prompt in prompts:
+        sources = [m["metadata"]["source"] for m in prompt]
+        assert abs(sources.count("knowledge_bank") - sources.count("field_issues")) <= 1
@@ -0,0 +1,39 @@
+# server/tests/test_embedding_agent.py
+
+from server.utils.cache import EmbeddingCache
+from server.agents.embedding_agent import EmbeddingAgent
+
+CHUNKS = [
+    {"text": "Display flickers at low temperature", "metadata": {"source": "field_issues"}},
+    {"text": "Backlight driver overheats", "metadata": {"source": "field_issues"}},
+    {"text": "Touch panel delamination", "metadata": {"source": "knowledge_bank"}},
+]
+
+
+def _agent(cache: EmbeddingCache) -> EmbeddingAgent:
+    agent = EmbeddingAgent(cache=cache)
+    agent.cooldown = 0
+    return agent
+
+
+def test_empty_cache_is_filled(fake_services, tmp_path):
+    # An empty cache is falsy (__len__ == 0) but must still be used
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite"))
+    agent = _agent(cache)
+    assert agent.cache is cache
+
+    embedded = agent.embed_chunks_sync(CHUNKS)
+
+    assert len(embedded) == len(CHUNKS)
+    assert len(cache) == len(CHUNKS)
+
+
+def test_second_run_is_served_from_cache(fake_services, tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite"))
+    first = _agent(cache).embed_chunks_sync(CHUNKS)
+    calls = fake_services.calls
+
+    second = _agent(cache).embed_chunks_sync(CHUNKS)
+
+    assert fake_services.calls == calls
+    assert second.vectors.tolist() == first.vectors.tolist()
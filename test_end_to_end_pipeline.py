@@ -0,0 +1,53 @@
+# server/tests/test_end_to_end_pipeline.py
+
+import os
+import pytest
+from server.utils import client_pool
+from server.agents.context_agent import ContextAgent
+from server.agents.vectorstore_agent import VectorStoreAgent
+from server.pipeline.end_to_end_pipeline import DFMEAEndToEndPipeline
+from server.benchmarks.fake_services import FakeAsyncEmbeddingClient
+from server.benchmarks.synthetic_data import generate_files
+
+RUN_ID = "resume-test"
+
+
+@pytest.fixture
+def inputs(fake_services, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DFMEA_RUN_DIR", str(tmp_path / "runs"))
+    monkeypatch.setenv("DFMEA_OUTPUT_FORMATS", "csv")
+    monkeypatch.setenv("EMBEDDING_MODE", "async")
+    monkeypatch.setenv("LLM_CACHE", "0")
+    dim = client_pool.get_embedding_client().dim
+    client_pool.set_client("async_embedding", FakeAsyncEmbeddingClient(fake_services, dim=dim))
+    return generate_files(str(tmp_path / "data"), fi_rows=40, seed=3)
+
+
+def test_resume_after_retrieval_reuses_checkpoint(inputs, monkeypatch):
+    kb_path, fi_path = inputs
+    generate = ContextAgent._generate
+
+    async def interrupted(self, batches, system_msgs, deadline):
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(ContextAgent, "_generate", interrupted)
+    first = DFMEAEndToEndPipeline(kb_path, fi_path, top_k=10, run_id=RUN_ID)
+    with pytest.raises(RuntimeError, match="interrupted"):
+        first.run()
+    assert first.checkpoint.done("upsert")
+    assert os.listdir(os.path.join(first.checkpoint.path, "retrieval"))
+    assert not first.checkpoint.done("writing")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("resumed run repeated a finished stage")
+
+    monkeypatch.setattr(ContextAgent, "_generate", generate)
+    monkeypatch.setattr(VectorStoreAgent, "search", fail)
+    monkeypatch.setattr(VectorStoreAgent, "add_embeddings", fail)
+    resumed = DFMEAEndToEndPipeline(kb_path, fi_path, top_k=10, run_id=RUN_ID)
+    output_path = resumed.run()
+
+    assert os.path.isfile(output_path)
+    assert resumed.checkpoint.done("writing")
+    assert resumed.checkpoint.get("output_path") == str(output_path)
@@ -0,0 +1,84 @@
+# server/tests/test_json_stream.py
+
+import json
+from server.utils.json_stream import IncrementalJSONArrayParser
+
+ENTRIES = [
+    {"ID": 1, "Product": "TC57", "Subsystems": [{"Subsystem": "Display", "Components": []}]},
+    {"ID": 2, "Note": "braces } and [brackets] in \"quotes\" \\ backslash", "Tags": [[1, 2], {"k": "}"}]},
+    {"ID": 3, "Unicode": "Temperatur über 60 °C"},
+]
+TEXT = json.dumps(ENTRIES, indent=2)
+
+
+def _feed_all(chunks):
+    parser = IncrementalJSONArrayParser()
+    entries = []
+    for chunk in chunks:
+        entries.extend(parser.feed(chunk))
+    return parser, entries
+
+
+def test_whole_array_in_one_chunk():
+    parser, entries = _feed_all([TEXT])
+
+    assert entries == ENTRIES
+    assert parser.complete
+    assert parser.emitted == len(ENTRIES)
+
+
+def test_one_character_at_a_time():
+    # Every split point, including inside strings and right after a backslash
+    parser, entries = _feed_all(list(TEXT))
+
+    assert entries == ENTRIES
+    assert parser.complete
+
+
+def test_entry_is_emitted_when_its_closing_brace_arrives():
+    first = json.dumps(ENTRIES[0])
+    parser = IncrementalJSONArrayParser()
+
+    assert parser.feed("[" + first[:-1]) == []
+    assert parser.feed(first[-1]) == [ENTRIES[0]]
+    assert parser.feed(", " + json.dumps(ENTRIES[1])[:10]) == []
+
+
+def test_string_split_across_chunks():
+    text = json.dumps([{"Cause": 'Solder "cold" joint {under} [BGA]'}])
+    cut = text.index("joint")
+
+    parser, entries = _feed_all([text[:cut], text[cut:text.index("[BGA") + 2], text[text.index("[BGA") + 2:]])
+
+    assert entries == [{"Cause": 'Solder "cold" joint {under} [BGA]'}]
+    assert parser.complete
+
+
+def test_truncated_stream_keeps_complete_entries():
+    cut = TEXT.index('"ID": 3')
+    parser, entries = _feed_all([TEXT[:cut]])
+
+    assert entries == ENTRIES[:2]
+    assert not parser.complete
+    assert parser.errors == 0
+
+
+def test_markdown_fence_is_skipped():
+    parser, entries = _feed_all(["```json\n", TEXT[:40], TEXT[40:], "\n```"])
+
+    assert entries == ENTRIES
+    assert parser.complete
+
+
+def test_malformed_entry_is_dropped():
+    text = '[{"ID": 1}, {"ID": 2,}, {"ID": 3}]'
+    parser, entries = _feed_all([text[:15], text[15:]])
+
+    assert entries == [{"ID": 1}, {"ID": 3}]
+    assert parser.errors == 1
+
+
+def test_text_after_the_array_is_ignored():
+    parser = IncrementalJSONArrayParser()
+    assert parser.feed('[{"ID": 1}] trailing {"ID": 2}') == [{"ID": 1}]
+    assert parser.feed('{"ID": 3}') == []
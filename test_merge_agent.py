@@ -0,0 +1,92 @@
+# server/tests/test_merge_agent.py
+
+from server.utils import client_pool
+from server.agents.vectorstore_agent import VectorStoreAgent
+from server.agents.merge_agent import MergeAgent
+from server.benchmarks.fake_services import fake_embedding
+
+COLLECTION = "merge_test"
+KB_TEXT = "Flicker at low temperature: LED driver derating"
+
+
+def _store(with_kb: bool = True) -> VectorStoreAgent:
+    dim = client_pool.get_embedding_client().dim
+    store = VectorStoreAgent(collection_name=COLLECTION)
+    store.create_collection(dim)
+    if with_kb:
+        store.add_embeddings([{
+            "text": KB_TEXT,
+            "embedding": fake_embedding(KB_TEXT, dim),
+            "metadata": {"source": "knowledge_bank", "kb_id": "KB-7"}
+        }])
+    return store
+
+
+def _entries():
+    # Two parallel batches produced the same Backlight failure mode
+    def entry(components):
+        return {"ID": 0, "Product": "TC57", "Subsystems": [{"Subsystem": "Display", "Components": components}]}
+
+    return [
+        entry([{"Component": "Backlight", "FailureModes": [{
+            "FailureMode": "Flicker at low temperature",
+            "Effects": [{"Effect": "Unreadable screen", "Severity": 7}],
+            "Causes": [{"Cause": "LED driver derating", "Occurrence": 3, "Detection": 4,
+                        "Controls Prevention": ["Derating review"], "RPN": 999}]
+        }]}]),
+        entry([{"Component": "Backlight", "FailureModes": [{
+            "FailureMode": "Flicker at low temperature",
+            "Effects": [{"Effect": "unreadable  screen", "Severity": 8}],
+            "Causes": [{"Cause": "LED driver derating", "Occurrence": 5, "Detection": 2,
+                        "Controls Prevention": ["Thermal cycling test", "derating review"]},
+                       {"Cause": "Cold solder joint", "Occurrence": 2, "Detection": 6}]
+        }]}]),
+        entry([{"Component": "LCD", "FailureModes": [{
+            "FailureMode": "Dead pixels",
+            "Effects": [{"Effect": "Image defects", "Severity": 5}],
+            "Causes": [{"Cause": "Panel pressure", "Occurrence": 4, "Detection": "3"}]
+        }]}]),
+    ]
+
+
+def test_run_merges_duplicates_links_kb_and_recomputes_rpn(fake_services):
+    merged = MergeAgent(_store()).run(_entries())
+
+    assert [e["ID"] for e in merged] == [1, 2]
+    backlight = merged[0]["Subsystems"][0]["Components"][0]
+    assert len(backlight["FailureModes"]) == 1
+    fm = backlight["FailureModes"][0]
+    assert fm["Effects"] == [{"Effect": "Unreadable screen", "Severity": 8}]
+
+    derating, solder = fm["Causes"]
+    assert (derating["Occurrence"], derating["Detection"], derating["RPN"]) == (5, 4, 8 * 5 * 4)
+    assert derating["Controls Prevention"] == ["Derating review", "Thermal cycling test"]
+    assert derating["linked_to_dfmea_kb"] is True
+    assert derating["matched_kb_id"] == "KB-7"
+    assert solder["RPN"] == 8 * 2 * 6
+    assert solder["linked_to_dfmea_kb"] is False
+    assert solder["matched_kb_id"] == ""
+
+    lcd_cause = merged[1]["Subsystems"][0]["Components"][0]["FailureModes"][0]["Causes"][0]
+    assert lcd_cause["RPN"] == 5 * 4 * 3
+
+
+def test_run_bypasses_query_cache(fake_services):
+    MergeAgent(_store()).run(_entries())
+
+    assert len(client_pool.get_query_cache()) == 0
+
+
+def test_run_without_kb_vectors_links_nothing(fake_services):
+    merged = MergeAgent(_store(with_kb=False)).run(_entries())
+
+    causes = [c for e in merged for s in e["Subsystems"] for comp in s["Components"]
+              for fm in comp["FailureModes"] for c in fm["Causes"]]
+    assert causes
+    assert not any(c["linked_to_dfmea_kb"] for c in causes)
+
+
+def test_run_without_failure_modes_returns_entries(fake_services):
+    entries = [{"ID": 1, "Product": "TC57", "Subsystems": []}]
+
+    assert MergeAgent(_store()).run(entries) is entries
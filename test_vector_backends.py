@@ -0,0 +1,119 @@
+# server/tests/test_vector_backends.py
+
+import numpy as np
+import pytest
+from server.agents.vector_backends import LocalBackend
+
+DIM = 32
+
+
+@pytest.fixture
+def local_env(tmp_path, monkeypatch):
+    for name in ("VECTOR_QUANTIZATION", "QUANTIZATION_OVERSAMPLING", "LOCAL_VECTOR_ANN_THRESHOLD",
+                 "LOCAL_VECTOR_NPROBE", "LOCAL_PQ_SUBSPACES"):
+        monkeypatch.delenv(name, raising=False)
+    return str(tmp_path)
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _fill(backend: LocalBackend, vectors: np.ndarray, start: int = 0, batch: int = 500):
+    for i in range(0, len(vectors), batch):
+        ids = [f"p{start + j}" for j in range(i, min(i + batch, len(vectors)))]
+        backend.upsert(ids, vectors[i:i + batch], [{"text": pid, "product": "TC57" if int(pid[1:]) % 2 else "TC52"}
+                                                   for pid in ids])
+
+
+def test_reopen_after_write(local_env):
+    vectors = _vectors(3000)
+    backend = LocalBackend("reopen", root_dir=local_env)
+    backend.create(DIM)
+    _fill(backend, vectors)  # grows the vector file past its initial capacity twice
+
+    updated = _vectors(100, seed=1)
+    for _ in range(40):  # enough rewrites of the same rows to compact the payload log
+        backend.upsert([f"p{i}" for i in range(100)], updated, [{"text": "updated"}] * 100)
+    backend.delete_points([f"p{i}" for i in range(100, 200)])
+
+    reopened = LocalBackend("reopen", root_dir=local_env)
+    assert reopened.count() == 2900
+    assert reopened.point_ids() == backend.point_ids()
+    assert reopened.retrieve(["p0", "p150", "p2999"]) == {"p0": {"text": "updated"},
+                                                          "p2999": {"text": "p2999", "product": "TC57"}}
+    stored = reopened.vectors(["p0", "p2999"])
+    np.testing.assert_allclose(stored["p0"], updated[0], atol=1e-6)
+    np.testing.assert_allclose(stored["p2999"], vectors[2999], atol=1e-6)
+
+    # Growing a reopened collection keeps the rows already on disk
+    _fill(reopened, _vectors(2000, seed=2), start=3000)
+    again = LocalBackend("reopen", root_dir=local_env)
+    assert again.count() == 4900
+    np.testing.assert_allclose(again.vectors(["p2999"])["p2999"], vectors[2999], atol=1e-6)
+    score, payload, pid = again.search(vectors[500], top_k=1)[0]
+    assert (pid, payload["text"]) == ("p500", "p500")
+    assert score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_filters_survive_reopen(local_env):
+    backend = LocalBackend("filters", root_dir=local_env)
+    backend.create(DIM)
+    _fill(backend, _vectors(200))
+
+    reopened = LocalBackend("filters", root_dir=local_env)
+    results = reopened.search(_vectors(1, seed=5)[0], top_k=50, filters={"product": "TC57"})
+
+    assert len(results) == 50
+    assert all(payload["product"] == "TC57" for _, payload, _ in results)
+
+
+def _top(backend: LocalBackend, queries: np.ndarray, k: int):
+    return [[pid for _, _, pid in backend.search(q, top_k=k)] for q in queries]
+
+
+def test_scalar_quantized_search_matches_exact(local_env, monkeypatch):
+    vectors = _vectors(2000)
+    queries = vectors[:20] + 0.3 * _vectors(20, seed=9)
+    exact = LocalBackend("exact", root_dir=local_env)
+    exact.create(DIM)
+    _fill(exact, vectors)
+
+    monkeypatch.setenv("VECTOR_QUANTIZATION", "scalar")
+    quantized = LocalBackend("scalar", root_dir=local_env)
+    quantized.create(DIM)
+    _fill(quantized, vectors)
+
+    assert _top(quantized, queries, 10) == _top(exact, queries, 10)
+    # Candidates are rescored against the float32 vectors, so the scores are exact too
+    np.testing.assert_allclose([s for s, _, _ in quantized.search(queries[0], 10)],
+                               [s for s, _, _ in exact.search(queries[0], 10)], atol=1e-5)
+
+
+def test_product_quantized_search_finds_stored_vectors(local_env, monkeypatch):
+    vectors = _vectors(2000)
+    monkeypatch.setenv("VECTOR_QUANTIZATION", "product")
+    monkeypatch.setenv("LOCAL_PQ_SUBSPACES", "8")
+    monkeypatch.setenv("QUANTIZATION_OVERSAMPLING", "10")
+    quantized = LocalBackend("product", root_dir=local_env)
+    quantized.create(DIM)
+    _fill(quantized, vectors)
+
+    assert _top(quantized, vectors[:50], 1) == [[f"p{i}"] for i in range(50)]
+
+
+def test_ivf_probing_every_list_matches_exact(local_env, monkeypatch):
+    vectors = _vectors(2000)
+    queries = _vectors(20, seed=4)
+    exact = LocalBackend("exact", root_dir=local_env)
+    exact.create(DIM)
+    _fill(exact, vectors)
+
+    monkeypatch.setenv("LOCAL_VECTOR_ANN_THRESHOLD", "100")
+    monkeypatch.setenv("LOCAL_VECTOR_NPROBE", "1000")
+    ivf = LocalBackend("ivf", root_dir=local_env)
+    ivf.create(DIM)
+    _fill(ivf, vectors)
+
+    assert _top(ivf, queries, 10) == _top(exact, queries, 10)
@@ -0,0 +1,78 @@
+# server/tests/test_vectorstore_agent.py
+
+import os
+from server.utils import client_pool
+from server.agents.vectorstore_agent import VectorStoreAgent
+from server.benchmarks.fake_services import fake_embedding
+
+COLLECTION = "hybrid_test"
+
+CHUNKS = [
+    {"text": "FC-101 backlight flicker below -20C", "metadata": {"source": "field_issues", "product": "TC57"}},
+    {"text": "Cover glass cracked after drop", "metadata": {"source": "field_issues", "product": "TC52"}},
+    {"text": "Connector corrosion in humid storage", "metadata": {"source": "knowledge_bank"}},
+    {"text": "Speaker distortion at full volume", "metadata": {"source": "knowledge_bank"}},
+]
+
+
+def _seed() -> int:
+    dim = client_pool.get_embedding_client().dim
+    store = VectorStoreAgent(collection_name=COLLECTION)
+    store.create_collection(dim)
+    missing = store.add_embeddings([{**chunk, "embedding": fake_embedding(chunk["text"], dim)} for chunk in CHUNKS])
+    assert missing == []
+    return dim
+
+
+def test_default_mode_is_vector(fake_services):
+    assert VectorStoreAgent(collection_name=COLLECTION).retrieval_mode == "vector"
+
+
+def test_hybrid_search_on_saved_local_collection(fake_services, monkeypatch):
+    _seed()
+    monkeypatch.setenv("RETRIEVAL_MODE", "hybrid")
+    # A fresh agent reopens the collection from disk and builds BM25 by scrolling it
+    store = VectorStoreAgent(collection_name=COLLECTION)
+
+    results = store.search("fc 101 flicker", top_k=2)
+
+    assert store.backend.count() == len(CHUNKS)
+    assert results[0]["text"] == CHUNKS[0]["text"]
+    assert results[0]["metadata"]["product"] == "TC57"
+    assert os.path.exists(store.lexical_path)
+
+
+def test_hybrid_search_applies_filters(fake_services):
+    _seed()
+    store = VectorStoreAgent(collection_name=COLLECTION)
+
+    results = store.search("fc 101 flicker", top_k=4, filters={"source": "knowledge_bank"}, mode="hybrid")
+
+    assert {r["text"] for r in results} == {CHUNKS[2]["text"], CHUNKS[3]["text"]}
+
+
+def test_exact_text_is_top_vector_match(fake_services):
+    _seed()
+    store = VectorStoreAgent(collection_name=COLLECTION)
+
+    results = store.search(CHUNKS[1]["text"], top_k=1, mode="vector", with_vectors=True)
+
+    assert results[0]["text"] == CHUNKS[1]["text"]
+    assert len(results[0]["embedding"]) == client_pool.get_embedding_client().dim
+
+
+def test_writes_drop_lexical_index_once_synced(fake_services):
+    dim = _seed()
+    store = VectorStoreAgent(collection_name=COLLECTION)
+    store.search("fc 101 flicker", top_k=1, mode="hybrid")
+    assert os.path.exists(store.lexical_path)
+
+    extra = {"text": "FC-202 ghost touches in rain", "metadata": {"source": "field_issues"}}
+    store.add_embeddings([{**extra, "embedding": fake_embedding(extra["text"], dim)}])
+    # Stale only in memory until the ingest is done; this agent rebuilds on its next search
+    assert os.path.exists(store.lexical_path)
+    assert store.search("fc 202 ghost", top_k=1, mode="hybrid")[0]["text"] == extra["text"]
+
+    store.add_embeddings([{**extra, "embedding": fake_embedding(extra["text"], dim)}])
+    store.sync_lexical_index()
+    assert not os.path.exists(store.lexical_path)
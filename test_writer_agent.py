@@ -0,0 +1,100 @@
+# server/tests/test_writer_agent.py
+
+import csv
+import json
+import pytest
+from server.agents.writer_agent import WriterAgent, COLUMNS
+
+DFMEA = [{
+    "ID": 1,
+    "Product": "TC57",
+    "Subsystems": [{"Subsystem": "Display", "Components": [{
+        "Component": "Backlight",
+        "Function": "Illuminates the LCD",
+        "FailureModes": [{
+            "FailureMode": "Flicker at low temperature",
+            "Effects": [{"Effect": "Unreadable screen", "Severity": 8}, {"Effect": "Eye strain", "Severity": 4}],
+            "Causes": [
+                {"Cause": "LED driver derating", "Occurrence": 5, "Detection": 4,
+                 "Controls Prevention": ["Derating review", "Thermal test"], "Controls Detection": ["Cold soak"],
+                 "Recommended Actions": ["Wider-range driver"], "RPN": 160,
+                 "linked_to_dfmea_kb": True, "matched_kb_id": "KB-7"},
+                {"Cause": "Cold solder joint", "Occurrence": 2, "Detection": 6,
+                 "Controls Prevention": [], "Controls Detection": ["X-ray"], "Recommended Actions": [], "RPN": 96},
+            ]
+        }]
+    }]}]
+}]
+
+# The rows the original _flatten_dfmea produced, plus the new "Matched KB ID" column
+HEAD = ("TC57", "Display", "Backlight", "Illuminates the LCD", "Flicker at low temperature")
+DERATING = ("LED driver derating", 5, 4, "Derating review, Thermal test", "Cold soak", "Wider-range driver", 160, True, "KB-7")
+SOLDER = ("Cold solder joint", 2, 6, "", "X-ray", "", 96, False, "")
+EXPECTED = [
+    (1,) + HEAD + ("Unreadable screen", 8) + DERATING,
+    (2,) + HEAD + ("Unreadable screen", 8) + SOLDER,
+    (3,) + HEAD + ("Eye strain", 4) + DERATING,
+    (4,) + HEAD + ("Eye strain", 4) + SOLDER,
+]
+
+
+def _writer(tmp_path, formats) -> WriterAgent:
+    return WriterAgent(output_path=str(tmp_path / "out" / "dfmea_output.xlsx"),
+                       json_dump_path=str(tmp_path / "out" / "raw_dfmea_output.json"), formats=formats)
+
+
+def test_rows_match_flattened_dfmea():
+    assert list(WriterAgent()._iter_rows(DFMEA)) == EXPECTED
+
+
+def test_flatten_dfmea_dataframe():
+    pytest.importorskip("pandas")
+    df = WriterAgent()._flatten_dfmea(DFMEA)
+
+    assert list(df.columns) == COLUMNS
+    assert [tuple(row) for row in df.itertuples(index=False)] == EXPECTED
+
+
+def test_raw_json_dump_is_indented(tmp_path):
+    writer = _writer(tmp_path, ["csv"])
+    writer.run(DFMEA)
+
+    with open(writer.json_dump_path) as f:
+        assert f.read() == json.dumps(DFMEA, indent=2)
+
+
+def test_csv_round_trip(tmp_path):
+    writer = _writer(tmp_path, ["csv"])
+    path = writer.run(DFMEA)
+
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == COLUMNS
+    assert rows[1:] == [[str(v) for v in row] for row in EXPECTED]
+
+
+def test_xlsx_round_trip(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    writer = _writer(tmp_path, ["xlsx"])
+    path = writer.run(DFMEA)
+
+    sheet = openpyxl.load_workbook(path, read_only=True).active
+    rows = [tuple("" if v is None else v for v in row) for row in sheet.iter_rows(values_only=True)]
+    assert rows[0] == tuple(COLUMNS)
+    assert rows[1:] == EXPECTED
+
+
+def test_parquet_round_trip(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    writer = _writer(tmp_path, ["parquet"])
+    path = writer.run(DFMEA)
+
+    table = pq.read_table(path)
+    assert table.column_names == COLUMNS
+    rows = [tuple(row[name] for name in COLUMNS) for row in table.to_pylist()]
+    # Parquet keeps ID and the KB flag typed; the mixed LLM fields are text, "" as null
+    assert rows == [
+        tuple(v if name in ("ID", "Exists in DFMEA KB") else (None if v == "" else str(v))
+              for name, v in zip(COLUMNS, row))
+        for row in EXPECTED
+    ]
@@ -0,0 +1,25 @@
+# server/utils/tokenizer.py
+
+import os
+from functools import lru_cache
+from typing import List
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model_name: str = "text-embedding-ada-002"):
+    """Load each tiktoken encoder once per process."""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding(model_name)
+
+
+def encode_batch(texts: List[str], model_name: str = "text-embedding-ada-002", num_threads: int = None) -> List[List[int]]:
+    # tiktoken releases the GIL while encoding, so a thread pool scales across cores
+    num_threads = num_threads or int(os.getenv("TOKENIZER_THREADS", os.cpu_count() or 4))
+    return get_encoder(model_name).encode_batch(texts, num_threads=num_threads, disallowed_special=())
+
+
+def count_tokens(text: str, model_name: str = "cl100k_base") -> int:
+    return len(get_encoder(model_name).encode(text, disallowed_special=()))
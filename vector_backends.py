@@ -0,0 +1,485 @@
+# server/agents/vector_backends.py
+
+import os
+import json
+import shutil
+import threading
+from typing import TYPE_CHECKING, List, Dict, Tuple, Iterator, Optional
+import numpy as np
+from server.utils.client_pool import get_qdrant_client
+from server.utils.quantization import make_quantizer
+
+if TYPE_CHECKING:
+    from qdrant_client.models import Filter
+
+# Payload fields with a keyword index; search filters may only use these
+INDEXED_PAYLOAD_FIELDS = ("source", "product", "subsystem", "fault_code")
+
+
+def quantization_settings() -> Tuple[str, float]:
+    # VECTOR_QUANTIZATION=scalar (int8, 4x) or product (PQ, 16x+): searches score the
+    # compressed vectors, then rescore QUANTIZATION_OVERSAMPLING * top_k candidates exactly
+    return os.getenv("VECTOR_QUANTIZATION", "none").lower(), float(os.getenv("QUANTIZATION_OVERSAMPLING", 3.0))
+
+
+def filter_values(filters: Optional[Dict]) -> Dict[str, List[str]]:
+    """
+    Normalise {field: value | [values]} filters. A chunk passes a field's
+    filter if it carries one of the values or does not carry the field at
+    all (knowledge-bank rows have no product, field issues no subsystem).
+    """
+    normalised = {}
+    for field, values in (filters or {}).items():
+        if field not in INDEXED_PAYLOAD_FIELDS:
+            raise ValueError(f"Cannot filter on non-indexed payload field: {field}")
+        if values is None:
+            continue
+        values = [values] if isinstance(values, str) else list(values)
+        normalised[field] = [str(v) for v in values]
+    return normalised
+
+
+def _qdrant_models():
+    # Imported on first use, so the local backend and CLI startup never load qdrant_client
+    from qdrant_client import models
+    return models
+
+
+class QdrantBackend:
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.client = get_qdrant_client()
+        self.quantization, self.oversampling = quantization_settings()
+
+    def _quantization_config(self):
+        models = _qdrant_models()
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+        if self.quantization == "product":
+            return models.ProductQuantization(product=models.ProductQuantizationConfig(compression=models.CompressionRatio.X16, always_ram=True))
+        if self.quantization != "none":
+            raise ValueError(f"Unknown vector quantization: {self.quantization}")
+        return None
+
+    def create(self, vector_dim: int, recreate: bool = True):
+        models = _qdrant_models()
+        # With quantization only the codes stay in RAM; originals go to disk for rescoring
+        quantization_config = self._quantization_config()
+        vectors_config = models.VectorParams(size=vector_dim, distance=models.Distance.COSINE, on_disk=quantization_config is not None)
+        if recreate:
+            self.client.recreate_collection(collection_name=self.collection_name, vectors_config=vectors_config,
+                                            quantization_config=quantization_config)
+        else:
+            self.client.create_collection(collection_name=self.collection_name, vectors_config=vectors_config,
+                                          quantization_config=quantization_config)
+        for field in INDEXED_PAYLOAD_FIELDS:
+            self.client.create_payload_index(
+                collection_name=self.collection_name, field_name=field, field_schema=models.PayloadSchemaType.KEYWORD
+            )
+
+    def exists(self) -> bool:
+        return self.client.collection_exists(self.collection_name)
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection_name, exact=True).count
+
+    @staticmethod
+    def _filter(filters: Dict[str, List[str]]) -> Optional["Filter"]:
+        models = _qdrant_models()
+        if not filters:
+            return None
+        must = []
+        for field, values in filters.items():
+            match = models.MatchValue(value=values[0]) if len(values) == 1 else models.MatchAny(any=values)
+            must.append(models.Filter(should=[
+                models.FieldCondition(key=field, match=match),
+                models.IsEmptyCondition(is_empty=models.PayloadField(key=field))
+            ]))
+        return models.Filter(must=must)
+
+    def upsert(self, ids: List[str], vectors, payloads: List[Dict]):
+        models = _qdrant_models()
+        # Column-oriented Batch instead of one PointStruct object per point
+        if isinstance(vectors, np.ndarray):
+            vectors = vectors.tolist()
+        self.client.upsert(collection_name=self.collection_name, points=models.Batch(ids=ids, vectors=vectors, payloads=payloads))
+
+    def search(self, vector: List[float], top_k: int, filters: Dict = None) -> List[Tuple[float, Dict, str]]:
+        models = _qdrant_models()
+        # The filter is evaluated inside Qdrant against the payload indexes
+        results = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=vector,
+            query_filter=self._filter(filter_values(filters)),
+            search_params=models.SearchParams(
+                quantization=models.QuantizationSearchParams(rescore=True, oversampling=self.oversampling)
+            ) if self.quantization != "none" else None,
+            limit=top_k,
+            with_payload=True
+        )
+        return [(hit.score, hit.payload, str(hit.id)) for hit in results]
+
+    def iter_payloads(self, page_size: int = 1000, filters: Dict = None) -> Iterator[Tuple[str, Dict]]:
+        offset = None
+        scroll_filter = self._filter(filter_values(filters))
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            for record in records:
+                yield str(record.id), record.payload
+            if offset is None:
+                break
+
+    def retrieve(self, point_ids: List[str]) -> Dict[str, Dict]:
+        records = self.client.retrieve(collection_name=self.collection_name, ids=point_ids, with_payload=True)
+        return {str(record.id): record.payload for record in records}
+
+    def vectors(self, point_ids: List[str]) -> Dict[str, List[float]]:
+        records = self.client.retrieve(
+            collection_name=self.collection_name, ids=point_ids, with_payload=False, with_vectors=True
+        )
+        return {str(record.id): record.vector for record in records}
+
+    def point_ids(self, page_size: int = 1000) -> set:
+        ids = set()
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=page_size,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            ids.update(str(record.id) for record in records)
+            if offset is None:
+                break
+        return ids
+
+    def delete_points(self, point_ids: List[str]):
+        models = _qdrant_models()
+        self.client.delete(collection_name=self.collection_name, points_selector=models.PointIdsList(points=point_ids))
+
+    def drop(self):
+        self.client.delete_collection(self.collection_name)
+
+
+class LocalBackend:
+    """
+    Embedded in-process index: vectors live in a memory-mapped float32 matrix
+    (rows L2-normalised so cosine similarity is a dot product), payloads in an
+    append-only JSONL log of row writes and deletes. Each upsert appends
+    only its own rows. The log is rewritten once it holds twice as many
+    records as rows, so persistence stays linear in the payload bytes.
+
+    Search is an exact vectorised top-k; once the collection reaches
+    ann_threshold points an IVF index (k-means coarse quantiser) is built
+    lazily and only the nprobe closest lists are scanned. With quantization
+    enabled, candidates are scored on in-memory codes and only the best
+    top_k * oversampling rows are rescored against the float32 matrix.
+    """
+
+    def __init__(self, collection_name: str, root_dir: str = None):
+        self.collection_name = collection_name
+        self.root_dir = root_dir or os.getenv("LOCAL_VECTOR_DIR", ".vectorstore")
+        self.path = os.path.join(self.root_dir, collection_name)
+        self.ann_threshold = int(os.getenv("LOCAL_VECTOR_ANN_THRESHOLD", 50_000))
+        self.nprobe = int(os.getenv("LOCAL_VECTOR_NPROBE", 8))
+
+        self.dim = 0
+        self.size = 0
+        self.ids: List[str] = []
+        self.payloads: List[Dict] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.matrix = None
+        self._row_of: Dict[str, int] = {}
+        self._log_records = 0
+        self._ivf = None
+        self._field_index = None
+        self.quantization, self.oversampling = quantization_settings()
+        self._quantizer = None
+        # Writers may run in parallel threads; the row bookkeeping is serialised
+        self._write_lock = threading.Lock()
+
+        if self.exists():
+            self._load()
+
+    # -- persistence -------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _open_matrix(self, capacity: int, mode: str):
+        return np.memmap(self._file("vectors.f32"), dtype=np.float32, mode=mode, shape=(max(capacity, 1), self.dim))
+
+    def _load(self):
+        with open(self._file("meta.json")) as f:
+            meta = json.load(f)
+        self.dim, self.size = meta["dim"], meta["count"]
+        self.matrix = self._open_matrix(meta["capacity"], "r+")
+
+        # Replay the log; later records for a row replace earlier ones
+        self.ids, self.payloads = [None] * self.size, [None] * self.size
+        self._log_records = 0
+        with open(self._file("payloads.jsonl")) as f:
+            for line in f:
+                record = json.loads(line)
+                row = record.get("row", self._log_records)
+                if row < self.size:
+                    self.ids[row] = record["id"]
+                    self.payloads[row] = record["payload"]
+                self._log_records += 1
+        self.alive = np.array([pid is not None for pid in self.ids], dtype=bool)
+        self._row_of = {pid: row for row, pid in enumerate(self.ids) if pid is not None}
+
+    def _save(self, rows: Optional[List[int]] = None):
+        """Persist the given rows by appending to the payload log, or rewrite it in full when rows is None."""
+        self.matrix.flush()
+        if rows is None or self._log_records + len(rows) > 2 * max(self.size, 1024):
+            tmp = self._file("payloads.jsonl.tmp")
+            with open(tmp, "w") as f:
+                for row, (pid, payload) in enumerate(zip(self.ids, self.payloads)):
+                    f.write(json.dumps({"row": row, "id": pid, "payload": payload}) + "\n")
+            os.replace(tmp, self._file("payloads.jsonl"))
+            self._log_records = len(self.ids)
+        else:
+            with open(self._file("payloads.jsonl"), "a") as f:
+                for row in rows:
+                    f.write(json.dumps({"row": row, "id": self.ids[row], "payload": self.payloads[row]}) + "\n")
+            self._log_records += len(rows)
+        # Written after the log, so a crash in between leaves rows beyond "count" that _load ignores
+        with open(self._file("meta.json"), "w") as f:
+            json.dump({"dim": self.dim, "count": self.size, "capacity": self.matrix.shape[0]}, f)
+
+    def _grow(self, needed: int):
+        capacity = self.matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        # Extend the file in place: stored rows are never truncated or copied through RAM
+        self.matrix.flush()
+        self.matrix = None
+        with open(self._file("vectors.f32"), "r+b") as f:
+            f.truncate(new_capacity * self.dim * np.dtype(np.float32).itemsize)
+        self.matrix = self._open_matrix(new_capacity, "r+")
+
+    # -- backend interface -------------------------------------------------
+
+    def create(self, vector_dim: int, recreate: bool = True):
+        if recreate and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path, exist_ok=True)
+        self.dim, self.size = vector_dim, 0
+        self.ids, self.payloads, self._row_of = [], [], {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.matrix = self._open_matrix(1024, "w+")
+        self._ivf = None
+        self._field_index = None
+        self._quantizer = None
+        self._save()
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._file("meta.json"))
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    def upsert(self, ids: List[str], vectors: List[List[float]], payloads: List[Dict]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self._write_lock:
+            self._upsert(ids, vectors, payloads)
+
+    def _upsert(self, ids: List[str], vectors: np.ndarray, payloads: List[Dict]):
+        rows = []
+        new_rows: Dict[str, int] = {}
+        for pid in ids:
+            pid = str(pid)
+            row = self._row_of.get(pid)
+            if row is None:
+                row = new_rows.setdefault(pid, self.size + len(new_rows))
+            rows.append(row)
+        appended = len(new_rows)
+
+        self._grow(self.size + appended)
+        self.ids.extend([None] * appended)
+        self.payloads.extend([None] * appended)
+        self.alive = np.concatenate([self.alive, np.zeros(appended, dtype=bool)])
+        self.size += appended
+
+        self.matrix[rows] = vectors
+        for row, pid, payload in zip(rows, ids, payloads):
+            self.ids[row] = str(pid)
+            self.payloads[row] = payload
+            self._row_of[str(pid)] = row
+        self.alive[rows] = True
+
+        self._ivf = None
+        self._field_index = None
+        self._quantizer = None
+        self._save(sorted(set(rows)))
+
+    def search(self, vector: List[float], top_k: int, filters: Dict = None) -> List[Tuple[float, Dict, str]]:
+        if not self.size:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        allowed = self._allowed_mask(filter_values(filters))
+        if allowed is not None and allowed.sum() < self.ann_threshold:
+            # Selective filter: an exact scan of the matching rows beats probing the IVF lists
+            rows = np.flatnonzero(allowed)
+            scores = self._score(query, rows)
+        else:
+            candidates = self._ann_candidates(query) if self.size >= self.ann_threshold else None
+            if candidates is None:
+                scores = self._score(query)
+                scores[~(self.alive[:self.size] if allowed is None else allowed)] = -np.inf
+                rows = np.arange(self.size)
+            else:
+                rows = candidates[(self.alive if allowed is None else allowed)[candidates]]
+                scores = self._score(query, rows)
+
+        k = min(top_k, len(rows))
+        if k == 0:
+            return []
+        if self._quantizer is not None:
+            # Approximate scores pick the candidates; exact float32 scores rank them
+            pool = min(len(rows), max(k, int(k * self.oversampling)))
+            top = np.argpartition(-scores, pool - 1)[:pool]
+            top = top[np.isfinite(scores[top])]
+            scores = np.full(len(rows), -np.inf, dtype=np.float32)
+            scores[top] = self.matrix[rows[top]] @ query
+            top = top[np.argsort(-scores[top])][:k]
+        else:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.payloads[rows[i]], self.ids[rows[i]]) for i in top if np.isfinite(scores[i])]
+
+    def _score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        if self.quantization != "none" and self._quantizer is None:
+            self._build_quantizer()
+        if self._quantizer is not None:
+            return self._quantizer.scores(query, rows)
+        return self.matrix[:self.size] @ query if rows is None else self.matrix[rows] @ query
+
+    def _build_quantizer(self):
+        live = np.flatnonzero(self.alive[:self.size])
+        if not len(live):
+            return
+        quantizer = make_quantizer(self.quantization, int(os.getenv("LOCAL_PQ_SUBSPACES", 96)))
+        self._quantizer = quantizer.fit(self.matrix, live).encode(self.matrix, self.size)
+
+    def iter_payloads(self, filters: Dict = None) -> Iterator[Tuple[str, Dict]]:
+        allowed = self._allowed_mask(filter_values(filters))
+        for pid, row in self._row_of.items():
+            if allowed is None or allowed[row]:
+                yield pid, self.payloads[row]
+
+    def retrieve(self, point_ids: List[str]) -> Dict[str, Dict]:
+        return {str(pid): self.payloads[self._row_of[str(pid)]] for pid in point_ids if str(pid) in self._row_of}
+
+    def vectors(self, point_ids: List[str]) -> Dict[str, List[float]]:
+        return {str(pid): self.matrix[self._row_of[str(pid)]].tolist() for pid in point_ids if str(pid) in self._row_of}
+
+    def point_ids(self) -> set:
+        return set(self._row_of)
+
+    def delete_points(self, point_ids: List[str]):
+        with self._write_lock:
+            deleted = []
+            for pid in point_ids:
+                row = self._row_of.pop(str(pid), None)
+                if row is None:
+                    continue
+                deleted.append(row)
+                self.alive[row] = False
+                self.ids[row] = None
+                self.payloads[row] = None
+            self._ivf = None
+            self._field_index = None
+            self._quantizer = None
+            self._save(deleted)
+
+    def drop(self):
+        self.matrix = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    # -- payload filters ---------------------------------------------------
+
+    def _build_field_index(self):
+        index = {}
+        for field in INDEXED_PAYLOAD_FIELDS:
+            has_field = np.zeros(self.size, dtype=bool)
+            by_value: Dict[str, List[int]] = {}
+            for pid, row in self._row_of.items():
+                value = self.payloads[row].get(field)
+                if value not in (None, ""):
+                    has_field[row] = True
+                    by_value.setdefault(str(value), []).append(row)
+            index[field] = (has_field, {v: np.asarray(rows) for v, rows in by_value.items()})
+        self._field_index = index
+
+    def _allowed_mask(self, filters: Dict[str, List[str]]) -> Optional[np.ndarray]:
+        if not filters:
+            return None
+        if self._field_index is None:
+            self._build_field_index()
+        allowed = self.alive[:self.size].copy()
+        for field, values in filters.items():
+            has_field, by_value = self._field_index[field]
+            passes = ~has_field
+            for value in values:
+                if value in by_value:
+                    passes[by_value[value]] = True
+            allowed &= passes
+        return allowed
+
+    # -- approximate search ------------------------------------------------
+
+    def _build_ivf(self, iterations: int = 10):
+        rows = np.flatnonzero(self.alive[:self.size])
+        data = self.matrix[rows]
+        nlist = max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(rows), size=nlist, replace=False)].copy()
+
+        # Spherical k-means on a sample keeps the build cheap for large collections
+        sample = data[rng.choice(len(rows), size=min(len(rows), nlist * 64), replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assign = np.concatenate([
+            np.argmax(data[i:i + 65536] @ centroids.T, axis=1) for i in range(0, len(rows), 65536)
+        ])
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self._ivf = (centroids, rows[order], bounds)
+
+    def _ann_candidates(self, query: np.ndarray) -> np.ndarray:
+        if self._ivf is None:
+            self._build_ivf()
+        centroids, members, bounds = self._ivf
+        probes = np.argsort(-(centroids @ query))[:self.nprobe]
+        return np.concatenate([members[bounds[c]:bounds[c + 1]] for c in probes])
+
+
+def get_backend(collection_name: str, backend: str = None):
+    backend = (backend or os.getenv("VECTOR_BACKEND", "qdrant")).lower()
+    if backend == "qdrant":
+        return QdrantBackend(collection_name)
+    if backend == "local":
+        return LocalBackend(collection_name)
+    raise ValueError(f"Unknown vector backend: {backend}")
@@ -1,35 +1,265 @@
 # server/pipeline/vector_pipeline.py
 
+import os
+import re
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
 from server.agents.extraction_agent import ExtractionAgent
 from server.agents.chunking_agent import ChunkingAgent
 from server.agents.embedding_agent import EmbeddingAgent
 from server.agents.vectorstore_agent import VectorStoreAgent
+from server.utils.checkpoint import RunCheckpoint
+from server.utils.embedding_matrix import EmbeddingMatrix
+from server.utils import telemetry
+
+logger = telemetry.get_logger("VectorPipeline")
 
 class VectorPipeline:
-    def __init__(self, kb_path: str, fi_path: str):
+    def __init__(self, kb_path: str, fi_path: str, async_embedding: bool = None,
+                 incremental: bool = None, collection_name: str = None, checkpoint: RunCheckpoint = None,
+                 loop: asyncio.AbstractEventLoop = None):
         self.kb_path = kb_path
         self.fi_path = fi_path
+        self.async_embedding = async_embedding
+        self.failed_batches = []
+        self.missing_points = []
+
+        # Incremental mode syncs one long-lived collection instead of creating a session one
+        if incremental is None:
+            incremental = os.getenv("VECTOR_INCREMENTAL", "0") == "1"
+        self.incremental = incremental
+        self.collection_name = collection_name
+        # Resumable runs persist chunks, embeddings and the collection name per stage
+        self.checkpoint = checkpoint
+        # Event loop for async embedding; a warm worker passes its own so the pooled client is reused
+        self.loop = loop
+
+    def _stable_collection_name(self) -> str:
+        base = os.getenv("QDRANT_COLLECTION", "dfmea_collection")
+        kb_name = re.sub(r"[^A-Za-z0-9_]+", "_", Path(str(self.kb_path or "default")).stem).strip("_").lower()
+        return f"{base}_{kb_name or 'default'}"
 
+    @telemetry.traced("vector_pipeline")
     def run(self):
-        print("[VectorPipeline] Starting vector ingestion pipeline...")
+        logger.info("Starting vector ingestion pipeline...")
+        checkpoint = self.checkpoint
+        if checkpoint and checkpoint.done("upsert"):
+            logger.info(f"Resuming run {checkpoint.run_id}: collection already loaded.")
+            return checkpoint.get("collection_name")
 
-        # Step 1: Extraction
-        extractor = ExtractionAgent(self.kb_path, self.fi_path)
-        kb_data = extractor.load_knowledge_bank()
-        fi_data = extractor.load_field_issues()
+        if checkpoint and checkpoint.done("chunking"):
+            chunks = checkpoint.load_chunks()
+            logger.info(f"Resuming run {checkpoint.run_id}: loaded {len(chunks)} chunks.")
+        else:
+            # Step 1: Extraction
+            extractor = ExtractionAgent(self.kb_path, self.fi_path)
+            kb_data = extractor.load_knowledge_bank()
+            fi_data = extractor.load_field_issues()
 
-        # Step 2: Chunking
-        chunker = ChunkingAgent()
-        chunks = chunker.run(kb_data, fi_data)
+            # Step 2: Chunking
+            chunker = ChunkingAgent()
+            chunks = chunker.run(kb_data, fi_data)
+            if checkpoint:
+                checkpoint.save_chunks(chunks)
+
+        if self.incremental:
+            collection_name = self._sync_collection(chunks)
+            if checkpoint and not self.failed_batches and not self.missing_points:
+                checkpoint.mark_done("upsert", collection_name=collection_name)
+            return collection_name
 
         # Step 3: Embedding
-        embedder = EmbeddingAgent()
-        embedded_chunks = embedder.embed_chunks_sync(chunks)
+        if checkpoint and checkpoint.done("embedding"):
+            embedded_chunks = checkpoint.load_embeddings()
+            logger.info(f"Resuming run {checkpoint.run_id}: loaded {len(embedded_chunks)} embeddings.")
+        else:
+            embedder = EmbeddingAgent(loop=self.loop)
+            embedded_chunks = embedder.embed_chunks(chunks, use_async=self.async_embedding)
+            self.failed_batches = embedder.failed_batches
+            # A partial matrix is not checkpointed; on resume the embedding cache makes the retry cheap
+            if checkpoint and not self.failed_batches:
+                checkpoint.save_embeddings(embedded_chunks)
 
         # Step 4: Store in Qdrant
-        vectorstore = VectorStoreAgent()
+        if checkpoint:
+            # The run owns its collection, so a resumed upsert only sends the missing points
+            collection_name = checkpoint.get("collection_name") or self.collection_name or \
+                f"{os.getenv('QDRANT_COLLECTION', 'dfmea_collection')}_{re.sub(r'[^A-Za-z0-9_]+', '_', checkpoint.run_id)}"
+            checkpoint.set(collection_name=collection_name)
+            vectorstore = VectorStoreAgent(collection_name=collection_name)
+            vectorstore.ensure_collection(len(embedded_chunks[0]["embedding"]))
+            existing = vectorstore.existing_point_ids()
+            todo = [i for i, chunk in enumerate(embedded_chunks.records) if VectorStoreAgent.point_id(chunk) not in existing]
+            if len(todo) < len(embedded_chunks):
+                logger.info(f"{len(embedded_chunks) - len(todo)} points already stored; uploading {len(todo)}.")
+            todo_chunks = EmbeddingMatrix(np.asarray(embedded_chunks.vectors[todo]), [embedded_chunks.records[i] for i in todo])
+            self.missing_points = vectorstore.add_embeddings(todo_chunks) if todo else []
+            vectorstore.sync_lexical_index()
+            if not self.missing_points and not self.failed_batches:
+                checkpoint.mark_done("upsert", collection_name=collection_name)
+            return vectorstore.collection_name
+
+        vectorstore = VectorStoreAgent(collection_name=self.collection_name)
         vector_dim = len(embedded_chunks[0]["embedding"])
         vectorstore.create_collection(vector_dim)
-        vectorstore.add_embeddings(embedded_chunks)
+        self.missing_points = vectorstore.add_embeddings(embedded_chunks)
+        vectorstore.sync_lexical_index()
+
+        return vectorstore.collection_name
+
+    def _sync_collection(self, chunks):
+        vectorstore = VectorStoreAgent(collection_name=self.collection_name or self._stable_collection_name())
+
+        # Step 3: Diff chunk IDs against what is already stored
+        desired = {}
+        for chunk in chunks:
+            desired.setdefault(VectorStoreAgent.point_id(chunk), chunk)
+        existing = vectorstore.existing_point_ids()
+
+        new_ids = [pid for pid in desired if pid not in existing]
+        stale_ids = [pid for pid in existing if pid not in desired]
+        logger.info(f"{len(desired)} chunks: {len(desired) - len(new_ids)} unchanged, "
+                    f"{len(new_ids)} new/changed, {len(stale_ids)} stale.")
+
+        # Step 4: Embed and upsert only new or changed chunks
+        if new_ids:
+            embedder = EmbeddingAgent(loop=self.loop)
+            embedded_chunks = embedder.embed_chunks([desired[pid] for pid in new_ids], use_async=self.async_embedding)
+            self.failed_batches = embedder.failed_batches
+            if embedded_chunks:
+                vectorstore.ensure_collection(len(embedded_chunks[0]["embedding"]))
+                self.missing_points = vectorstore.add_embeddings(embedded_chunks)
+
+        # Step 5: Drop rows that disappeared from the source files
+        if stale_ids:
+            vectorstore.delete_points(stale_ids)
+        vectorstore.sync_lexical_index()
+
+        return vectorstore.collection_name
+
+    @telemetry.traced("vector_pipeline")
+    def run_streaming(self, batch_size: int = None, queue_size: int = None):
+        """
+        Stream rows from disk through chunking, embedding and upsert.
+
+        Each stage runs in its own thread, connected by bounded queues, so peak
+        memory depends on batch_size * queue_size rather than on the input size
+        and the first points are upserted while the files are still being read.
+        """
+        logger.info("Starting streaming ingestion pipeline...")
+        batch_size = batch_size or int(os.getenv("STREAM_BATCH_SIZE", 500))
+        queue_size = queue_size or int(os.getenv("STREAM_QUEUE_SIZE", 4))
+
+        extractor = ExtractionAgent(self.kb_path, self.fi_path)
+        chunker = ChunkingAgent()
+        embedder = EmbeddingAgent()
+
+        if self.incremental:
+            vectorstore = VectorStoreAgent(collection_name=self.collection_name or self._stable_collection_name())
+            existing = vectorstore.existing_point_ids()
+        else:
+            vectorstore = VectorStoreAgent(collection_name=self.collection_name)
+            existing = set()
+        seen = set()
+
+        chunk_queue = queue.Queue(maxsize=queue_size)
+        embed_queue = queue.Queue(maxsize=queue_size)
+        errors = []
+
+        def read_and_chunk():
+            kb_rows = extractor.iter_knowledge_bank()
+            fi_rows = extractor.iter_field_issues()
+            for batch in chunker.stream(kb_rows, fi_rows, batch_size=batch_size):
+                # Incremental mode: skip chunks the collection already holds
+                fresh = []
+                for chunk in batch:
+                    pid = VectorStoreAgent.point_id(chunk)
+                    if pid in seen:
+                        continue
+                    seen.add(pid)
+                    if pid not in existing:
+                        fresh.append(chunk)
+                if fresh:
+                    chunk_queue.put(fresh)
+
+        def embed():
+            for batch in _drain(chunk_queue):
+                embedded = embedder.embed_batch(batch)
+                if embedded:
+                    embed_queue.put(embedded)
+
+        threads = [
+            threading.Thread(target=_run_stage, args=(read_and_chunk, chunk_queue, errors), daemon=True),
+            threading.Thread(target=_run_stage, args=(embed, embed_queue, errors, chunk_queue), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        upserted = 0
+        collection_ready = False
+        # Parallel batch writers; at most two batches per writer are queued at once
+        workers = max(1, vectorstore.upsert_workers)
+        with ThreadPoolExecutor(max_workers=workers) as writers:
+            in_flight = deque()
+            for embedded in _drain(embed_queue):
+                if not collection_ready:
+                    vector_dim = len(embedded[0]["embedding"])
+                    if self.incremental:
+                        vectorstore.ensure_collection(vector_dim)
+                    else:
+                        vectorstore.create_collection(vector_dim)
+                    collection_ready = True
+                in_flight.append(writers.submit(vectorstore.add_embeddings, embedded))
+                if len(in_flight) >= 2 * workers:
+                    in_flight.popleft().result()
+                upserted += len(embedded)
+            for future in in_flight:
+                future.result()
+
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        self.failed_batches = embedder.failed_batches
+        self.missing_points = list(vectorstore.missing_points)
+        logger.info(f"Streamed {upserted - len(self.missing_points)} new points into '{vectorstore.collection_name}'.")
+        if self.missing_points:
+            logger.warning(f"{len(self.missing_points)} points failed to upload; see missing_points.")
+
+        if self.incremental:
+            stale_ids = [pid for pid in existing if pid not in seen]
+            if stale_ids:
+                vectorstore.delete_points(stale_ids)
+        vectorstore.sync_lexical_index()
 
         return vectorstore.collection_name
+
+
+_DONE = object()
+
+
+def _run_stage(target, out_queue: queue.Queue, errors: list, in_queue: queue.Queue = None):
+    try:
+        target()
+    except Exception as e:
+        errors.append(e)
+        # Keep consuming so the upstream stage is not left blocked on a full queue
+        if in_queue is not None:
+            for _ in _drain(in_queue):
+                pass
+    finally:
+        out_queue.put(_DONE)
+
+
+def _drain(in_queue: queue.Queue):
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        yield item
@@ -1,93 +1,273 @@
 import os
 import uuid
 import math
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from server.agents.vector_backends import get_backend, filter_values, INDEXED_PAYLOAD_FIELDS
+from server.utils.client_pool import get_embedding_client, get_query_cache
+from server.utils.lexical_index import LexicalIndex
+from server.utils.embedding_matrix import EmbeddingMatrix, to_vector
+from server.agents.embedding_agent import embedding_dimensions, embedding_request_options, cache_namespace
+from server.utils import telemetry
 
 load_dotenv()
 
+logger = telemetry.get_logger("VectorStoreAgent")
+
+# Azure OpenAI accepts at most this many inputs per embeddings request
+EMBEDDING_REQUEST_LIMIT = 2048
+
 class VectorStoreAgent:
-    def __init__(self, collection_name: str = None):
-        self.qdrant_url = os.getenv("QDRANT_ENDPOINT")
-        self.qdrant_api_key = os.getenv("QDRANT_API_KEY")
+    def __init__(self, collection_name: str = None, backend: str = None):
         self.base_collection = os.getenv("QDRANT_COLLECTION", "dfmea_collection")
         self.session_id = str(uuid.uuid4())[:8]
         self.collection_name = collection_name or f"{self.base_collection}_{self.session_id}"
-        self.client = QdrantClient(
-            url=self.qdrant_url,
-            api_key=self.qdrant_api_key,
-            prefer_grpc=False,  # Make HTTP-based async fallback smoother
-            https=True,
-            timeout=30,
-            verify=False
-        )
+
+        # VECTOR_BACKEND=qdrant (remote) or local (embedded memory-mapped index)
+        self.backend = get_backend(self.collection_name, backend)
         # Disable SSL verification for all requests
         self.ssl_verify = False
 
+        # RETRIEVAL_MODE=vector (default) is dense-only; hybrid opts in to fusing BM25 and
+        # vector rankings (RRF), at the cost of scrolling the collection once to build BM25
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "vector").lower()
+        self.hybrid_candidates = int(os.getenv("HYBRID_CANDIDATE_FACTOR", 3))
+        self.rrf_k = int(os.getenv("HYBRID_RRF_K", 60))
+        self.lexical_path = os.path.join(os.getenv("LEXICAL_INDEX_DIR", ".cache/lexical"), f"{self.collection_name}.pkl")
+        self._lexical = None
+        # Writes only mark the persisted index stale; sync_lexical_index() drops it once per ingest
+        self._lexical_stale = False
+        self._lexical_lock = threading.Lock()
+
+        # Queries must be embedded exactly like the stored chunks (same model and dimensions)
+        self.embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+        self.embedding_options = embedding_request_options(embedding_dimensions())
+        self.query_cache_namespace = cache_namespace(self.embedding_deployment, embedding_dimensions())
+
+        self.upsert_workers = int(os.getenv("UPSERT_WORKERS", 4))
+        self.upsert_attempts = int(os.getenv("UPSERT_MAX_ATTEMPTS", 4))
+        self.missing_points: List[str] = []
+
     def create_collection(self, vector_dim: int):
-        print(f"[VectorStoreAgent] Creating collection '{self.collection_name}'...")
-        self.client.recreate_collection(
-            collection_name=self.collection_name,
-            vectors_config=VectorParams(size=vector_dim, distance=Distance.COSINE)
-        )
-        print(f"[VectorStoreAgent] Created session collection: {self.collection_name}")
-
-    def add_embeddings(self, embedded_chunks: List[Dict], batch_limit: int = 500):
-        print(f"[VectorStoreAgent] Uploading {len(embedded_chunks)} vectors in batches...")
-
-        points = [
-            PointStruct(
-                id=idx,
-                vector=chunk["embedding"],
-                payload={**chunk.get("metadata", {}), "text": chunk["text"]}
-            )
-            for idx, chunk in enumerate(embedded_chunks)
-        ]
+        logger.info(f"Creating collection '{self.collection_name}'...")
+        self.backend.create(vector_dim, recreate=True)
+        self._invalidate_lexical()
+        self.sync_lexical_index()
+        logger.info(f"Created session collection: {self.collection_name}")
 
-        # Split into batches to avoid 32MB payload limits
-        num_batches = math.ceil(len(points) / batch_limit)
-        for i in range(num_batches):
-            batch = points[i * batch_limit : (i + 1) * batch_limit]
+    def collection_exists(self) -> bool:
+        return self.backend.exists()
+
+    def ensure_collection(self, vector_dim: int):
+        """Create the collection only if it does not exist yet (long-lived collections)."""
+        if self.collection_exists():
+            logger.info(f"Reusing collection '{self.collection_name}'.")
+            return
+        logger.info(f"Creating collection '{self.collection_name}'...")
+        self.backend.create(vector_dim, recreate=False)
+        self._invalidate_lexical()
+
+    @staticmethod
+    def point_id(chunk: Dict) -> str:
+        """Deterministic point ID derived from the chunk's source and content."""
+        metadata = chunk.get("metadata", {})
+        if metadata.get("point_id"):
+            return metadata["point_id"]
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{metadata.get('source', '')}\x1f{chunk['text']}"))
+
+    def existing_point_ids(self) -> set:
+        if not self.collection_exists():
+            return set()
+        return self.backend.point_ids()
+
+    def delete_points(self, point_ids: List[str], batch_limit: int = 1000):
+        logger.info(f"Deleting {len(point_ids)} stale points from '{self.collection_name}'...")
+        for i in range(0, len(point_ids), batch_limit):
+            self.backend.delete_points(point_ids[i:i + batch_limit])
+        self._invalidate_lexical()
+
+    @staticmethod
+    def _records(batch) -> List[Dict]:
+        return batch.records if isinstance(batch, EmbeddingMatrix) else batch
+
+    def _upsert_batch(self, number: int, batch: List[Dict]) -> List[str]:
+        """Upsert one batch with retries; returns the point IDs that could not be written."""
+        ids = [self.point_id(chunk) for chunk in self._records(batch)]
+        for attempt in range(1, self.upsert_attempts + 1):
+            start = time.perf_counter()
             try:
-                self.client.upsert(collection_name=self.collection_name, points=batch)
+                self.backend.upsert(
+                    ids=ids,
+                    vectors=batch.vectors if isinstance(batch, EmbeddingMatrix) else [chunk["embedding"] for chunk in batch],
+                    payloads=[{**chunk.get("metadata", {}), "text": chunk["text"]} for chunk in self._records(batch)]
+                )
+                telemetry.incr("vectorstore.points_upserted", len(batch))
+                return []
             except Exception as e:
-                print(f"[VectorStoreAgent] Batch {i+1} failed: {type(e).__name__}: {e}")
-        print("[VectorStoreAgent] Upload complete.")
-
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        print(f"[VectorStoreAgent] Searching for: '{query}' in '{self.collection_name}'")
-
-        embedding_client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION")
-        )
-        deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
-        response = embedding_client.embeddings.create(input=query, model=deployment)
-        query_vector = response.data[0].embedding
-
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=top_k,
-            with_payload=True
-        )
+                logger.warning(f"Batch {number} attempt {attempt}/{self.upsert_attempts} failed: {type(e).__name__}: {e}")
+                telemetry.incr("vectorstore.upsert_retries")
+                if attempt < self.upsert_attempts:
+                    time.sleep(min(30, 2 ** attempt) * (0.5 + random.random()))
+            finally:
+                telemetry.observe("vectorstore.upsert_latency", time.perf_counter() - start)
+        telemetry.incr("vectorstore.batch_failures")
+        return ids
+
+    def add_embeddings(self, embedded_chunks: List[Dict], batch_limit: int = 500) -> List[str]:
+        """
+        Upload chunks in batches through UPSERT_WORKERS parallel writers. Each
+        batch is retried; the IDs of points that still failed are returned and
+        kept in self.missing_points.
+        """
+        logger.info(f"Uploading {len(embedded_chunks)} vectors in batches...")
 
+        # Split into batches to avoid 32MB payload limits
+        num_batches = math.ceil(len(embedded_chunks) / batch_limit)
+        batches = [embedded_chunks[i * batch_limit:(i + 1) * batch_limit] for i in range(num_batches)]
+        missing = []
+        with telemetry.span("upsert", points=len(embedded_chunks), batches=num_batches, workers=self.upsert_workers):
+            if self.upsert_workers > 1 and num_batches > 1:
+                with ThreadPoolExecutor(max_workers=self.upsert_workers) as pool:
+                    for failed in pool.map(self._upsert_batch, range(1, num_batches + 1), batches):
+                        missing.extend(failed)
+            else:
+                for number, batch in enumerate(batches, 1):
+                    missing.extend(self._upsert_batch(number, batch))
+        self._invalidate_lexical()
+
+        self.missing_points.extend(missing)
+        if missing:
+            logger.warning(f"Upload incomplete: {len(missing)} of {len(embedded_chunks)} points missing from "
+                           f"'{self.collection_name}': {', '.join(missing[:20])}{' ...' if len(missing) > 20 else ''}")
+        else:
+            logger.info("Upload complete.")
+        return missing
+
+    def _invalidate_lexical(self):
+        with self._lexical_lock:
+            self._lexical = None
+            self._lexical_stale = True
+
+    def sync_lexical_index(self):
+        """Delete the persisted BM25 index if writes since the last sync made it stale; call once after an ingest."""
+        with self._lexical_lock:
+            if self._lexical_stale and os.path.exists(self.lexical_path):
+                os.remove(self.lexical_path)
+            self._lexical_stale = False
+
+    def _lexical_index(self) -> LexicalIndex:
+        """Load the persisted BM25 index, rebuilding it by scrolling the collection if it is missing or stale."""
+        with self._lexical_lock:
+            if self._lexical is None:
+                index = None if self._lexical_stale else LexicalIndex.load(self.lexical_path)
+                if index is None or len(index) != self.backend.count():
+                    logger.info(f"Building lexical index for '{self.collection_name}'...")
+                    with telemetry.span("lexical_index_build") as span:
+                        index = LexicalIndex(INDEXED_PAYLOAD_FIELDS).build(self.backend.iter_payloads())
+                        index.save(self.lexical_path)
+                        span["documents"] = len(index)
+                    self._lexical_stale = False
+                self._lexical = index
+            return self._lexical
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query string, served from the LRU / on-disk query cache when possible."""
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str], use_cache: bool = True) -> List[List[float]]:
+        """
+        Embed several texts, sending the cache misses in as few requests as the
+        API's per-request input limit allows. use_cache=False skips the query
+        cache entirely, for one-off texts that would only evict real queries.
+        """
+        cache = get_query_cache() if use_cache else None
+        vectors = cache.get_many(queries, self.query_cache_namespace) if cache is not None else [None] * len(queries)
+        missing = list(dict.fromkeys(q for q, v in zip(queries, vectors) if v is None))
+        if cache is not None:
+            telemetry.incr("query_embedding.cache_hits", len(queries) - len(missing))
+            telemetry.incr("query_embedding.cache_misses", len(missing))
+        if missing:
+            fresh = {}
+            for i in range(0, len(missing), EMBEDDING_REQUEST_LIMIT):
+                batch = missing[i:i + EMBEDDING_REQUEST_LIMIT]
+                start = time.perf_counter()
+                response = get_embedding_client().embeddings.create(
+                    input=batch, model=self.embedding_deployment, **self.embedding_options
+                )
+                telemetry.observe("embedding.api_latency", time.perf_counter() - start)
+                fresh.update({batch[item.index]: to_vector(item.embedding).tolist() for item in response.data})
+            if cache is not None:
+                cache.put_many(list(fresh), list(fresh.values()), self.query_cache_namespace)
+            vectors = [v if v is not None else fresh[q] for q, v in zip(queries, vectors)]
+        return vectors
+
+    def _hybrid_search(self, query: str, query_vector: List[float], top_k: int, filters: Dict):
+        # Reciprocal rank fusion: rank-based, so BM25 and cosine scores need no calibration
+        pool = top_k * max(self.hybrid_candidates, 1)
+        dense = self.backend.search(query_vector, pool, filters)
+        lexical = self._lexical_index().search(query, pool, filter_values(filters))
+
+        fused, payloads = {}, {}
+        for rank, (_, payload, pid) in enumerate(dense):
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            payloads[pid] = payload
+        for rank, (pid, _) in enumerate(lexical):
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        missing = [pid for pid in ranked if pid not in payloads]
+        if missing:
+            payloads.update(self.backend.retrieve(missing))
+        telemetry.incr("retrieval.lexical_only_hits", len(missing))
+        return [(fused[pid], payloads[pid], pid) for pid in ranked if pid in payloads]
+
+    def search(self, query: str, top_k: int = 5, filters: Dict = None, mode: str = None,
+               with_vectors: bool = False, query_vector: List[float] = None) -> List[Dict]:
+        """
+        Retrieve the top_k chunks for query. filters maps indexed payload
+        fields (source, product, subsystem, fault_code) to a value or list of
+        values and is applied inside the index; chunks without the field pass.
+        with_vectors adds each match's stored vector as "embedding"; a
+        precomputed query_vector skips the query embedding.
+        """
+        mode = (mode or self.retrieval_mode).lower()
+        logger.info(f"Searching for: '{query}' in '{self.collection_name}' ({mode}, filters={filters or {}})")
+
+        with telemetry.span("retrieval", top_k=top_k, mode=mode) as span:
+            query_vector = query_vector or self.embed_query(query)
+            start = time.perf_counter()
+            if mode == "hybrid":
+                results = self._hybrid_search(query, query_vector, top_k, filters)
+            elif mode == "vector":
+                results = self.backend.search(query_vector, top_k, filters)
+            else:
+                raise ValueError(f"Unknown retrieval mode: {mode}")
+            telemetry.observe("vectorstore.search_latency", time.perf_counter() - start)
+            span["matches"] = len(results)
+
+        vectors = self.backend.vectors([pid for _, _, pid in results]) if with_vectors and results else {}
         output = []
-        for hit in results:
-            output.append({
-                "score": hit.score,
-                "text": hit.payload.get("text", ""),
-                "metadata": hit.payload
-            })
-
-        print(f"[VectorStoreAgent] Found {len(output)} matches.")
+        for score, payload, pid in results:
+            match = {
+                "id": pid,
+                "score": score,
+                "text": payload.get("text", ""),
+                "metadata": payload
+            }
+            if with_vectors:
+                match["embedding"] = vectors.get(pid)
+            output.append(match)
+
+        logger.info(f"Found {len(output)} matches.")
         return output
 
     def delete_collection(self):
-        print(f"[VectorStoreAgent] Dropping collection '{self.collection_name}'...")
-        self.client.delete_collection(self.collection_name)
-        print("[VectorStoreAgent] Collection deleted.")
+        logger.info(f"Dropping collection '{self.collection_name}'...")
+        self.backend.drop()
+        self._invalidate_lexical()
+        self.sync_lexical_index()
+        logger.info("Collection deleted.")
@@ -0,0 +1,236 @@
+# server/pipeline/worker.py
+
+import os
+import json
+import time
+import queue
+import socket
+import asyncio
+import importlib
+import threading
+import socketserver
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+from server.utils import telemetry
+
+logger = telemetry.get_logger("Worker")
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+JOB_OPS = ("ingest", "generate", "run")
+
+
+def parse_address(address: Optional[str] = None) -> Tuple[str, int]:
+    address = address or os.getenv("DFMEA_WORKER_ADDRESS", DEFAULT_ADDRESS)
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def send_job(job: Dict, address: Optional[str] = None, timeout: Optional[float] = None) -> Dict:
+    """Send one JSON job to a running worker and wait for its reply."""
+    with socket.create_connection(parse_address(address), timeout=timeout) as conn:
+        conn.sendall(json.dumps(job).encode("utf-8") + b"\n")
+        with conn.makefile("rb") as reply:
+            line = reply.readline()
+    if not line:
+        raise ConnectionError("Worker closed the connection without replying")
+    return json.loads(line)
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    # One newline-terminated JSON job per connection, answered with one JSON line
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            reply = {"ok": False, "error": f"Invalid job: {e}"}
+        else:
+            reply = self.server.worker.handle(job)
+        self.wfile.write(json.dumps(reply, default=str).encode("utf-8") + b"\n")
+
+
+class _JobServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class DFMEAWorker:
+    """
+    Long-lived DFMEA service. Tokenizer encoders, pooled OpenAI/Qdrant
+    clients, the caches, one event loop (so the async chat client and its
+    connections survive between jobs), the LLM scheduler and a ContextAgent
+    per collection (vector store handle, lexical index) stay warm, so a job
+    only pays for its own work.
+
+    Jobs are dicts with an "op" of ingest, generate or run. They are queued
+    and executed one at a time, either in-process via submit() or from
+    serve(), which accepts JSON lines on a localhost socket.
+    """
+
+    def __init__(self, address: Optional[str] = None):
+        self.address = parse_address(address)
+        self.jobs: "queue.Queue[Tuple[Optional[Dict], Optional[Future]]]" = queue.Queue()
+        self.loop = asyncio.new_event_loop()
+        self.scheduler = None
+        self._contexts: Dict[str, object] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[_JobServer] = None
+        self.started = time.time()
+        self.completed = 0
+
+    def warm(self):
+        """Import the pipeline and build every shared resource before the first job."""
+        with telemetry.span("worker_warmup") as span:
+            from server.utils import client_pool
+            from server.utils.tokenizer import get_encoder
+            from server.utils.llm_scheduler import LLMScheduler
+            # Import the pipeline modules now rather than on the first job
+            importlib.import_module("server.pipeline.vector_pipeline")
+            importlib.import_module("server.pipeline.dfmea_pipeline")
+
+            get_encoder("text-embedding-ada-002")
+            get_encoder("cl100k_base")
+            client_pool.get_embedding_client()
+            client_pool.get_embedding_cache()
+            client_pool.get_query_cache()
+            client_pool.get_response_cache()
+            if os.getenv("VECTOR_BACKEND", "qdrant").lower() == "qdrant":
+                client_pool.get_qdrant_client()
+            self.scheduler = LLMScheduler()
+
+            async def bind_async_clients():
+                client_pool.get_async_chat_client()
+                client_pool.get_async_embedding_client()
+
+            self.loop.run_until_complete(bind_async_clients())
+            span["seconds"] = round(time.time() - self.started, 3)
+        logger.info(f"Warm after {time.time() - self.started:.2f}s.")
+
+    # -- job execution -----------------------------------------------------
+
+    def _context(self, collection_name: str):
+        context = self._contexts.get(collection_name)
+        if context is None:
+            from server.agents.context_agent import ContextAgent
+            from server.agents.merge_agent import merge_enabled
+            context = ContextAgent(collection_name=collection_name, batch_size=5, scheduler=self.scheduler, loop=self.loop,
+                                   merge=merge_enabled())
+            self._contexts[collection_name] = context
+        return context
+
+    def _ingest(self, job: Dict, checkpoint) -> Dict:
+        from server.pipeline.vector_pipeline import VectorPipeline
+        pipeline = VectorPipeline(job.get("kb_path"), job.get("fi_path"), incremental=job.get("incremental"),
+                                  collection_name=job.get("collection"), checkpoint=checkpoint, loop=self.loop)
+        collection_name = pipeline.run()
+        # A warm context on this collection holds a lexical index that is now stale
+        self._contexts.pop(collection_name, None)
+        return {
+            "collection": collection_name,
+            "failed_embedding_batches": len(pipeline.failed_batches),
+            "missing_points": len(pipeline.missing_points)
+        }
+
+    def _generate(self, job: Dict, checkpoint) -> Dict:
+        from server.pipeline.dfmea_pipeline import DFMEAPipeline
+        if not job.get("collection"):
+            raise ValueError("generate needs a collection")
+        context = self._context(job["collection"])
+        pipeline = DFMEAPipeline(job["collection"], checkpoint=checkpoint, context=context)
+        top_k = job.get("top_k", 100)
+        if job.get("targets"):
+            output_path = pipeline.run_targets(job["targets"], top_k=top_k)
+        else:
+            kwargs = {"query": job["query"]} if job.get("query") else {}
+            output_path = pipeline.run(top_k=top_k, filters=job.get("filters"), **kwargs)
+        return {"output_path": output_path, "failed_llm_batches": len(context.failed_batches)}
+
+    def execute(self, job: Dict) -> Dict:
+        """Run one job on the calling thread and return its JSON-serialisable reply."""
+        op = job.get("op")
+        if op not in JOB_OPS:
+            return {"ok": False, "op": op, "error": f"Unknown job op: {op}"}
+        start = time.time()
+        try:
+            checkpoint = None
+            if job.get("run_id"):
+                from server.utils.checkpoint import RunCheckpoint
+                checkpoint = RunCheckpoint(job["run_id"])
+            result = {}
+            if op in ("ingest", "run"):
+                result.update(self._ingest(job, checkpoint))
+            if op in ("generate", "run"):
+                result.update(self._generate({**job, "collection": result.get("collection", job.get("collection"))}, checkpoint))
+            reply = {"ok": True, "op": op, **result}
+        except Exception as e:
+            logger.exception(f"Job '{op}' failed: {e}")
+            reply = {"ok": False, "op": op, "error": f"{type(e).__name__}: {e}"}
+        reply["seconds"] = round(time.time() - start, 3)
+        if job.get("run_id"):
+            reply["run_id"] = job["run_id"]
+        telemetry.observe("worker.job_seconds", reply["seconds"])
+        self.completed += 1
+        return reply
+
+    # -- queue -------------------------------------------------------------
+
+    def _work(self):
+        asyncio.set_event_loop(self.loop)
+        self.warm()
+        while True:
+            job, future = self.jobs.get()
+            if job is None:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_result(self.execute(job))
+        self.loop.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="dfmea-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, job: Dict) -> Future:
+        """Queue a job; the returned future resolves to its reply."""
+        future = Future()
+        self.jobs.put((job, future))
+        self.start()
+        return future
+
+    def stop(self, wait: bool = True):
+        if self._thread is not None:
+            self.jobs.put((None, None))
+            if wait:
+                self._thread.join()
+            self._thread = None
+
+    # -- socket ------------------------------------------------------------
+
+    def handle(self, job: Dict) -> Dict:
+        op = job.get("op")
+        if op == "ping":
+            return {"ok": True, "op": op, "queued": self.jobs.qsize(), "completed": self.completed,
+                    "uptime": round(time.time() - self.started, 1)}
+        if op == "shutdown":
+            # shutdown() blocks until serve_forever returns, so it cannot run on this handler's stack
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+            return {"ok": True, "op": op}
+        return self.submit(job).result()
+
+    def serve(self):
+        """Warm up, then accept jobs on the socket until a shutdown job or Ctrl+C."""
+        self.start()
+        self._server = _JobServer(self.address, _JobHandler)
+        self._server.worker = self
+        logger.info(f"Accepting DFMEA jobs on {self.address[0]}:{self.address[1]}")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+            self.stop()
+            logger.info(f"Stopped after {self.completed} jobs.")
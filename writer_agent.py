@@ -1,80 +1,199 @@
 # server/agents/writer_agent.py
 
 import os
+import csv
 import json
-import pandas as pd
-from typing import List, Dict
+import textwrap
+from typing import TYPE_CHECKING, List, Dict, Iterable, Iterator, Tuple
+from server.utils import telemetry
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+logger = telemetry.get_logger("WriterAgent")
+
+COLUMNS = [
+    "ID", "Product", "Subsystem", "Component", "Function", "Failure Mode", "Effect", "Severity",
+    "Cause", "Occurrence", "Detection", "Controls Prevention", "Controls Detection",
+    "Recommended Actions", "RPN", "Exists in DFMEA KB", "Matched KB ID"
+]
 
 class WriterAgent:
-    def __init__(self, output_path: str = "output/dfmea_output.xlsx", json_dump_path: str = "output/raw_dfmea_output.json"):
+    def __init__(self, output_path: str = "output/dfmea_output.xlsx", json_dump_path: str = "output/raw_dfmea_output.json",
+                 formats: Iterable[str] = None, row_group_size: int = 50_000):
         self.output_path = output_path
         self.json_dump_path = json_dump_path
+        self.formats = tuple(formats or os.getenv("DFMEA_OUTPUT_FORMATS", "xlsx").split(","))
+        self.row_group_size = row_group_size
 
-    def _flatten_dfmea(self, dfmea_json: List[Dict]) -> pd.DataFrame:
+    def _iter_rows(self, dfmea_json: List[Dict]) -> Iterator[Tuple]:
         """
-        Flatten the hierarchical DFMEA JSON into tabular structure.
+        Yield one tuple per (effect × cause) row in COLUMNS order, without
+        building an intermediate dict per row.
         """
-        rows = []
         unique_id = 1
-
         for entry in dfmea_json:
             product = entry.get("Product", "Unknown Product")
-            subsystems = entry.get("Subsystems", [])
-
-            for sub in subsystems:
+            for sub in entry.get("Subsystems", []):
                 subsystem = sub.get("Subsystem", "")
-                components = sub.get("Components", [])
-
-                for comp in components:
+                for comp in sub.get("Components", []):
                     component = comp.get("Component", "")
                     function = comp.get("Function", "")
-                    failure_modes = comp.get("FailureModes", [])
-
-                    for fm in failure_modes:
+                    for fm in comp.get("FailureModes", []):
                         failure_mode = fm.get("FailureMode", "")
-                        effects = fm.get("Effects", [])
-                        causes = fm.get("Causes", [])
-
-                        for effect in effects:
-                            effect_text = effect.get("Effect", "")
-                            severity = effect.get("Severity", "")
-
+                        causes = [
+                            (
+                                cause.get("Cause", ""),
+                                cause.get("Occurrence", ""),
+                                cause.get("Detection", ""),
+                                ", ".join(cause.get("Controls Prevention", [])),
+                                ", ".join(cause.get("Controls Detection", [])),
+                                ", ".join(cause.get("Recommended Actions", [])),
+                                cause.get("RPN", ""),
+                                cause.get("linked_to_dfmea_kb", False),
+                                cause.get("matched_kb_id", "")
+                            )
+                            for cause in fm.get("Causes", [])
+                        ]
+                        for effect in fm.get("Effects", []):
+                            head = (product, subsystem, component, function, failure_mode,
+                                    effect.get("Effect", ""), effect.get("Severity", ""))
                             for cause in causes:
-                                row = {
-                                    "ID": unique_id,
-                                    "Product": product,
-                                    "Subsystem": subsystem,
-                                    "Component": component,
-                                    "Function": function,
-                                    "Failure Mode": failure_mode,
-                                    "Effect": effect_text,
-                                    "Severity": severity,
-                                    "Cause": cause.get("Cause", ""),
-                                    "Occurrence": cause.get("Occurrence", ""),
-                                    "Detection": cause.get("Detection", ""),
-                                    "Controls Prevention": ", ".join(cause.get("Controls Prevention", [])),
-                                    "Controls Detection": ", ".join(cause.get("Controls Detection", [])),
-                                    "Recommended Actions": ", ".join(cause.get("Recommended Actions", [])),
-                                    "RPN": cause.get("RPN", ""),
-                                    "Exists in DFMEA KB": cause.get("linked_to_dfmea_kb", False)
-                                }
-                                rows.append(row)
+                                yield (unique_id,) + head + cause
                                 unique_id += 1
 
-        return pd.DataFrame(rows)
+    def _flatten_columns(self, dfmea_json: List[Dict]) -> Dict[str, list]:
+        columns = {name: [] for name in COLUMNS}
+        appenders = [columns[name].append for name in COLUMNS]
+        for row in self._iter_rows(dfmea_json):
+            for append, value in zip(appenders, row):
+                append(value)
+        return columns
+
+    def _flatten_dfmea(self, dfmea_json: List[Dict]) -> "DataFrame":
+        """
+        Flatten the hierarchical DFMEA JSON into tabular structure.
+        """
+        # pandas is only needed for this DataFrame view; the writers stream tuples
+        import pandas as pd
+        return pd.DataFrame(self._flatten_columns(dfmea_json), columns=COLUMNS)
+
+    @staticmethod
+    def _cell(value):
+        # Spreadsheet writers only accept scalars; the LLM occasionally nests lists
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return json.dumps(value)
+
+    def _path_for(self, fmt: str) -> str:
+        if fmt == "xlsx":
+            return self.output_path
+        return os.path.splitext(self.output_path)[0] + f".{fmt}"
+
+    def _write_json(self, dfmea_json: List[Dict]):
+        # Written entry by entry so the whole document never exists as one string;
+        # the bytes match json.dump(dfmea_json, f, indent=2)
+        with open(self.json_dump_path, "w") as f:
+            if not dfmea_json:
+                f.write("[]")
+                return
+            f.write("[\n")
+            for i, entry in enumerate(dfmea_json):
+                if i:
+                    f.write(",\n")
+                f.write(textwrap.indent(json.dumps(entry, indent=2), "  "))
+            f.write("\n]")
+
+    def _write_xlsx(self, rows: Iterator[Tuple], path: str) -> int:
+        count = 0
+        try:
+            import xlsxwriter
+        except ImportError:
+            from openpyxl import Workbook
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Sheet1")
+            sheet.append(COLUMNS)
+            for row in rows:
+                sheet.append([self._cell(v) for v in row])
+                count += 1
+            workbook.save(path)
+            return count
+
+        # constant_memory flushes each row to disk as soon as the next one starts
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        sheet = workbook.add_worksheet("Sheet1")
+        sheet.write_row(0, 0, COLUMNS)
+        for count, row in enumerate(rows, 1):
+            sheet.write_row(count, 0, [self._cell(v) for v in row])
+        workbook.close()
+        return count
 
+    def _write_csv(self, rows: Iterator[Tuple], path: str) -> int:
+        count = 0
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        return count
+
+    def _write_parquet(self, rows: Iterator[Tuple], path: str) -> int:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)") from e
+
+        # LLM output mixes ints and "" in numeric fields, so everything but ID/KB flag is text
+        schema = pa.schema([
+            (name, pa.int64() if name == "ID" else pa.bool_() if name == "Exists in DFMEA KB" else pa.string())
+            for name in COLUMNS
+        ])
+
+        def to_table(buffer):
+            columns = list(zip(*buffer)) if buffer else [[] for _ in COLUMNS]
+            arrays = []
+            for field, col in zip(schema, columns):
+                if field.name == "ID":
+                    arrays.append(pa.array(col, pa.int64()))
+                elif field.name == "Exists in DFMEA KB":
+                    arrays.append(pa.array([bool(v) for v in col], pa.bool_()))
+                else:
+                    arrays.append(pa.array([None if v in ("", None) else str(v) for v in col], pa.string()))
+            return pa.Table.from_arrays(arrays, schema=schema)
+
+        count = 0
+        buffer = []
+        with pq.ParquetWriter(path, schema) as writer:
+            for row in rows:
+                buffer.append(row)
+                count += 1
+                if len(buffer) >= self.row_group_size:
+                    writer.write_table(to_table(buffer))
+                    buffer = []
+            if buffer or not count:
+                writer.write_table(to_table(buffer))
+        return count
+
+    @telemetry.traced("writing")
     def run(self, dfmea_json: List[Dict]) -> str:
-        print(f"[WriterAgent] Writing DFMEA output to: {self.output_path}")
+        logger.info(f"Writing DFMEA output to: {self.output_path}")
 
         # Save raw JSON for debugging
         os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
-        with open(self.json_dump_path, "w") as f:
-            json.dump(dfmea_json, f, indent=2)
-        print(f"[WriterAgent] Raw DFMEA JSON dumped to: {self.json_dump_path}")
+        self._write_json(dfmea_json)
+        logger.info(f"Raw DFMEA JSON dumped to: {self.json_dump_path}")
 
-        # Flatten and write Excel
-        df = self._flatten_dfmea(dfmea_json)
-        df.to_excel(self.output_path, index=False)
-        print(f"[WriterAgent] Excel file saved with {len(df)} rows.\n")
+        writers = {"xlsx": self._write_xlsx, "csv": self._write_csv, "parquet": self._write_parquet}
+        paths = []
+        for fmt in (f.strip().lower() for f in self.formats if f.strip()):
+            if fmt not in writers:
+                raise ValueError(f"Unsupported output format: {fmt}")
+            path = self._path_for(fmt)
+            count = writers[fmt](self._iter_rows(dfmea_json), path)
+            paths.append(path)
+            telemetry.incr(f"writer.{fmt}_rows", count)
+            logger.info(f"{fmt.upper()} file saved with {count} rows: {path}")
 
-        return self.output_path
+        return self.output_path if self.output_path in paths else (paths[0] if paths else self.json_dump_path)